@@ -1 +1,2 @@
-from .motion_analysis import analyze_jump
\ No newline at end of file
+from .motion_analysis import analyze_jump
+from .online import JumpEvent, OnlineJumpDetector, detect_jumps_online
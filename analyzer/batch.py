@@ -0,0 +1,112 @@
+import numpy as np
+
+from utils.calculations import find_parabolic_curve
+
+
+def pack_trajectories(keypoints_data, ids, keypoint_index, axis=1):
+    """
+    The function `pack_trajectories` packs one keypoint coordinate of several tracks into a single
+    padded array. Row `i` holds the trajectory of `ids[i]` left aligned, the padding is NaN.
+
+    :param keypoints_data: A dictionary mapping the ids to their `KeypointTrack`
+    :param ids: The ids to pack, in row order
+    :param keypoint_index: The index of the keypoint, e.g. 11 for the left hip
+    :param axis: 0 for the x coordinate, 1 for the y coordinate, defaults to 1 (optional)
+    :return: the padded (tracks x frames) float64 array and the length of each trajectory.
+    """
+    lengths = np.asarray([len(keypoints_data[id]) for id in ids], dtype=np.int64)
+    signals = np.full((len(ids), int(lengths.max(initial=0))), np.nan)
+    for row, id in enumerate(ids):
+        signals[row, :lengths[row]] = keypoints_data[id].keypoints[:, keypoint_index, axis]
+    return signals, lengths
+
+
+def _fallback(signal, window_size, threshold, prominence):
+    result = find_parabolic_curve(signal, window_size=window_size, threshold=threshold,
+                                  find_minimum_peak=True, prominence=prominence)
+    if not isinstance(result, tuple) or result[0] is None:
+        return -1, -1
+    return result
+
+
+def find_parabolic_curves_batch(signals, lengths, window_size=20, threshold=1, prominence=30):
+    """
+    Batched version of `find_parabolic_curve` for concave-up curves (valleys of the signal).
+
+    The most prominent valley of a row is its global minimum whenever that minimum is a strict local
+    minimum with enough prominence, and the prominence of the global minimum only depends on the
+    running maxima on both sides of it. This is checked for all rows at once; the few rows where it
+    does not hold (edge or plateau minimum, or a global minimum that is not prominent enough) are
+    passed to `find_parabolic_curve`. The quadratic window fits are solved together as a stack of
+    3x3 normal equations.
+
+    Parameters:
+    signals (numpy array): (tracks x frames) array, padded with NaN after each trajectory.
+    lengths (numpy array): The number of valid samples in each row.
+    window_size (int): The size of the window around the valley for curve fitting.
+    threshold (float): The threshold for deviation from the fitted curve to determine the bounds.
+    prominence (float): The required prominence of the valley.
+
+    Returns:
+    tuple: Arrays with the start and end points of the parabolic curve of each row, -1 where no curve
+    was found.
+    """
+    n_rows, n_cols = signals.shape
+    starts = np.full(n_rows, -1, dtype=np.int64)
+    ends = np.full(n_rows, -1, dtype=np.int64)
+    if n_rows == 0 or n_cols < 3:
+        return starts, ends
+
+    rows = np.arange(n_rows)
+    cols = np.arange(n_cols)
+    valid = cols[None, :] < lengths[:, None]
+    low = np.where(valid, signals, np.inf)
+    high = np.where(valid, signals, -np.inf)
+
+    target = np.argmin(low, axis=1)
+    value = low[rows, target]
+    interior = (target >= 1) & (target <= lengths - 2) & (lengths >= 3)
+    next_value = low[rows, np.minimum(target + 1, n_cols - 1)]
+    strict = interior & (next_value > value)
+
+    # Highest sample on each side of the valley, the prominence is measured from the lower of the two.
+    left_max = np.where(cols[None, :] < target[:, None], high, -np.inf).max(axis=1)
+    right_max = np.where(cols[None, :] > target[:, None], high, -np.inf).max(axis=1)
+    fast = strict & (np.minimum(left_max, right_max) - value >= prominence)
+
+    # Rows with too few samples or no vertical movement cannot hold a prominent valley.
+    span = high.max(axis=1) - low.min(axis=1)
+    slow = ~fast & (lengths >= 3) & (span >= prominence)
+    for row in np.flatnonzero(slow):
+        starts[row], ends[row] = _fallback(signals[row, :lengths[row]], window_size, threshold, prominence)
+
+    fast_rows = np.flatnonzero(fast)
+    if len(fast_rows) == 0:
+        return starts, ends
+
+    peak = target[fast_rows]
+    length = lengths[fast_rows]
+    window_start = np.maximum(peak - window_size, 0)
+    window_end = np.minimum(peak + window_size, length)
+    offsets = np.arange(2 * window_size)
+    index = window_start[:, None] + offsets[None, :]
+    in_window = index < window_end[:, None]
+    y = signals[fast_rows[:, None], np.minimum(index, n_cols - 1)]
+    y = np.where(in_window, y, 0.0)
+
+    # Least squares parabola in coordinates centred on the valley, solved for all rows at once.
+    u = np.where(in_window, index - peak[:, None], 0).astype(np.float64)
+    w = in_window.astype(np.float64)
+    powers = [(w * u ** k).sum(axis=1) for k in range(5)]
+    gram = np.stack([np.stack(powers[i:i + 3], axis=1) for i in range(3)], axis=1)
+    moments = np.stack([(w * u ** k * y).sum(axis=1) for k in range(3)], axis=1)
+    coefficients = np.linalg.solve(gram, moments[:, :, None])[:, :, 0]
+    fitted = coefficients[:, :1] + coefficients[:, 1:2] * u + coefficients[:, 2:] * u ** 2
+
+    over = (np.abs(fitted - y) > threshold) & in_window
+    any_over = over.any(axis=1)
+    first = np.argmax(over, axis=1)
+    last = over.shape[1] - 1 - np.argmax(over[:, ::-1], axis=1)
+    starts[fast_rows] = np.where(any_over, first + window_start, window_start)
+    ends[fast_rows] = np.where(any_over, last + window_start, window_end)
+    return starts, ends
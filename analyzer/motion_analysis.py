@@ -1,20 +1,36 @@
 from utils.calculations import calculate_jump_height, calculate_launch_velocity, find_parabolic_curve
 import numpy as np
+from keypoints.track import as_tracks
+from utils import profiling
+from utils.segmentation import find_parabolic_curves, segment_jump
+from .batch import find_parabolic_curves_batch, pack_trajectories
 
 LEFT_HIP_INDEX = 11
 RIGHT_HIP_INDEX = 12
 LEFT_ANKLE_INDEX = 15
 RIGHT_ANKLE_INDEX = 16
 
+# Parabola search on the left hip trajectory and the frame corrections applied to its result
+WINDOW_SIZE = 10
+THRESHOLD = 0.5
+PEAK_PROMINENCE = 30
+LAUNCH_FRAME_OFFSET = 3
+LANDING_FRAME_OFFSET = 1
+
+# Shortest and longest flights, in seconds, searched by the multi-jump segmentations
+MIN_AIR_TIME = 0.2
+MAX_AIR_TIME = 1.0
+SEGMENTATIONS = ("peak", "rolling", "piecewise")
+JUMP_KEYS = ("launch_frame", "landing_frame", "jump_height", "launch_velocity")
+
 
 def get_limb_keypoint_trajectories(keypoints_data, id, LEFT_LIMB_INDEX=11, RIGHT_LIMB_INDEX=12):
     """
     The function `get_limb_keypoint_trajectories` extracts x and y coordinates for both left and right
     hips from a given keypoints data.
 
-    :param keypoints_data: The `keypoints_data` parameter is a dictionary that contains the keypoints
-    data for different frames and different individuals. The keys of the dictionary represent the
-    individual IDs, and the values are dictionaries that contain the keypoints data for each frame
+    :param keypoints_data: The `keypoints_data` parameter is a dictionary that maps the individual IDs
+    to their `KeypointTrack`. Nested dictionaries of keypoints data per frame are converted first
     :param id: The `id` parameter is used to specify the ID of the person for whom we want to extract
     the limb keypoints trajectories
     :param LEFT_LIMB_INDEX: The LEFT_LIMB_INDEX parameter is the index of the left hip in the keypoints
@@ -23,29 +39,138 @@ def get_limb_keypoint_trajectories(keypoints_data, id, LEFT_LIMB_INDEX=11, RIGHT
     :param RIGHT_LIMB_INDEX: The `RIGHT_LIMB_INDEX` parameter is the index of the right hip in the
     keypoints list. It is used to extract the x and y coordinates of the right hip from the keypoints
     data, defaults to 12 (optional)
-    :return: five lists: x_coords_left_hip, y_coords_left_hip, x_coords_right_hip, y_coords_right_hip,
-    and time_steps.
+    :return: five arrays: x_coords_left_hip, y_coords_left_hip, x_coords_right_hip, y_coords_right_hip,
+    and time_steps. The coordinates are views of the track arrays, no data is copied.
+    """
+
+    track = as_tracks(keypoints_data)[int(id)]
+    left_hip = track.joint(LEFT_LIMB_INDEX)
+    right_hip = track.joint(RIGHT_LIMB_INDEX)
+    return left_hip[:, 0], left_hip[:, 1], right_hip[:, 0], right_hip[:, 1], track.frames
+
+
+def jump_entry(best_launch_frame, best_landing_frame, fps=30, offsets=(LAUNCH_FRAME_OFFSET, LANDING_FRAME_OFFSET)):
+    """
+    The function `jump_entry` builds the `jump_data` entry of one player from the start and end of
+    the parabolic curve found in the hip trajectory, applying the launch and landing frame offsets.
+
+    :param best_launch_frame: Start of the parabolic curve, or None if no curve was found
+    :param best_landing_frame: End of the parabolic curve, or None if no curve was found
+    :param fps: The frame rate of the video, defaults to 30 (optional)
+    :param offsets: The launch and landing frame offsets, defaults to the ones calibrated for
+    `find_parabolic_curve` (optional)
+    :return: a dictionary with the jumping flag, launch frame, landing frame, jump height and launch
+    velocity.
+    """
+    jump_height = 0
+    launch_velocity = 0
+    if best_launch_frame and best_landing_frame:
+        best_launch_frame += offsets[0]
+        best_landing_frame += offsets[1]
+        jumping = True
+        total_air_time = best_landing_frame - best_launch_frame
+        total_air_time = total_air_time / fps
+        jump_height = calculate_jump_height(total_air_time)
+        launch_velocity = calculate_launch_velocity(total_air_time)
+    else:
+        jumping = False
+
+    return {
+        "jumping": jumping,
+        "launch_frame": best_launch_frame,
+        "landing_frame": best_landing_frame,
+        "jump_height": jump_height,
+        "launch_velocity": launch_velocity
+    }
+
+
+def with_jumps(entry, jumps=None):
+    """
+    Adds the list of all the jumps of a player to its `jump_data` entry. Without `jumps`, the entry
+    itself is the only jump, if it is one.
     """
+    if jumps is None:
+        jumps = [dict({key: entry[key] for key in JUMP_KEYS}, residual=None)] if entry["jumping"] else []
+    entry["jumps"] = jumps
+    return entry
+
+
+def print_jump_entry(id, entry):
+    if entry["jumping"]:
+        print(f"For player ID {id}: Launch frame: {entry['launch_frame']}, Landing frame: {entry['landing_frame']}, Jumping: {entry['jumping']}, Jump height: {entry['jump_height']}, Launch velocity: {entry['launch_velocity']}")
+        jumps = entry.get("jumps", [])
+        if len(jumps) > 1:
+            for i, jump in enumerate(jumps, 1):
+                print(f"    Jump {i}: Launch frame: {jump['launch_frame']}, Landing frame: {jump['landing_frame']}, Jump height: {jump['jump_height']}")
+    else:
+        print(f"For player ID {id}: Not jumping")
+
+
+def find_jumps(track, fps=30, prominence=PEAK_PROMINENCE, keypoint_index=LEFT_HIP_INDEX):
+    """
+    The function `find_jumps` finds all the jumps of one player with `find_parabolic_curves`: every
+    flight of the hip trajectory that is well fitted by a parabola, not only the most prominent one.
+
+    :param track: The `KeypointTrack` of the player
+    :param fps: The frame rate of the video, flights from `MIN_AIR_TIME` to `MAX_AIR_TIME` seconds
+    long are searched, defaults to 30 (optional)
+    :param prominence: The minimum depth of a flight in pixels, defaults to 30 (optional)
+    :param keypoint_index: The keypoint whose y coordinate is followed, defaults to the left hip
+    (optional)
+    :return: a list of jumps sorted by launch, each a dictionary with the launch frame, landing frame,
+    jump height, launch velocity and the root mean square residual of the parabola fit.
+    """
+    signal = np.asarray(track.keypoints[:, keypoint_index, 1], dtype=np.float64)
+    curves = find_parabolic_curves(signal, MIN_AIR_TIME * fps, MAX_AIR_TIME * fps + 1, prominence)
+    jumps = []
+    for start, end, rmse in curves:
+        # The section found is the flight itself, so its first and last frames need no offset
+        entry = jump_entry(int(track.frames[start]), int(track.frames[end]), fps, offsets=(0, 0))
+        jumps.append(dict({key: entry[key] for key in JUMP_KEYS}, residual=rmse))
+    return jumps
+
 
-    x_coords_left_hip = []
-    y_coords_left_hip = []
-    x_coords_right_hip = []
-    y_coords_right_hip = []
-    time_steps = sorted(keypoints_data[str(id)].keys(), key=int)
-
-    for frame in time_steps:
-        keypoints = keypoints_data[str(id)][frame]["keypoints"]
-        left_hip = [float(kp) for kp in keypoints[LEFT_LIMB_INDEX][:2]]
-        right_hip = [float(kp) for kp in keypoints[RIGHT_LIMB_INDEX][:2]]
-        x_coords_left_hip.append(left_hip[0])
-        y_coords_left_hip.append(left_hip[1])
-        x_coords_right_hip.append(right_hip[0])
-        y_coords_right_hip.append(right_hip[1])
-    time_steps = [int(time_step) for time_step in time_steps]
-    return x_coords_left_hip, y_coords_left_hip, x_coords_right_hip, y_coords_right_hip, time_steps
-
-
-def analyze_jump(keypoints_data, fps=30):
+def find_jump_piecewise(track, fps=30, prominence=PEAK_PROMINENCE, keypoint_index=LEFT_HIP_INDEX):
+    """
+    The function `find_jump_piecewise` finds the jump of one player with `segment_jump`, i.e. the
+    launch and landing that best split the hip trajectory into a line, a flight parabola and a line.
+
+    :param track: The `KeypointTrack` of the player
+    :param fps: The frame rate of the video, flights from `MIN_AIR_TIME` to `MAX_AIR_TIME` seconds
+    long are searched, defaults to 30 (optional)
+    :param prominence: The minimum depth of the flight in pixels, defaults to 30 (optional)
+    :param keypoint_index: The keypoint whose y coordinate is followed, defaults to the left hip
+    (optional)
+    :return: a list holding the jump, empty if there is none, in the format of `find_jumps`; the
+    residual is the root mean square residual of the whole three piece fit.
+    """
+    signal = np.asarray(track.keypoints[:, keypoint_index, 1], dtype=np.float64)
+    segment = segment_jump(signal, MIN_AIR_TIME * fps, MAX_AIR_TIME * fps + 1, prominence)
+    if segment is None:
+        return []
+    launch, landing, loss = segment
+    entry = jump_entry(int(track.frames[launch]), int(track.frames[landing]), fps, offsets=(0, 0))
+    return [dict({key: entry[key] for key in JUMP_KEYS}, residual=float(np.sqrt(loss / len(signal))))]
+
+
+def _analyze_jump_segmented(keypoints_data, fps, min_track_length, find_jumps_function):
+    jump_data = {}
+    for id in keypoints_data:
+        jumps = []
+        if len(keypoints_data[id]) >= min_track_length:
+            with profiling.stage("analysis.track"):
+                jumps = find_jumps_function(keypoints_data[id], fps)
+        if jumps:
+            # The top level fields describe the highest jump
+            highest = max(jumps, key=lambda jump: jump["jump_height"])
+            entry = dict(jumping=True, **{key: highest[key] for key in JUMP_KEYS})
+        else:
+            entry = jump_entry(None, None, fps)
+        jump_data[id] = with_jumps(entry, jumps)
+    return jump_data
+
+
+def analyze_jump(keypoints_data, fps=30, batch=False, min_track_length=0, verbose=True, segmentation="peak"):
     """
     The `analyze_jump` function takes in keypoints data of players' hip positions over time and
     calculates various jump-related metrics such as launch frame, landing frame, jump height, and launch
@@ -57,50 +182,84 @@ def analyze_jump(keypoints_data, fps=30):
     :param fps: The parameter `fps` stands for frames per second and represents the frame rate of the
     video or animation being analyzed. It is used to calculate the total air time of the jump and the
     launch velocity, defaults to 30 (optional)
+    :param batch: If True, the trajectories of all players are packed into one padded array and the
+    peak detection and parabola fits run vectorized over all of them, defaults to False (optional)
+    :param min_track_length: Players tracked in fewer frames are reported as not jumping without any
+    fitting. Players whose hip never moves more than the peak prominence are always skipped in batch
+    mode, since they cannot contain a jump, defaults to 0 (optional)
+    :param verbose: If True, prints the result of every player, defaults to True (optional)
+    :param segmentation: How the flights are found in the hip trajectory. "peak" fits a parabola
+    around the most prominent valley (`find_parabolic_curve`), so it finds one jump per player at
+    most. "rolling" scores every section of the trajectory with rolling parabola fits
+    (`find_jumps`) and finds all the jumps. "piecewise" finds one jump per player as the best split
+    of the trajectory into a line, a flight parabola and a line (`find_jump_piecewise`). `batch`
+    only applies to "peak". Defaults to "peak" (optional)
     :return: The function `analyze_jump` returns a dictionary `jump_data` which contains information
     about the jump analysis for each player ID. The keys of the dictionary are the player IDs, and the
-    values are dictionaries containing the following information:
+    values are dictionaries containing the following information: the jumping flag and the launch
+    frame, landing frame, jump height and launch velocity of the jump (the highest one with
+    "rolling"), and under "jumps" the list of all the jumps found, with the residual of their fit
+    where the segmentation provides one. With every segmentation, the launch and landing frames are
+    frame numbers of the video (counted from 1, like `KeypointTrack.frames`), not indices into the
+    track, so they hold for tracks that start late or miss frames.
     """
+    if segmentation not in SEGMENTATIONS:
+        raise ValueError(f"Unknown segmentation {segmentation!r}, expected one of {', '.join(SEGMENTATIONS)}")
+    keypoints_data = as_tracks(keypoints_data)
+    if batch or segmentation != "peak":
+        if segmentation == "rolling":
+            jump_data = _analyze_jump_segmented(keypoints_data, fps, min_track_length, find_jumps)
+        elif segmentation == "piecewise":
+            jump_data = _analyze_jump_segmented(keypoints_data, fps, min_track_length, find_jump_piecewise)
+        else:
+            with profiling.stage("analysis.batch"):
+                jump_data = _analyze_jump_batch(keypoints_data, fps, min_track_length)
+        if verbose:
+            for id, entry in jump_data.items():
+                print_jump_entry(id, entry)
+        return jump_data
+
     jump_data = {}
     for id in keypoints_data:
-        x_coords_left_hip, y_coords_left_hip, x_coords_right_hip, y_coords_right_hip, time_steps = get_limb_keypoint_trajectories(
-            keypoints_data, int(id))
-        y_coords_left_hip = np.array(y_coords_left_hip)
         best_launch_frame = None
         best_landing_frame = None
-        jump_height = 0
-        launch_velocity = 0
-        jumping = False
-        threshold = 0.5
-        window_size = 10
-        try:
-            best_launch_frame, best_landing_frame = find_parabolic_curve(
-                y_coords_left_hip, window_size=window_size, threshold=threshold, find_minimum_peak=True)
-        except Exception as e:
-            print(f"Error processing player ID {id}: {e}")
-            best_launch_frame = None
-            best_landing_frame = None
-
-        if best_launch_frame and best_landing_frame:
-            best_launch_frame += 3
-            best_landing_frame += 1
-            jumping = True
-            total_air_time = best_landing_frame - best_launch_frame
-            total_air_time = total_air_time / fps
-            jump_height = calculate_jump_height(total_air_time)
-            launch_velocity = calculate_launch_velocity(total_air_time)
-        else:
-            jumping = False
-
-        jump_data[id] = {
-            "jumping": jumping,
-            "launch_frame": best_launch_frame,
-            "landing_frame": best_landing_frame,
-            "jump_height": jump_height,
-            "launch_velocity": launch_velocity
-        }
-        if jumping:
-            print(f"For player ID {id}: Launch frame: {best_launch_frame}, Landing frame: {best_landing_frame}, Jumping: {jumping}, Jump height: {jump_height}, Launch velocity: {launch_velocity}")
-        else:
-            print(f"For player ID {id}: Not jumping")
+        if len(keypoints_data[id]) >= min_track_length:
+            with profiling.stage("analysis.track"):
+                x_coords_left_hip, y_coords_left_hip, x_coords_right_hip, y_coords_right_hip, time_steps = get_limb_keypoint_trajectories(
+                    keypoints_data, int(id))
+                y_coords_left_hip = np.array(y_coords_left_hip, dtype=np.float64)
+                try:
+                    best_launch_frame, best_landing_frame = find_parabolic_curve(
+                        y_coords_left_hip, window_size=WINDOW_SIZE, threshold=THRESHOLD, find_minimum_peak=True,
+                        prominence=PEAK_PROMINENCE)
+                except Exception as e:
+                    print(f"Error processing player ID {id}: {e}")
+                    best_launch_frame = None
+                    best_landing_frame = None
+
+        jump_data[id] = with_jumps(_peak_jump_entry(keypoints_data[id], best_launch_frame, best_landing_frame, fps))
+        if verbose:
+            print_jump_entry(id, jump_data[id])
     return jump_data
+
+
+def _analyze_jump_batch(keypoints_data, fps, min_track_length):
+    ids = [id for id in keypoints_data if len(keypoints_data[id]) >= min_track_length]
+    signals, lengths = pack_trajectories(keypoints_data, ids, LEFT_HIP_INDEX)
+    starts, ends = find_parabolic_curves_batch(signals, lengths, window_size=WINDOW_SIZE,
+                                               threshold=THRESHOLD, prominence=PEAK_PROMINENCE)
+    curves = {id: (start, end) for id, start, end in zip(ids, starts, ends) if start >= 0}
+    return {id: with_jumps(_peak_jump_entry(keypoints_data[id], *curves.get(id, (None, None)), fps))
+            for id in keypoints_data}
+
+
+def _peak_jump_entry(track, start, end, fps):
+    # The parabola search works on sample indices of the track and its offsets were calibrated on
+    # them, with sample i at frame i + 1. Sample i is mapped to its frame minus one, so the entry holds
+    # frames of the video and a track that starts at frame 1 keeps its launch and landing. The end is
+    # one past the last sample when no sample deviates from the parabola up to the end of the track.
+    if start is None or end is None:
+        return jump_entry(None, None, fps)
+    frames = track.frames
+    landing = int(frames[end]) - 1 if end < len(frames) else int(frames[-1])
+    return jump_entry(int(frames[start]) - 1, landing, fps)
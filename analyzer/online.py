@@ -0,0 +1,162 @@
+from collections import namedtuple
+
+import numpy as np
+
+from utils.calculations import peak_prominence
+from .motion_analysis import (LEFT_HIP_INDEX, PEAK_PROMINENCE, THRESHOLD, WINDOW_SIZE, jump_entry)
+
+JumpEvent = namedtuple("JumpEvent", ["track_id", "launch_frame", "landing_frame", "jump_height",
+                                     "launch_velocity", "detected_frame"])
+
+
+class _TrackBuffer:
+    """
+    Fixed size ring buffer with the latest hip samples of one track. `count` is the number of samples
+    ever appended, sample `k` lives at slot `k % capacity` while `k >= count - capacity`.
+    """
+
+    __slots__ = ("frames", "values", "count", "last_frame", "resume_at")
+
+    def __init__(self, capacity):
+        self.frames = np.zeros(capacity, dtype=np.int64)
+        self.values = np.zeros(capacity, dtype=np.float64)
+        self.count = 0
+        self.last_frame = 0
+        # First sample that may be the apex of a new jump, used to skip the rest of a detected jump.
+        self.resume_at = 0
+
+    def append(self, frame, value):
+        slot = self.count % len(self.values)
+        self.frames[slot] = frame
+        self.values[slot] = value
+        self.count += 1
+        self.last_frame = frame
+
+    def window(self, first, stop):
+        slots = np.arange(first, stop) % len(self.values)
+        return self.frames[slots], self.values[slots]
+
+
+class OnlineJumpDetector:
+    """
+    Incremental version of the jump analysis for keypoints that arrive frame by frame, e.g. from a
+    camera or from `iter_key_points`.
+
+    Every track keeps the last `history` hip samples in a ring buffer. A sample is tested as the apex
+    of a jump once `window_size` newer samples have arrived, so jumps are reported `window_size`
+    samples after their apex. The apex has to be the lowest point of its fit window and as prominent
+    as in `find_parabolic_curve`, with `peak_prominence` measured inside the buffer; the launch and
+    landing are then found with the same parabola fit and deviation threshold. Tracks that are not
+    seen for `max_idle_frames` frames are dropped, so memory does not grow with the stream length.
+
+    :param fps: The frame rate of the stream, defaults to 30 (optional)
+    :param window_size: Half width of the parabola fit window, in samples
+    :param threshold: The deviation from the fitted parabola that marks launch and landing
+    :param prominence: The required prominence of the apex, in pixels
+    :param history: The number of samples kept per track, defaults to six fit windows (optional)
+    :param max_idle_frames: Tracks not seen for this many frames are dropped, defaults to the history
+    (optional)
+    """
+
+    def __init__(self, fps=30, window_size=WINDOW_SIZE, threshold=THRESHOLD, prominence=PEAK_PROMINENCE,
+                 history=None, max_idle_frames=None, keypoint_index=LEFT_HIP_INDEX):
+        self.fps = fps
+        self.window_size = window_size
+        self.threshold = threshold
+        self.prominence = prominence
+        self.history = history or 6 * window_size
+        if self.history < 2 * window_size + 1:
+            raise ValueError("history must hold at least one full fit window.")
+        self.max_idle_frames = max_idle_frames or self.history
+        self.keypoint_index = keypoint_index
+        self.tracks = {}
+
+    def update(self, frame, ids, keypoints):
+        """
+        Adds the detections of one frame and returns the jumps that were completed by it.
+
+        :param frame: The frame number
+        :param ids: The track ids detected in the frame
+        :param keypoints: The keypoints of the detections, shape (len(ids), 17, 3)
+        :return: a list of `JumpEvent`.
+        """
+        events = []
+        for id, kps in zip(ids, keypoints):
+            id = int(id)
+            buffer = self.tracks.get(id)
+            if buffer is None:
+                buffer = self.tracks[id] = _TrackBuffer(self.history)
+            buffer.append(frame, kps[self.keypoint_index][1])
+            event = self._check(id, buffer, buffer.count - 1 - self.window_size, frame)
+            if event is not None:
+                events.append(event)
+
+        for id in [id for id, buffer in self.tracks.items() if frame - buffer.last_frame > self.max_idle_frames]:
+            events.extend(self._drain(id, frame))
+        return events
+
+    def flush(self):
+        """
+        Tests the samples that are still waiting for a full window, e.g. at the end of a video, and
+        drops all tracks.
+        """
+        events = []
+        for id in list(self.tracks):
+            events.extend(self._drain(id, self.tracks[id].last_frame))
+        return events
+
+    def _drain(self, id, frame):
+        buffer = self.tracks.pop(id)
+        events = []
+        for apex in range(max(buffer.count - self.window_size, 0), buffer.count):
+            event = self._check(id, buffer, apex, frame)
+            if event is not None:
+                events.append(event)
+        return events
+
+    def _check(self, id, buffer, apex, frame):
+        first = max(buffer.count - self.history, 0)
+        if apex < max(first + 1, buffer.resume_at) or apex >= buffer.count - 1:
+            return None
+
+        frames, values = buffer.window(first, buffer.count)
+        position = apex - first
+        start = max(position - self.window_size, 0)
+        end = min(position + self.window_size, len(values))
+        # Same apex conditions as a prominent valley in `find_parabolic_curve`
+        if np.argmin(values[start:end]) != position - start or values[position + 1] <= values[position]:
+            return None
+        if peak_prominence(-values, position) < self.prominence:
+            return None
+
+        x = np.arange(start, end) - position
+        y = values[start:end]
+        coefficients = np.polyfit(x, y, 2)
+        over = np.flatnonzero(np.abs(np.polyval(coefficients, x) - y) > self.threshold)
+        if len(over):
+            launch, landing = over[0] + start, over[-1] + start
+        else:
+            launch, landing = start, end - 1
+        buffer.resume_at = first + landing + 1
+
+        entry = jump_entry(int(frames[launch]), int(frames[landing]), self.fps)
+        if not entry["jumping"]:
+            return None
+        return JumpEvent(id, entry["launch_frame"], entry["landing_frame"], entry["jump_height"],
+                         entry["launch_velocity"], frame)
+
+
+def detect_jumps_online(frames, fps=30, **kwargs):
+    """
+    The function `detect_jumps_online` runs an `OnlineJumpDetector` over a stream of detections and
+    yields jump events as soon as they are detected.
+
+    :param frames: An iterable of `(frame, ids, boxes, keypoints)` tuples, as yielded by `iter_key_points`
+    :param fps: The frame rate of the stream, defaults to 30 (optional)
+    :param kwargs: Other arguments of `OnlineJumpDetector`
+    :return: a generator of `JumpEvent`.
+    """
+    detector = OnlineJumpDetector(fps=fps, **kwargs)
+    for frame, ids, boxes, keypoints in frames:
+        yield from detector.update(frame, ids, keypoints)
+    yield from detector.flush()
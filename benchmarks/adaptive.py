@@ -0,0 +1,108 @@
+"""
+Compares adaptive frame-stride extraction (`get_key_points_adaptive`) with full rate extraction on a
+set of videos: throughput of both, and the launch and landing frame differences of every jump. Needs
+the pose model weights. Run it with `python -m benchmarks.adaptive test_videos --stride 4`.
+"""
+import argparse
+import json
+import time
+
+
+def stride_frame_offset(dense, sparse, stride):
+    """
+    The function `stride_frame_offset` checks the frame numbers of a strided pass against a dense pass
+    of the same video: it shifts the sparse tracks by every offset from `1 - stride` to `stride - 1`
+    frames and returns the one under which they agree best with the dense tracks, by box IoU and pose
+    similarity. It is 0 when the strided frames are numbered correctly.
+
+    :param dense: The tracks of a full rate pass
+    :param sparse: The tracks of a pass with `vid_stride=stride`
+    :param stride: The stride of the sparse pass
+    :return: the best offset, in frames.
+    """
+    from keypoints.stitching import match_tracks, track_similarity
+    from keypoints.track import KeypointTrack
+
+    mapping = match_tracks(dense, sparse)
+    scores = {}
+    for offset in range(1 - stride, stride):
+        scores[offset] = sum(track_similarity(dense[dense_id], KeypointTrack(
+            sparse_id, sparse[sparse_id].frames + offset, sparse[sparse_id].boxes, sparse[sparse_id].keypoints),
+            keypoint_weight=0.5) for sparse_id, dense_id in mapping.items())
+    return max(scores, key=scores.get)
+
+
+def compare_video(video_path, stride=4, tolerance=2):
+    """
+    The function `compare_video` extracts the keypoints of a video at full rate and adaptively, and
+    compares the jumps found in both.
+
+    :param video_path: The path to the video file
+    :param stride: The sparse stride of the adaptive extraction, defaults to 4 (optional)
+    :param tolerance: The largest launch or landing frame difference accepted, defaults to 2 (optional)
+    :return: a dictionary with the extraction times, the speedup, the frame differences of every jump,
+    the frame offset of the strided pass (`stride_frame_offset`) and whether all the jumps are within
+    `tolerance` and the offset is 0.
+    """
+    from analyzer import analyze_jump
+    from keypoints.adaptive import get_key_points_adaptive
+    from keypoints.stitching import match_tracks
+    from keypoints.track import as_tracks, tracks_from_frames
+    from keypoints.video import video_properties
+    from keypoints.yolo import get_key_points, iter_key_points
+
+    fps = video_properties(video_path)[0]
+    start = time.perf_counter()
+    full = as_tracks(get_key_points(path=video_path))
+    full_time = time.perf_counter() - start
+    start = time.perf_counter()
+    adaptive = get_key_points_adaptive(path=video_path, stride=stride)
+    adaptive_time = time.perf_counter() - start
+
+    full_jumps = analyze_jump(full, fps, verbose=False)
+    adaptive_jumps = analyze_jump(adaptive, fps, verbose=False)
+    mapping = match_tracks(full, adaptive)
+    jumps = []
+    for adaptive_id, full_id in mapping.items():
+        expected, actual = full_jumps[full_id], adaptive_jumps[adaptive_id]
+        if not expected["jumping"]:
+            continue
+        if not actual["jumping"]:
+            jumps.append({"id": full_id, "missed": True})
+            continue
+        jumps.append({
+            "id": full_id,
+            "launch_error": int(actual["launch_frame"] - expected["launch_frame"]),
+            "landing_error": int(actual["landing_frame"] - expected["landing_frame"]),
+        })
+
+    offset = stride_frame_offset(full, tracks_from_frames(iter_key_points(video_path, vid_stride=stride)), stride)
+    within = offset == 0 and all(not jump.get("missed") and abs(jump["launch_error"]) <= tolerance
+                                 and abs(jump["landing_error"]) <= tolerance for jump in jumps)
+    return {
+        "video": video_path,
+        "full_seconds": full_time,
+        "adaptive_seconds": adaptive_time,
+        "speedup": full_time / adaptive_time if adaptive_time else None,
+        "jumps": jumps,
+        "sparse_frame_offset": offset,
+        "within_tolerance": within,
+    }
+
+
+def main(argv=None):
+    from pipeline.batch import find_videos
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("source", help="a directory of videos or a glob pattern")
+    parser.add_argument("--stride", type=int, default=4, help="sparse pass stride")
+    parser.add_argument("--tolerance", type=int, default=2, help="accepted launch/landing error in frames")
+    args = parser.parse_args(argv)
+
+    results = [compare_video(video, args.stride, args.tolerance) for video in find_videos(args.source)]
+    print(json.dumps(results, indent=2))
+    return 0 if all(result["within_tolerance"] for result in results) else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
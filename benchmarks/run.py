@@ -0,0 +1,187 @@
+"""
+Benchmarks every stage of the analysis on synthetic keypoints, without a video or the pose model.
+Run it with `python -m benchmarks.run --tracks 20 --frames 3000 --jumps 2 --output bench.json`; the
+JSON report can be compared between commits.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from .synthetic import SyntheticVideo, synthetic_detections, synthetic_keypoints_data
+
+
+def measure(function, repeat=5):
+    """
+    Calls `function` `repeat` times and returns the best, median and mean wall time in seconds.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return {"best": min(times), "median": statistics.median(times), "mean": statistics.fmean(times),
+            "repeat": repeat}
+
+
+def peak_allocated(function):
+    """
+    Calls `function` once and returns the peak memory it allocated, in megabytes.
+    """
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1] / (1 << 20)
+    finally:
+        tracemalloc.stop()
+
+
+def collect_nested_lists(detections):
+    """
+    Collects per-frame detections the way `get_key_points` used to, through Python lists and
+    dictionaries, as a baseline for `tracks_from_frames`.
+    """
+    keypoints_data = {}
+    for frame_count, ids, boxes, keypoints in detections:
+        ids = ids.tolist()
+        boxes = boxes.tolist()
+        keypoints = keypoints.tolist()
+        for i, id in enumerate(ids):
+            keypoints_data.setdefault(id, {})[frame_count] = {"box": boxes[i], "keypoints": keypoints[i]}
+    return keypoints_data
+
+
+def render_window(tracks, jump_data, n_frames):
+    """
+    Moves `n_frames` frames centred on the first launch in `jump_data` to the start of the video, so
+    that a render of the first `n_frames` frames of a `SyntheticVideo` draws the jump overlays.
+
+    :return: the shifted tracks and `jump_data`, and the `(first, last)` frames of the window.
+    """
+    from keypoints.track import KeypointTrack, tracks_in_range
+
+    launches = [entry["launch_frame"] for entry in jump_data.values() if entry["jumping"]]
+    first = max(int(min(launches)) - n_frames // 2, 1) if launches else 1
+    last = first + n_frames - 1
+    shift = first - 1
+    tracks = {id: KeypointTrack(id, track.frames - shift, track.boxes, track.keypoints)
+              for id, track in tracks_in_range(tracks, first, last).items()}
+    jump_data = {id: dict(entry, launch_frame=entry["launch_frame"] - shift,
+                          landing_frame=entry["landing_frame"] - shift) if entry["jumping"] else entry
+                 for id, entry in jump_data.items()}
+    return tracks, jump_data, (first, last)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_benchmarks(n_tracks=20, n_frames=3000, n_jumps=2, render_frames=300, repeat=5, seed=0):
+    """
+    The function `run_benchmarks` times the collection of per-frame detections into tracks (against
+    the former nested lists), `load_keypoints_data` (cache write and read),
+    `get_limb_keypoint_trajectories`, `find_parabolic_curve`, `analyze_jump` (per track, batched and
+    with the rolling segmentation) and the per-frame cost of `save_and_show_output` on synthetic data.
+
+    :param n_tracks: The number of tracked people, defaults to 20 (optional)
+    :param n_frames: The number of frames per track, defaults to 3000 (optional)
+    :param n_jumps: The number of jumps per track, defaults to 2 (optional)
+    :param render_frames: The number of synthetic frames rendered, defaults to 300 (optional)
+    :param repeat: The number of timed runs of every stage, defaults to 5 (optional)
+    :param seed: The random seed of the synthetic data, defaults to 0 (optional)
+    :return: a JSON serializable report.
+    """
+    from analyzer import analyze_jump
+    from analyzer.motion_analysis import (PEAK_PROMINENCE, THRESHOLD, WINDOW_SIZE,
+                                          get_limb_keypoint_trajectories)
+    from keypoints.data_loader import load_keypoints_data
+    from keypoints.track import as_tracks, tracks_from_frames
+    from utils.calculations import find_parabolic_curve
+    from utils.visualization import save_and_show_output
+
+    keypoints_data = synthetic_keypoints_data(n_tracks, n_frames, n_jumps, seed=seed)
+    stages = {}
+    detections = synthetic_detections(as_tracks(keypoints_data))
+    for name, collect in (("collect_tracks", tracks_from_frames), ("collect_nested_lists", collect_nested_lists)):
+        result = measure(lambda: collect(detections), repeat)
+        result["per_frame"] = result["best"] / len(detections)
+        result["peak_mb"] = peak_allocated(lambda: collect(detections))
+        stages[name] = result
+
+    with tempfile.TemporaryDirectory() as tmp:
+        video_path = os.path.join(tmp, "synthetic.mp4")
+        with open(video_path, "wb") as f:
+            f.write(np.random.default_rng(seed).bytes(1 << 20))
+
+        stages["cache_write"] = measure(lambda: load_keypoints_data(
+            video_path, lambda path: keypoints_data, ignore_cache=True, cache_dir=tmp), repeat)
+        stages["cache_read"] = measure(lambda: load_keypoints_data(video_path, None, cache_dir=tmp), repeat)
+        tracks = load_keypoints_data(video_path, None, cache_dir=tmp)
+
+        stages["get_limb_keypoint_trajectories"] = measure(
+            lambda: [get_limb_keypoint_trajectories(tracks, id) for id in tracks], repeat)
+        signals = [np.asarray(get_limb_keypoint_trajectories(tracks, id)[1], dtype=np.float64) for id in tracks]
+        stages["find_parabolic_curve"] = measure(
+            lambda: [find_parabolic_curve(signal, window_size=WINDOW_SIZE, threshold=THRESHOLD,
+                                          prominence=PEAK_PROMINENCE) for signal in signals], repeat)
+        stages["analyze_jump"] = measure(lambda: analyze_jump(tracks, 30, verbose=False), repeat)
+        stages["analyze_jump_batch"] = measure(lambda: analyze_jump(tracks, 30, batch=True, verbose=False), repeat)
+        stages["analyze_jump_rolling"] = measure(
+            lambda: analyze_jump(tracks, 30, verbose=False, segmentation="rolling"), repeat)
+
+        # Rendering is timed on frames around a jump, against plain re-encoding of the same frames
+        # with no jump at all
+        window_tracks, jump_data, window = render_window(tracks, analyze_jump(tracks, 30, verbose=False),
+                                                         render_frames)
+        no_jumps = {id: dict(entry, jumping=False) for id, entry in jump_data.items()}
+        for name, data in (("render", jump_data), ("render_no_overlays", no_jumps)):
+            result = measure(lambda: save_and_show_output(
+                "rendered.mp4", SyntheticVideo(render_frames, seed=seed), data, window_tracks, show=False,
+                fps=30, output_dir=tmp), max(1, repeat // 2))
+            result["per_frame"] = result["best"] / render_frames
+            result["frames"] = list(window)
+            stages[name] = result
+
+    return {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "parameters": {"tracks": n_tracks, "frames": n_frames, "jumps": n_jumps,
+                       "render_frames": render_frames, "repeat": repeat, "seed": seed},
+        "stages": stages,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tracks", type=int, default=20, help="number of tracked people")
+    parser.add_argument("--frames", type=int, default=3000, help="number of frames per track")
+    parser.add_argument("--jumps", type=int, default=2, help="number of jumps per track")
+    parser.add_argument("--render-frames", type=int, default=300, help="number of frames rendered")
+    parser.add_argument("--repeat", type=int, default=5, help="number of timed runs per stage")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("-o", "--output", default=None, help="write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(args.tracks, args.frames, args.jumps, args.render_frames, args.repeat, args.seed)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,139 @@
+"""
+Compares the segmentations of `analyze_jump` ("peak", "rolling" and "piecewise") on synthetic tracks
+with known launch and landing frames: analysis time, missed and spurious jumps, and launch, landing
+and height errors. A jump at the very end of a track is checked too, the command fails if any
+segmentation raises on it. Run it with `python -m benchmarks.segmentation --tracks 200 --noise 2`.
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from .synthetic import synthetic_keypoints_data
+
+
+def score_segmentation(jump_data, truth, fps=30):
+    """
+    The function `score_segmentation` matches the jumps found to the true ones and measures the errors.
+
+    :param jump_data: The `jump_data` dictionary returned by `analyze_jump`
+    :param truth: The `(launch_index, landing_index)` pairs of every track, as returned by
+    `synthetic_keypoints_data`
+    :param fps: The frame rate of the synthetic tracks, defaults to 30 (optional)
+    :return: a dictionary with the number of true, found, missed and spurious jumps and the mean
+    and mean absolute launch, landing and height errors (frames and cm) of the matched jumps.
+    """
+    from utils.calculations import calculate_jump_height
+
+    errors = []
+    found = missed = 0
+    for id, jumps in truth.items():
+        detected = jump_data[id]["jumps"]
+        found += len(detected)
+        for launch, landing in jumps:
+            # Frames are numbered from 1, sample i of a synthetic track is frame i + 1
+            launch, landing = launch + 1, landing + 1
+            overlapping = [jump for jump in detected
+                           if jump["launch_frame"] <= landing and jump["landing_frame"] >= launch]
+            if not overlapping:
+                missed += 1
+                continue
+            jump = min(overlapping, key=lambda jump: abs(jump["launch_frame"] - launch))
+            errors.append((jump["launch_frame"] - launch, jump["landing_frame"] - landing,
+                           jump["jump_height"] - calculate_jump_height((landing - launch) / fps)))
+
+    n_true = sum(len(jumps) for jumps in truth.values())
+    errors = np.array(errors, dtype=np.float64).reshape(-1, 3)
+    report = {"true": n_true, "found": found, "missed": missed, "spurious": found - len(errors)}
+    for i, name in enumerate(("launch_frames", "landing_frames", "height_cm")):
+        report[f"{name}_error"] = float(errors[:, i].mean()) if len(errors) else None
+        report[f"{name}_abs_error"] = float(np.abs(errors[:, i]).mean()) if len(errors) else None
+    return report
+
+
+def compare_segmentations(n_tracks=100, n_frames=600, n_jumps=1, noise=1.0, fps=30, seed=0, repeat=3):
+    """
+    The function `compare_segmentations` times and scores every segmentation of `analyze_jump` on the
+    same synthetic tracks.
+
+    :param n_tracks: The number of tracks, defaults to 100 (optional)
+    :param n_frames: The number of frames per track, defaults to 600 (optional)
+    :param n_jumps: The number of jumps per track, defaults to 1 (optional)
+    :param noise: The keypoint noise in pixels, defaults to 1.0 (optional)
+    :param fps: The frame rate, defaults to 30 (optional)
+    :param seed: The random seed, defaults to 0 (optional)
+    :param repeat: The number of timed runs, the best one is reported, defaults to 3 (optional)
+    :return: a dictionary mapping each segmentation to its time per track and its scores.
+    """
+    from analyzer import analyze_jump
+    from analyzer.motion_analysis import SEGMENTATIONS
+    from keypoints.track import as_tracks
+
+    keypoints_data, truth = synthetic_keypoints_data(n_tracks, n_frames, n_jumps, fps, noise, seed,
+                                                     return_truth=True)
+    tracks = as_tracks(keypoints_data)
+    results = {}
+    for segmentation in SEGMENTATIONS:
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            jump_data = analyze_jump(tracks, fps, verbose=False, segmentation=segmentation)
+            times.append(time.perf_counter() - start)
+        results[segmentation] = dict(seconds_per_track=min(times) / n_tracks,
+                                     **score_segmentation(jump_data, truth, fps))
+    return results
+
+
+def check_jump_at_track_end(fps=30, first_frame=101):
+    """
+    The function `check_jump_at_track_end` analyses a clean 40-sample track whose apex is 8 samples
+    before its end, so the parabola fit window reaches the end of the track, with every segmentation.
+
+    :param fps: The frame rate, defaults to 30 (optional)
+    :param first_frame: The frame at which the track starts, defaults to 101 (optional)
+    :return: a dictionary mapping each segmentation, and "peak" with `batch`, to the launch and
+    landing frames found (None when no jump is found) or to the error raised.
+    """
+    from analyzer import analyze_jump
+    from analyzer.motion_analysis import SEGMENTATIONS
+    from keypoints.track import KeypointTrack
+
+    samples = np.arange(40)
+    keypoints = np.zeros((40, 17, 3))
+    keypoints[:, :, 1] = 700 - np.clip(200 - 2.0 * (samples - 32) ** 2, 0, None)[:, None]
+    keypoints[:, :, 2] = 1
+    tracks = {1: KeypointTrack(1, np.arange(first_frame, first_frame + 40, dtype=np.int32), np.zeros((40, 4)),
+                               keypoints)}
+    runs = {segmentation: {"segmentation": segmentation} for segmentation in SEGMENTATIONS}
+    runs["peak-batch"] = {"batch": True}
+    results = {}
+    for name, kwargs in runs.items():
+        try:
+            entry = analyze_jump(tracks, fps, verbose=False, **kwargs)[1]
+        except Exception as e:
+            results[name] = f"error: {e}"
+        else:
+            results[name] = [entry["launch_frame"], entry["landing_frame"]] if entry["jumping"] else None
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tracks", type=int, default=100, help="number of synthetic tracks")
+    parser.add_argument("--frames", type=int, default=600, help="number of frames per track")
+    parser.add_argument("--jumps", type=int, default=1, help="number of jumps per track")
+    parser.add_argument("--noise", type=float, default=1.0, help="keypoint noise in pixels")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--repeat", type=int, default=3, help="number of timed runs")
+    args = parser.parse_args(argv)
+
+    results = compare_segmentations(args.tracks, args.frames, args.jumps, args.noise, seed=args.seed,
+                                    repeat=args.repeat)
+    track_end = check_jump_at_track_end()
+    print(json.dumps(dict(results, jump_at_track_end=track_end), indent=2))
+    return 1 if any(isinstance(result, str) for result in track_end.values()) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,140 @@
+"""
+Load test of the analysis service (`pipeline.service`): sends many `POST /jobs?wait=1` requests with a
+fixed number in flight and reports the throughput and the latency percentiles. Requests turned away
+because the queue is full are retried after `Retry-After` and counted. Without `--port` or `--unix`,
+a service is started in-process for the test. Run it with
+`python -m benchmarks.service test_videos --requests 50 --concurrency 8 --workers 2`.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import time
+
+import numpy as np
+
+PERCENTILES = (50, 95, 99)
+
+
+async def _send_jobs(videos, n_requests, concurrency, ignore_cache, address):
+    from pipeline.service import request
+
+    latencies, queued, running = [], [], []
+    counts = {"completed": 0, "failed": 0, "rejected": 0}
+    next_video = itertools.cycle(videos)
+    remaining = iter(range(n_requests))
+
+    async def client():
+        for _ in remaining:
+            body = {"video": next(next_video), "ignore_cache": ignore_cache}
+            start = time.perf_counter()
+            while True:
+                status, headers, job = await request("POST", "/jobs?wait=1", body, **address)
+                if status != 503:
+                    break
+                counts["rejected"] += 1
+                await asyncio.sleep(float(headers.get("retry-after", 1)))
+            latencies.append(time.perf_counter() - start)
+            if status == 200 and job["status"] == "done":
+                counts["completed"] += 1
+                queued.append(job["queued_seconds"])
+                running.append(job["run_seconds"])
+            else:
+                counts["failed"] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return time.perf_counter() - start, latencies, queued, running, counts
+
+
+def _summary(seconds):
+    values = np.array(seconds, dtype=np.float64) * 1000
+    if len(values) == 0:
+        return None
+    summary = {"mean_ms": float(values.mean())}
+    for q, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+        summary[f"p{q}_ms"] = float(value)
+    summary["max_ms"] = float(values.max())
+    return summary
+
+
+async def load_test(videos, n_requests=50, concurrency=8, workers=2, queue_size=None, ignore_cache=False,
+                    host="127.0.0.1", port=None, unix_path=None, model_name="yolov8n-pose.pt",
+                    cache_dir="keypoints_cache"):
+    """
+    The function `load_test` sends `n_requests` jobs to the service, `concurrency` at a time.
+
+    :param videos: The paths of the videos, used in turn
+    :param n_requests: The number of jobs, defaults to 50 (optional)
+    :param concurrency: The number of requests in flight, defaults to 8 (optional)
+    :param workers: The number of worker processes of the in-process service, defaults to 2 (optional)
+    :param queue_size: The queue size of the in-process service, defaults to its default (optional)
+    :param ignore_cache: If True, every job extracts the keypoints again, defaults to False (optional)
+    :param host: The host of a running service, defaults to 127.0.0.1 (optional)
+    :param port: The port of a running service; without it or `unix_path` a service is started (optional)
+    :param unix_path: The Unix socket of a running service (optional)
+    :param model_name: The pose model of the in-process service, defaults to yolov8n-pose.pt (optional)
+    :param cache_dir: The keypoints cache of the in-process service, defaults to keypoints_cache
+    (optional)
+    :return: a JSON serializable report with the throughput, the counts of completed, failed and
+    rejected requests, the end-to-end latency percentiles and the time the jobs spent queued and
+    running in the service.
+    """
+    from pipeline.service import QUEUE_SIZE, AnalysisService, start_server
+
+    videos = [os.path.abspath(video) for video in videos]
+    service = server = None
+    startup = None
+    if port is None and unix_path is None:
+        start = time.perf_counter()
+        service = AnalysisService(workers, queue_size or QUEUE_SIZE, model_name, cache_dir)
+        server = await start_server(service, host, 0)
+        startup = time.perf_counter() - start
+        port = server.sockets[0].getsockname()[1]
+    address = {"host": host, "port": port, "unix_path": unix_path}
+    try:
+        wall, latencies, queued, running, counts = await _send_jobs(videos, n_requests, concurrency, ignore_cache,
+                                                                     address)
+    finally:
+        if server is not None:
+            server.close()
+            await server.wait_closed()
+            await service.stop()
+
+    return {
+        "parameters": {"videos": len(videos), "requests": n_requests, "concurrency": concurrency,
+                       "workers": workers if service else None, "ignore_cache": ignore_cache},
+        "startup_seconds": startup,
+        "wall_seconds": wall,
+        "throughput_per_second": counts["completed"] / wall if wall > 0 else None,
+        **counts,
+        "latency": _summary(latencies),
+        "queued": _summary(queued),
+        "running": _summary(running),
+    }
+
+
+def main(argv=None):
+    from pipeline.batch import find_videos
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("source", help="a video, a directory of videos or a glob pattern")
+    parser.add_argument("-n", "--requests", type=int, default=50, help="number of jobs")
+    parser.add_argument("-c", "--concurrency", type=int, default=8, help="requests in flight")
+    parser.add_argument("-j", "--workers", type=int, default=2, help="workers of the in-process service")
+    parser.add_argument("--queue-size", type=int, default=None, help="queue size of the in-process service")
+    parser.add_argument("--ignore-cache", action="store_true", help="extract the keypoints in every job")
+    parser.add_argument("--port", type=int, default=None, help="port of a running service")
+    parser.add_argument("--unix", default=None, metavar="PATH", help="Unix socket of a running service")
+    args = parser.parse_args(argv)
+
+    videos = [args.source] if os.path.isfile(args.source) else find_videos(args.source)
+    report = asyncio.run(load_test(videos, args.requests, args.concurrency, args.workers, args.queue_size,
+                                   args.ignore_cache, port=args.port, unix_path=args.unix))
+    print(json.dumps(report, indent=2))
+    return 1 if report["failed"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,96 @@
+"""
+Startup time of re-analysing a cached video (`load_keypoints_data` followed by `analyze_jump`) in a
+fresh interpreter. Run it with `python -m benchmarks.startup`; it exits with a non-zero status when the
+run is slower than the budget or when a heavy dependency gets imported on the way.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from .synthetic import synthetic_keypoints_data
+
+STARTUP_BUDGET = 1.0
+HEAVY_MODULES = ("ultralytics", "torch", "cv2", "scipy", "tqdm")
+
+_CHILD = """
+import sys, time, json
+start = time.perf_counter()
+from keypoints.data_loader import load_keypoints_data
+from analyzer import analyze_jump
+imported = time.perf_counter()
+keypoints_data = load_keypoints_data(sys.argv[1], None, cache_dir=sys.argv[2])
+jump_data = analyze_jump(keypoints_data, 30, verbose=False)
+done = time.perf_counter()
+print(json.dumps({"import": imported - start, "analysis": done - imported,
+                  "modules": sorted(name for name in sys.modules if "." not in name)}))
+"""
+
+
+def measure_startup(repeat=3):
+    """
+    The function `measure_startup` writes a small keypoints cache and re-analyses it `repeat` times,
+    each time in a new interpreter.
+
+    :param repeat: The number of runs, the fastest one is reported, defaults to 3 (optional)
+    :return: a dictionary with the wall time of the fastest run, its import and analysis time and the
+    heavy modules that were imported.
+    """
+    from keypoints.data_loader import load_keypoints_data
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as tmp:
+        video_path = os.path.join(tmp, "startup.mp4")
+        with open(video_path, "wb") as f:
+            f.write(b"startup benchmark")
+        load_keypoints_data(video_path, lambda path: synthetic_keypoints_data(n_tracks=2, n_frames=300), cache_dir=tmp)
+
+        runs = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            output = subprocess.run([sys.executable, "-c", _CHILD, video_path, tmp], cwd=root, check=True,
+                                    capture_output=True, text=True).stdout
+            wall = time.perf_counter() - start
+            runs.append(dict(json.loads(output.strip().splitlines()[-1]), wall=wall))
+
+    best = min(runs, key=lambda run: run["wall"])
+    return {
+        "wall": best["wall"],
+        "import": best["import"],
+        "analysis": best["analysis"],
+        "heavy_modules": [name for name in HEAVY_MODULES if name in best["modules"]],
+    }
+
+
+def check_startup(budget=STARTUP_BUDGET, repeat=3):
+    """
+    Raises an AssertionError if re-analysing a cached video takes longer than `budget` seconds or
+    imports a heavy dependency, returns the measurement otherwise.
+    """
+    result = measure_startup(repeat)
+    if result["heavy_modules"]:
+        raise AssertionError(f"heavy modules imported at startup: {result['heavy_modules']}")
+    if result["wall"] >= budget:
+        raise AssertionError(f"startup took {result['wall']:.3f}s, budget is {budget:.3f}s")
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--budget", type=float, default=STARTUP_BUDGET, help="maximum wall time in seconds")
+    parser.add_argument("--repeat", type=int, default=3, help="number of runs")
+    args = parser.parse_args(argv)
+    try:
+        result = check_startup(args.budget, args.repeat)
+    except AssertionError as e:
+        print(e, file=sys.stderr)
+        return 1
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,128 @@
+import numpy as np
+
+from analyzer.motion_analysis import LEFT_HIP_INDEX, RIGHT_HIP_INDEX
+from utils.calculations import GRAVITY
+
+# Offsets of the 17 keypoints from the hips, in pixels, for a person standing about 500px tall
+_POSE = np.array([
+    [0, -330], [8, -340], [-8, -340], [18, -335], [-18, -335],
+    [45, -260], [-45, -260], [60, -170], [-60, -170], [65, -90], [-65, -90],
+    [25, 0], [-25, 0], [28, 120], [-28, 120], [30, 240], [-30, 240],
+], dtype=np.float64)
+
+
+def synthetic_hip_trajectory(n_frames, n_jumps, fps=30, pixels_per_meter=500, noise=1.0, rng=None):
+    """
+    The function `synthetic_hip_trajectory` generates the vertical hip position of a person standing
+    still and jumping `n_jumps` times, each flight following a parabola, plus Gaussian noise.
+
+    :param n_frames: The number of frames
+    :param n_jumps: The number of jumps, spread over the trajectory without overlapping
+    :param fps: The frame rate, defaults to 30 (optional)
+    :param pixels_per_meter: The image scale, defaults to 500 (optional)
+    :param noise: The standard deviation of the noise in pixels, defaults to 1.0 (optional)
+    :param rng: A NumPy random generator (optional)
+    :return: the hip y coordinates and a list of `(launch_index, landing_index)` of every jump.
+    """
+    rng = rng or np.random.default_rng()
+    y = np.full(n_frames, 700.0)
+    jumps = []
+    if n_jumps:
+        slot = n_frames // n_jumps
+        for k in range(n_jumps):
+            air_time = rng.uniform(0.35, 0.7)
+            flight = int(round(air_time * fps))
+            if flight + 20 > slot:
+                continue
+            launch = k * slot + int(rng.integers(10, slot - flight - 9))
+            t = np.arange(flight + 1) / fps
+            v_0 = GRAVITY * air_time / 2
+            y[launch:launch + flight + 1] -= (v_0 * t - 0.5 * GRAVITY * t ** 2) * pixels_per_meter
+            jumps.append((launch, launch + flight))
+    return y + rng.normal(0, noise, n_frames), jumps
+
+
+def synthetic_keypoints_data(n_tracks=10, n_frames=1000, n_jumps=1, fps=30, noise=1.0, seed=0, return_truth=False):
+    """
+    The function `synthetic_keypoints_data` generates keypoints data in the nested dictionary format of
+    the JSON caches, for benchmarking without a video or the pose model.
+
+    Every track is visible for the whole video at its own horizontal position and jumps `n_jumps`
+    times; all 17 keypoints follow the hips.
+
+    :param n_tracks: The number of tracked people, defaults to 10 (optional)
+    :param n_frames: The number of frames, defaults to 1000 (optional)
+    :param n_jumps: The number of jumps of every person, defaults to 1 (optional)
+    :param fps: The frame rate, defaults to 30 (optional)
+    :param noise: The keypoint noise in pixels, defaults to 1.0 (optional)
+    :param seed: The random seed, defaults to 0 (optional)
+    :param return_truth: If True, also returns the `(launch_index, landing_index)` pairs of every track
+    (optional)
+    :return: a dictionary `{id: {frame: {"box": [...], "keypoints": [...]}}}`, and the ground truth if
+    `return_truth` is set.
+    """
+    rng = np.random.default_rng(seed)
+    keypoints_data = {}
+    truth = {}
+    for id in range(1, n_tracks + 1):
+        hip_y, jumps = synthetic_hip_trajectory(n_frames, n_jumps, fps, noise=noise, rng=rng)
+        hip_x = 100.0 + 150 * (id - 1)
+        keypoints = np.empty((n_frames, 17, 3))
+        keypoints[:, :, 0] = hip_x + _POSE[:, 0] + rng.normal(0, noise, (n_frames, 17))
+        keypoints[:, :, 1] = hip_y[:, None] + _POSE[:, 1] + rng.normal(0, noise, (n_frames, 17))
+        keypoints[:, [LEFT_HIP_INDEX, RIGHT_HIP_INDEX], 1] = hip_y[:, None]
+        keypoints[:, :, 2] = rng.uniform(0.8, 1.0, (n_frames, 17))
+        boxes = np.stack([keypoints[:, :, 0].min(axis=1) - 20, keypoints[:, :, 1].min(axis=1) - 20,
+                          keypoints[:, :, 0].max(axis=1) + 20, keypoints[:, :, 1].max(axis=1) + 20], axis=1)
+        boxes, keypoints = boxes.tolist(), keypoints.tolist()
+        keypoints_data[id] = {frame + 1: {"box": boxes[frame], "keypoints": keypoints[frame]}
+                              for frame in range(n_frames)}
+        truth[id] = jumps
+    if return_truth:
+        return keypoints_data, truth
+    return keypoints_data
+
+
+def synthetic_detections(tracks):
+    """
+    Turns a dictionary of `KeypointTrack` back into per-frame `(frame, ids, boxes, keypoints)` arrays,
+    as yielded by `iter_key_points`.
+    """
+    frames = np.unique(np.concatenate([track.frames for track in tracks.values()]))
+    detections = []
+    for frame in frames.tolist():
+        rows = [(id, track.index_of(frame)) for id, track in tracks.items()]
+        rows = [(id, i) for id, i in rows if i is not None]
+        detections.append((frame, np.array([id for id, _ in rows], dtype=np.int64),
+                           np.array([tracks[id].boxes[i] for id, i in rows], dtype=np.float32).reshape(-1, 4),
+                           np.array([tracks[id].keypoints[i] for id, i in rows], dtype=np.float32).reshape(-1, 17, 3)))
+    return detections
+
+
+class SyntheticVideo:
+    """
+    A stand-in for `cv2.VideoCapture` that returns copies of one generated frame, so rendering can be
+    benchmarked without decoding a video.
+    """
+
+    def __init__(self, n_frames, width=1280, height=720, seed=0):
+        rng = np.random.default_rng(seed)
+        self.frame = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+        self.n_frames = n_frames
+        self.position = 0
+
+    def read(self):
+        if self.position >= self.n_frames:
+            return False, None
+        self.position += 1
+        return True, self.frame.copy()
+
+    def get(self, prop):
+        # 3 and 4 are cv2.CAP_PROP_FRAME_WIDTH and cv2.CAP_PROP_FRAME_HEIGHT
+        return {3: self.frame.shape[1], 4: self.frame.shape[0], 7: self.n_frames}.get(prop, 0)
+
+    def isOpened(self):
+        return True
+
+    def release(self):
+        pass
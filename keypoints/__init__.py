@@ -1,2 +1,5 @@
+from .adaptive import get_key_points_adaptive
+from .checkpoint import ChunkedKeypointsCache, extract_keypoints_checkpointed
 from .data_loader import load_keypoints_data
-from .yolo import get_key_points
\ No newline at end of file
+from .track import KeypointTrack, as_tracks
+from .yolo import get_key_points, iter_key_points, reset_tracker, track_frame
@@ -0,0 +1,129 @@
+import numpy as np
+
+from .stitching import match_tracks
+from .track import KeypointTrack, tracks_from_frames
+from .yolo import MODEL_NAME, iter_key_points, iter_key_points_from_frames
+
+LEFT_HIP_INDEX = 11
+RIGHT_HIP_INDEX = 12
+
+
+def find_motion_windows(tracks, margin, min_rise=15, baseline_samples=5):
+    """
+    The function `find_motion_windows` finds the parts of a (sparsely sampled) video in which some
+    tracked person's hips rise above their usual height, i.e. where a jump may happen.
+
+    :param tracks: A dictionary of `KeypointTrack`
+    :param margin: The number of frames added before and after every candidate sample
+    :param min_rise: The rise of the hips above their running median, in pixels, that makes a sample a
+    candidate, defaults to 15 (optional)
+    :param baseline_samples: The half width, in samples, of the running median, defaults to 5 (optional)
+    :return: a sorted list of non-overlapping `(start, stop)` frame windows, both inclusive.
+    """
+    windows = []
+    for track in tracks.values():
+        if len(track) < 3:
+            continue
+        hip_y = np.asarray(track.keypoints[:, [LEFT_HIP_INDEX, RIGHT_HIP_INDEX], 1], dtype=np.float64).mean(axis=1)
+        padded = np.pad(hip_y, baseline_samples, mode="edge")
+        baseline = np.median(np.lib.stride_tricks.sliding_window_view(padded, 2 * baseline_samples + 1), axis=1)
+        # Image y grows downwards, so a rising hip has a smaller y than its baseline
+        candidates = track.frames[baseline - hip_y > min_rise]
+        windows.extend((int(frame) - margin, int(frame) + margin) for frame in candidates)
+
+    merged = []
+    for start, stop in sorted(windows):
+        start = max(start, 1)
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    return merged
+
+
+def interpolate_track(track, max_gap):
+    """
+    The function `interpolate_track` fills the frames missing from a track by linear interpolation of
+    the boxes and keypoints, as long as the gap is at most `max_gap` frames. Longer gaps, where the
+    person really was not detected, are left as they are.
+
+    :param track: A `KeypointTrack`
+    :param max_gap: The longest gap, in frames, that is filled
+    :return: a new `KeypointTrack`.
+    """
+    frames = np.asarray(track.frames)
+    if len(frames) < 2 or max_gap < 1:
+        return track
+    step = np.diff(frames)
+    fill = (step > 1) & (step <= max_gap + 1)
+    if not fill.any():
+        return track
+
+    missing = np.concatenate([np.arange(frames[i] + 1, frames[i + 1]) for i in np.flatnonzero(fill)])
+    all_frames = np.union1d(frames, missing).astype(np.int32)
+    values = np.concatenate([np.asarray(track.boxes, dtype=np.float64),
+                             np.asarray(track.keypoints, dtype=np.float64).reshape(len(frames), -1)], axis=1)
+    interpolated = np.stack([np.interp(all_frames, frames, column) for column in values.T], axis=1)
+    return KeypointTrack(track.track_id, all_frames, interpolated[:, :4].astype(np.float32),
+                         interpolated[:, 4:].reshape(len(all_frames), -1, 3).astype(np.float32))
+
+
+def get_key_points_adaptive(path="test_videos/test1.mp4", stride=4, margin=None, min_rise=15, model_name=MODEL_NAME):
+    """
+    The function `get_key_points_adaptive` extracts keypoints with two sampling rates to save most of
+    the pose inference on long videos.
+
+    A sparse pass runs the model and tracker on every `stride`-th frame and looks for hips moving
+    upwards (`find_motion_windows`). A dense pass then runs the model on every frame of those windows
+    only. Dense tracks are matched to the sparse ones by box IoU on the frames both passes processed,
+    so they keep the sparse ids. Outside the windows, the frames skipped by the sparse pass are filled
+    by linear interpolation.
+
+    :param path: The path to the video file
+    :param stride: The frame stride of the sparse pass, defaults to 4 (optional)
+    :param margin: The number of frames processed densely before and after every candidate, defaults
+    to enough for the crouch, the flight and the landing of a jump (optional)
+    :param min_rise: The hip rise, in pixels, that triggers a dense window, defaults to 15 (optional)
+    :param model_name: The pose model to use, defaults to yolov8n-pose.pt (optional)
+    :return: a dictionary mapping each integer id to its `KeypointTrack`, with one row per frame like
+    the full rate extraction.
+    """
+    from .video import read_frames
+
+    margin = 30 + stride if margin is None else margin
+    print("***Getting keypoints data (sparse pass)***")
+    sparse = tracks_from_frames(iter_key_points(path, model_name, vid_stride=stride))
+    windows = find_motion_windows(sparse, margin, min_rise)
+    print(f"***Getting keypoints data (dense pass, {len(windows)} windows)***")
+
+    pieces = {id: [] for id in sparse}
+    covered = {id: [] for id in sparse}
+    next_id = max(sparse, default=0) + 1
+    for start, stop in windows:
+        dense = tracks_from_frames(iter_key_points_from_frames(read_frames(path, start, stop), model_name))
+        mapping = match_tracks(sparse, dense)
+        for dense_id, track in dense.items():
+            id = mapping.get(dense_id)
+            if id is None:
+                id, next_id = next_id, next_id + 1
+                pieces[id], covered[id] = [], []
+            pieces[id].append(track)
+            covered[id].append((start, stop))
+
+    tracks = {}
+    for id, track in sparse.items():
+        # Sparse samples are replaced by the dense ones wherever this person was tracked densely
+        keep = np.ones(len(track), dtype=bool)
+        for start, stop in covered[id]:
+            keep &= (track.frames < start) | (track.frames > stop)
+        pieces[id].append(KeypointTrack(id, track.frames[keep], track.boxes[keep], track.keypoints[keep]))
+    for id, id_pieces in pieces.items():
+        frames = np.concatenate([piece.frames for piece in id_pieces])
+        if len(frames) == 0:
+            continue
+        order = np.argsort(frames, kind="stable")
+        frames, unique = np.unique(frames[order], return_index=True)
+        boxes = np.concatenate([piece.boxes for piece in id_pieces])[order][unique]
+        keypoints = np.concatenate([piece.keypoints for piece in id_pieces])[order][unique]
+        tracks[id] = interpolate_track(KeypointTrack(id, frames, boxes, keypoints), stride - 1)
+    return tracks
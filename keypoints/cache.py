@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+CACHE_FORMAT_VERSION = 1
+HASH_CHUNK_SIZE = 1 << 20
+
+# Column files that make up a binary keypoints cache. Rows are sorted by track id and then by
+# frame, so the rows of one track are a contiguous slice described by `offsets`.
+TRACK_IDS_FILE = "track_ids.npy"
+OFFSETS_FILE = "offsets.npy"
+FRAMES_FILE = "frames.npy"
+BOXES_FILE = "boxes.npy"
+KEYPOINTS_FILE = "keypoints.npy"
+META_FILE = "meta.json"
+
+# The only settings the JSON caches of earlier versions were ever written with, and the suffix they
+# get once they have been converted
+LEGACY_SETTINGS = {"model": "yolov8n-pose.pt", "tracker": "botsort.yaml"}
+LEGACY_MIGRATED_SUFFIX = ".migrated"
+
+
+def video_cache_key(video_path, settings):
+    """
+    The function `video_cache_key` hashes the content of a video together with the settings used to
+    extract its keypoints.
+
+    :param video_path: The path to the video file
+    :param settings: A JSON serializable dictionary with the model and tracker settings
+    :return: a hex digest that changes whenever the video content or any of the settings change.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(video_path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    digest.update(json.dumps(settings, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def keypoints_cache_path(cache_dir, video_path, cache_key):
+    """
+    Returns the directory holding the binary cache of a video. The file name is kept as a prefix so
+    the cache directory stays readable, the content hash makes it unique.
+    """
+    video_name = os.path.splitext(os.path.basename(video_path))[0]
+    return os.path.join(cache_dir, f"{video_name}-{cache_key[:16]}")
+
+
+def legacy_json_cache_path(cache_dir, video_path):
+    """
+    Returns the path of the JSON cache written by earlier versions, which was keyed on the file name.
+    """
+    video_file_name = video_path.split("/")[-1]
+    return os.path.join(cache_dir, video_file_name.replace(".mp4", ".json"))
+
+
+def keypoints_data_to_arrays(keypoints_data):
+    """
+    The function `keypoints_data_to_arrays` packs the nested keypoints dictionary returned by
+    `get_key_points` (or loaded from a JSON cache) into columnar arrays.
+
+    :param keypoints_data: A dictionary of the form `{id: {frame: {"box": [...], "keypoints": [...]}}}`,
+    ids and frames may be integers or strings
+    :return: a dictionary with the `track_ids`, `offsets`, `frames`, `boxes` and `keypoints` arrays.
+    """
+    track_ids = sorted(keypoints_data, key=int)
+    offsets = [0]
+    frames, boxes, keypoints = [], [], []
+    for id in track_ids:
+        track = keypoints_data[id]
+        track_frames = sorted(track, key=int)
+        frames.extend(int(frame) for frame in track_frames)
+        boxes.extend(track[frame]["box"] for frame in track_frames)
+        keypoints.extend(track[frame]["keypoints"] for frame in track_frames)
+        offsets.append(len(frames))
+
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    keypoints = np.asarray(keypoints, dtype=np.float32)
+    keypoints = keypoints.reshape(len(frames), -1, 3) if keypoints.size else np.zeros((0, 17, 3), np.float32)
+    return {
+        "track_ids": np.asarray([int(id) for id in track_ids], dtype=np.int64),
+        "offsets": np.asarray(offsets, dtype=np.int64),
+        "frames": np.asarray(frames, dtype=np.int32),
+        "boxes": boxes,
+        "keypoints": keypoints,
+    }
+
+
+def write_keypoints_cache(cache_path, arrays, meta=None):
+    """
+    The function `write_keypoints_cache` writes columnar keypoints arrays as `.npy` files. The files
+    are written to a temporary directory which is then renamed, so readers never see a partial cache.
+
+    :param cache_path: The cache directory to create
+    :param arrays: The dictionary returned by `keypoints_data_to_arrays` or `tracks_to_arrays`
+    :param meta: Optional JSON serializable metadata stored next to the arrays
+    """
+    tmp_path = cache_path + ".tmp"
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    np.save(os.path.join(tmp_path, TRACK_IDS_FILE), arrays["track_ids"])
+    np.save(os.path.join(tmp_path, OFFSETS_FILE), arrays["offsets"])
+    np.save(os.path.join(tmp_path, FRAMES_FILE), arrays["frames"])
+    np.save(os.path.join(tmp_path, BOXES_FILE), arrays["boxes"])
+    np.save(os.path.join(tmp_path, KEYPOINTS_FILE), arrays["keypoints"])
+    with open(os.path.join(tmp_path, META_FILE), "w") as f:
+        json.dump(dict(meta or {}, version=CACHE_FORMAT_VERSION), f)
+
+    if os.path.exists(cache_path):
+        shutil.rmtree(cache_path)
+    os.replace(tmp_path, cache_path)
+
+
+def read_keypoints_cache(cache_path):
+    """
+    The function `read_keypoints_cache` opens a binary keypoints cache. The large columns are memory
+    mapped, so only the pages that are actually used are read from disk.
+
+    :param cache_path: The cache directory written by `write_keypoints_cache`
+    :return: a dictionary with the `track_ids`, `offsets`, `frames`, `boxes` and `keypoints` arrays.
+    """
+    return {
+        "track_ids": np.load(os.path.join(cache_path, TRACK_IDS_FILE)),
+        "offsets": np.load(os.path.join(cache_path, OFFSETS_FILE)),
+        "frames": np.load(os.path.join(cache_path, FRAMES_FILE), mmap_mode="r"),
+        "boxes": np.load(os.path.join(cache_path, BOXES_FILE), mmap_mode="r"),
+        "keypoints": np.load(os.path.join(cache_path, KEYPOINTS_FILE), mmap_mode="r"),
+    }
+
+
+def is_keypoints_cache(cache_path):
+    return os.path.exists(os.path.join(cache_path, META_FILE))
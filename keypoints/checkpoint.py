@@ -0,0 +1,236 @@
+import json
+import os
+import shutil
+
+import numpy as np
+
+from .track import TrackBuilder, tracks_from_rows
+from .yolo import MODEL_NAME
+
+CHUNK_SIZE = 500
+RESUME_OVERLAP = 30
+
+# Files of one chunk, one row per detection sorted by frame
+CHUNK_COLUMNS = ("ids", "frames", "boxes", "keypoints")
+MANIFEST_FILE = "chunks.jsonl"
+
+
+class ChunkedKeypointsCache:
+    """
+    An append-only keypoints cache made of chunks of consecutive frames, written while the keypoints
+    are extracted. Every chunk is a directory of `.npy` columns that is renamed into place once
+    complete, then recorded in `chunks.jsonl`; a chunk that is not recorded there is ignored, so the
+    cache is consistent whenever the extraction stops.
+
+    :param path: The directory of the cache, created if needed
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.chunks = []
+        self.complete = False
+        manifest_path = os.path.join(path, MANIFEST_FILE)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break  # line cut short by an interrupted run
+                    if record.get("complete"):
+                        self.complete = True
+                    else:
+                        self.chunks.append(record)
+
+    @property
+    def last_frame(self):
+        """
+        The last frame covered by the recorded chunks, 0 if there is none.
+        """
+        return self.chunks[-1]["last_frame"] if self.chunks else 0
+
+    @property
+    def next_id(self):
+        """
+        An id larger than every id stored so far.
+        """
+        return max((chunk["max_id"] for chunk in self.chunks), default=0) + 1
+
+    def _chunk_path(self, index):
+        return os.path.join(self.path, f"chunk-{index:06d}")
+
+    def append(self, first_frame, last_frame, ids, frames, boxes, keypoints):
+        """
+        Writes the detections of the frames `first_frame` to `last_frame` as a new chunk.
+        """
+        index = len(self.chunks)
+        chunk_path = self._chunk_path(index)
+        tmp_path = chunk_path + ".tmp"
+        for path in (tmp_path, chunk_path):
+            if os.path.exists(path):
+                shutil.rmtree(path)
+        os.makedirs(tmp_path)
+        for name, values in zip(CHUNK_COLUMNS, (ids, frames, boxes, keypoints)):
+            np.save(os.path.join(tmp_path, f"{name}.npy"), values)
+        os.replace(tmp_path, chunk_path)
+
+        record = {"index": index, "first_frame": int(first_frame), "last_frame": int(last_frame),
+                  "rows": len(frames), "max_id": int(ids.max(initial=0))}
+        self._record(record)
+        self.chunks.append(record)
+
+    def mark_complete(self):
+        """
+        Records that the whole video has been extracted.
+        """
+        self._record({"complete": True})
+        self.complete = True
+
+    def _record(self, record):
+        with open(os.path.join(self.path, MANIFEST_FILE), "a") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def read(self, first=None, last=None):
+        """
+        The function `read` loads the detections of the frames `first` to `last` (both inclusive).
+        Only the chunks overlapping that range are opened, and they are memory mapped.
+
+        :param first: The first frame, defaults to the start of the video (optional)
+        :param last: The last frame, defaults to the last frame extracted (optional)
+        :return: a dictionary mapping each integer id to its `KeypointTrack`.
+        """
+        first = 1 if first is None else first
+        last = self.last_frame if last is None else last
+        columns = {name: [] for name in CHUNK_COLUMNS}
+        for chunk in self.chunks:
+            if chunk["last_frame"] < first or chunk["first_frame"] > last:
+                continue
+            chunk_path = self._chunk_path(chunk["index"])
+            values = {name: np.load(os.path.join(chunk_path, f"{name}.npy"), mmap_mode="r")
+                      for name in CHUNK_COLUMNS}
+            # Rows are sorted by frame, the range is a contiguous slice
+            start = int(np.searchsorted(values["frames"], first, side="left"))
+            stop = int(np.searchsorted(values["frames"], last, side="right"))
+            for name in CHUNK_COLUMNS:
+                columns[name].append(values[name][start:stop])
+        if not columns["frames"]:
+            return {}
+        return tracks_from_rows(*(np.concatenate(columns[name]) for name in CHUNK_COLUMNS))
+
+    def remove(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+class _ChunkWriter:
+    # Collects the detections of consecutive frames and appends them to the cache every `chunk_size` frames
+    def __init__(self, cache, chunk_size):
+        self.cache = cache
+        self.chunk_size = chunk_size
+        self.first_frame = None
+        self.last_frame = None
+        self.rows = []
+
+    def add(self, frame, ids, boxes, keypoints):
+        if self.first_frame is None:
+            self.first_frame = frame
+        self.last_frame = frame
+        if len(ids):
+            self.rows.append((ids, np.full(len(ids), frame, dtype=np.int32), boxes, keypoints))
+        if frame - self.first_frame + 1 >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.first_frame is None:
+            return
+        if self.rows:
+            ids, frames, boxes, keypoints = (np.concatenate(column) for column in zip(*self.rows))
+        else:
+            ids, frames = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int32)
+            boxes, keypoints = np.zeros((0, 4), dtype=np.float32), np.zeros((0, 17, 3), dtype=np.float32)
+        self.cache.append(self.first_frame, self.last_frame, ids.astype(np.int64), frames,
+                          boxes.astype(np.float32), keypoints.astype(np.float32))
+        self.first_frame = self.last_frame = None
+        self.rows = []
+
+
+class _IdMapper:
+    # Maps the ids of a fresh tracker to the ids stored before the restart; new people get new ids
+    def __init__(self, mapping, next_id):
+        self.mapping = dict(mapping)
+        self.next_id = next_id
+
+    def __call__(self, ids):
+        mapped = np.empty(len(ids), dtype=np.int64)
+        for i, id in enumerate(ids.tolist()):
+            if id not in self.mapping:
+                self.mapping[id] = self.next_id
+                self.next_id += 1
+            mapped[i] = self.mapping[id]
+        return mapped
+
+
+def extract_keypoints_checkpointed(video_path, cache_path, model_name=MODEL_NAME, chunk_size=CHUNK_SIZE,
+                                   overlap=RESUME_OVERLAP, batch_size=1, progress=None):
+    """
+    The function `extract_keypoints_checkpointed` extracts the keypoints of a video into a
+    `ChunkedKeypointsCache`, flushing them every `chunk_size` frames, and resumes an interrupted
+    extraction after its last complete chunk.
+
+    The tracker state cannot be restored, so a resumed run starts a fresh tracker `overlap` frames
+    before the end of the last chunk. The tracks of those overlapping frames are matched to the
+    stored ones by box IoU (`match_tracks`) and the fresh tracker ids are mapped to the stored ids,
+    which keeps the ids continuous; people not matched get new ids.
+
+    :param video_path: The path to the video file
+    :param cache_path: The directory of the chunked cache
+    :param model_name: The pose model to use, defaults to yolov8n-pose.pt (optional)
+    :param chunk_size: The number of frames per chunk, defaults to 500 (optional)
+    :param overlap: The number of frames processed again when resuming, defaults to 30 (optional)
+    :param batch_size: The number of frames run through the model at once, defaults to 1 (optional)
+    :param progress: A function called with the frame number after every frame, like the one of
+    `get_key_points` (optional)
+    :return: the `ChunkedKeypointsCache`, complete.
+    """
+    from .stitching import match_tracks
+    from .video import read_frames
+    from .yolo import iter_key_points, iter_key_points_from_frames
+
+    cache = ChunkedKeypointsCache(cache_path)
+    if cache.complete:
+        return cache
+
+    writer = _ChunkWriter(cache, chunk_size)
+    resume_after = cache.last_frame
+    try:
+        if resume_after == 0:
+            print("***Getting keypoints data***")
+            for frame, ids, boxes, keypoints in iter_key_points(video_path, model_name, batch_size=batch_size):
+                writer.add(frame, ids, boxes, keypoints)
+                if progress is not None:
+                    progress(frame)
+        else:
+            start = max(resume_after - overlap + 1, 1)
+            print(f"***Resuming keypoints extraction after frame {resume_after}***")
+            stored = cache.read(start, resume_after)
+            replayed = TrackBuilder()
+            map_ids = None
+            for frame, ids, boxes, keypoints in iter_key_points_from_frames(read_frames(video_path, start),
+                                                                              model_name, batch_size):
+                if frame <= resume_after:
+                    replayed.add(frame, ids, boxes, keypoints)
+                    continue
+                if map_ids is None:
+                    map_ids = _IdMapper(match_tracks(stored, replayed.build()), cache.next_id)
+                writer.add(frame, map_ids(ids), boxes, keypoints)
+                if progress is not None:
+                    progress(frame)
+    except KeyboardInterrupt:
+        # Keep the frames of the current chunk, the next run resumes after them
+        writer.flush()
+        raise
+    writer.flush()
+    cache.mark_complete()
+    return cache
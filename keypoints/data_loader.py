@@ -1,11 +1,31 @@
 import json
 import os
+import shutil
+from functools import partial
 
-def load_keypoints_data(video_path, get_key_points_function, ignore_cache=False):
+from .cache import (LEGACY_MIGRATED_SUFFIX, LEGACY_SETTINGS, is_keypoints_cache, keypoints_cache_path,
+                    legacy_json_cache_path, read_keypoints_cache, video_cache_key, write_keypoints_cache)
+from .track import as_tracks, tracks_from_arrays, tracks_in_range, tracks_to_arrays
+from utils import profiling
+
+KEYPOINTS_CACHE_DIR = "keypoints_cache"
+CHUNKS_SUFFIX = ".chunks"
+
+
+def load_keypoints_data(video_path, get_key_points_function, ignore_cache=False,
+                        model_name="yolov8n-pose.pt", tracker="botsort.yaml",
+                        cache_dir=KEYPOINTS_CACHE_DIR, extra_settings=None, checkpoint_every=None,
+                        frame_range=None):
     """
     The function `load_keypoints_data` loads keypoints data from a cache file or generates it using a
     provided function if the cache file does not exist or if the `ignore_cache` flag is set to `True`.
-    
+
+    The cache is a directory of memory mapped `.npy` arrays keyed on a hash of the video content and
+    of the model and tracker settings. A JSON cache written by earlier versions, which was keyed on the
+    file name only, is converted once, when it is found with the default settings it was written
+    with, and then renamed to `*.json.migrated` so it is never picked up again for another video of
+    the same name.
+
     :param video_path: The path to the video file from which you want to extract keypoints
     :param get_key_points_function: The `get_key_points_function` is a function that takes the path of a
     video file as input and returns the key points data for that video. It is used to extract the key
@@ -14,19 +34,76 @@ def load_keypoints_data(video_path, get_key_points_function, ignore_cache=False)
     ignore the cached keypoints data or not. If `ignore_cache` is set to `True`, the function will
     always compute the keypoints data and overwrite the existing cache. If `ignore_cache` is set to
     `False` (default, defaults to False (optional)
-    :return: the keypoints data loaded from the cache file.
+    :param model_name: The pose model used by `get_key_points_function`, part of the cache key
+    :param tracker: The tracker configuration used by `get_key_points_function`, part of the cache key
+    :param cache_dir: The directory in which the caches are stored, defaults to keypoints_cache
+    :param extra_settings: Other settings of `get_key_points_function` that change its result, e.g. the
+    stride of `get_key_points_adaptive`, added to the cache key (optional)
+    :param checkpoint_every: If set, the keypoints are extracted by `extract_keypoints_checkpointed`,
+    flushing them every `checkpoint_every` frames to a chunked cache next to the final one; an
+    interrupted extraction is resumed by the next call. The chunks are removed once the final cache
+    is written. `get_key_points_function` must then be `get_key_points`, possibly wrapped in a
+    `functools.partial`, whose model, batch size and progress callback are kept; other extractors
+    raise a ValueError (optional)
+    :param frame_range: Only return the frames `(first, last)`, both inclusive. Since the arrays are
+    memory mapped, the rest of the cache is not read (optional)
+    :return: a dictionary mapping each track id to a `KeypointTrack` backed by the memory mapped
+    cache arrays.
     """
-    
-    keyppoints_cache_dir = "keypoints_cache"
-    video_file_name = video_path.split("/")[-1]
-    json_file_name = video_file_name.replace(".mp4", ".json")
-    keypoints_cache_file_path = os.path.join(
-        keyppoints_cache_dir, json_file_name)
-    
-    if not os.path.exists(keypoints_cache_file_path) or ignore_cache:
-        keypoints_data = get_key_points_function(path=video_path)
-        with open(keypoints_cache_file_path, "w") as f:
-            json.dump(keypoints_data, f)
-
-    with open(keypoints_cache_file_path, "r") as f:
-        return json.load(f)
+    checkpoint_options = _checkpoint_options(get_key_points_function, model_name) if checkpoint_every else None
+    settings = dict(extra_settings or {}, model=model_name, tracker=tracker)
+    with profiling.stage("cache.key"):
+        cache_key = video_cache_key(video_path, settings)
+    keypoints_cache_file_path = keypoints_cache_path(cache_dir, video_path, cache_key)
+    meta = {"video": os.path.basename(video_path), "key": cache_key, "settings": settings}
+
+    if ignore_cache or not is_keypoints_cache(keypoints_cache_file_path):
+        legacy_cache_file_path = legacy_json_cache_path(cache_dir, video_path)
+        adopt_legacy = (not ignore_cache and settings == LEGACY_SETTINGS
+                        and os.path.exists(legacy_cache_file_path))
+        if adopt_legacy:
+            with profiling.stage("cache.read_legacy_json"), open(legacy_cache_file_path, "r") as f:
+                keypoints_data = json.load(f)
+        else:
+            with profiling.stage("get_key_points"):
+                keypoints_data = _extract(video_path, get_key_points_function, keypoints_cache_file_path + CHUNKS_SUFFIX,
+                                          checkpoint_every, checkpoint_options, ignore_cache)
+        with profiling.stage("cache.write"):
+            os.makedirs(cache_dir, exist_ok=True)
+            write_keypoints_cache(keypoints_cache_file_path, tracks_to_arrays(as_tracks(keypoints_data)), meta)
+        if adopt_legacy:
+            os.replace(legacy_cache_file_path, legacy_cache_file_path + LEGACY_MIGRATED_SUFFIX)
+        if checkpoint_every:
+            shutil.rmtree(keypoints_cache_file_path + CHUNKS_SUFFIX, ignore_errors=True)
+
+    with profiling.stage("cache.read"):
+        tracks = tracks_from_arrays(read_keypoints_cache(keypoints_cache_file_path))
+    if frame_range is not None:
+        tracks = tracks_in_range(tracks, *frame_range)
+    return tracks
+
+
+def _checkpoint_options(get_key_points_function, model_name):
+    # The checkpointed extraction drives the model frame by frame itself, so it can only stand in for
+    # `get_key_points`; any other extractor would be silently replaced while its settings end up in
+    # the cache key
+    from .yolo import get_key_points
+
+    function, args, keywords = get_key_points_function, (), {}
+    if isinstance(function, partial):
+        function, args, keywords = function.func, function.args, function.keywords
+    if function is not get_key_points or args or set(keywords) - {"model_name", "batch_size", "progress"}:
+        raise ValueError("checkpoint_every only works with get_key_points (or a functools.partial of it "
+                         f"setting model_name, batch_size or progress), not with {get_key_points_function!r}")
+    return dict({"model_name": model_name}, **keywords)
+
+
+def _extract(video_path, get_key_points_function, chunks_path, checkpoint_every, checkpoint_options, ignore_cache):
+    if not checkpoint_every:
+        return get_key_points_function(path=video_path)
+    from .checkpoint import extract_keypoints_checkpointed
+
+    if ignore_cache:
+        shutil.rmtree(chunks_path, ignore_errors=True)
+    return extract_keypoints_checkpointed(video_path, chunks_path, chunk_size=checkpoint_every,
+                                          **checkpoint_options).read()
@@ -0,0 +1,139 @@
+import numpy as np
+
+from .track import KeypointTrack
+
+# Falloff of the keypoint similarity, relative to the box size; a pose a few percent off still scores high
+KEYPOINT_FALLOFF = 0.1
+
+
+def box_iou(boxes_a, boxes_b):
+    """
+    Returns the intersection over union of paired boxes in xyxy format, shape (n,).
+    """
+    x1 = np.maximum(boxes_a[:, 0], boxes_b[:, 0])
+    y1 = np.maximum(boxes_a[:, 1], boxes_b[:, 1])
+    x2 = np.minimum(boxes_a[:, 2], boxes_b[:, 2])
+    y2 = np.minimum(boxes_a[:, 3], boxes_b[:, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (boxes_a[:, 2] - boxes_a[:, 0]) * (boxes_a[:, 3] - boxes_a[:, 1])
+    area_b = (boxes_b[:, 2] - boxes_b[:, 0]) * (boxes_b[:, 3] - boxes_b[:, 1])
+    return intersection / np.maximum(area_a + area_b - intersection, 1e-9)
+
+
+def keypoint_similarity(boxes_a, keypoints_a, keypoints_b, min_confidence=0.3):
+    """
+    Returns the object keypoint similarity (OKS) of paired poses, shape (n,): the mean over the
+    keypoints seen in both poses of exp(-d^2 / (2 * s^2 * k^2)), where d is the distance between the
+    keypoints, s^2 the area of the box of the first pose and k = `KEYPOINT_FALLOFF`. Poses without a
+    common keypoint score 0.
+    """
+    keypoints_a = np.asarray(keypoints_a, dtype=np.float64)
+    keypoints_b = np.asarray(keypoints_b, dtype=np.float64)
+    boxes_a = np.asarray(boxes_a, dtype=np.float64)
+    area = np.maximum((boxes_a[:, 2] - boxes_a[:, 0]) * (boxes_a[:, 3] - boxes_a[:, 1]), 1.0)
+    distances = np.sum((keypoints_a[:, :, :2] - keypoints_b[:, :, :2]) ** 2, axis=2)
+    visible = (keypoints_a[:, :, 2] >= min_confidence) & (keypoints_b[:, :, 2] >= min_confidence)
+    similarity = np.exp(-distances / (2 * area[:, None] * KEYPOINT_FALLOFF ** 2))
+    count = visible.sum(axis=1)
+    return np.where(count > 0, (similarity * visible).sum(axis=1) / np.maximum(count, 1), 0.0)
+
+
+def track_similarity(track_a, track_b, keypoint_weight=0.0):
+    """
+    Returns the similarity of two tracks over the frames in which both were detected, or 0 if they
+    have no frame in common: the mean box IoU, blended with the mean `keypoint_similarity` of the
+    poses when `keypoint_weight` is above 0.
+    """
+    _, index_a, index_b = np.intersect1d(track_a.frames, track_b.frames, assume_unique=True, return_indices=True)
+    if len(index_a) == 0:
+        return 0.0
+    boxes_a = np.asarray(track_a.boxes[index_a])
+    score = float(box_iou(boxes_a, np.asarray(track_b.boxes[index_b])).mean())
+    if keypoint_weight > 0:
+        poses = keypoint_similarity(boxes_a, track_a.keypoints[index_a], track_b.keypoints[index_b])
+        score = (1 - keypoint_weight) * score + keypoint_weight * float(poses.mean())
+    return score
+
+
+def match_tracks(reference, candidates, min_similarity=0.3, keypoint_weight=0.0):
+    """
+    The function `match_tracks` matches the tracks of two tracker runs that cover some common frames,
+    e.g. a sparse and a dense pass over the same part of a video.
+
+    Every pair of tracks is scored with `track_similarity` and pairs are matched one to one, best
+    score first, as long as the score is at least `min_similarity`.
+
+    :param reference: A dictionary of `KeypointTrack` whose ids are kept
+    :param candidates: A dictionary of `KeypointTrack` whose ids are mapped
+    :param min_similarity: The minimum score of a match, defaults to 0.3 (optional)
+    :param keypoint_weight: The weight of the pose similarity in the score, see `track_similarity`,
+    defaults to 0 (optional)
+    :return: a dictionary mapping candidate ids to reference ids; unmatched candidates are left out.
+    """
+    scores = []
+    for candidate_id, candidate in candidates.items():
+        for reference_id, track in reference.items():
+            score = track_similarity(track, candidate, keypoint_weight)
+            if score >= min_similarity:
+                scores.append((score, candidate_id, reference_id))
+
+    mapping = {}
+    used = set()
+    for score, candidate_id, reference_id in sorted(scores, key=lambda item: -item[0]):
+        if candidate_id not in mapping and reference_id not in used:
+            mapping[candidate_id] = reference_id
+            used.add(reference_id)
+    return mapping
+
+
+def stitch_segments(segments, min_similarity=0.3, keypoint_weight=0.5):
+    """
+    The function `stitch_segments` joins the tracks of consecutive, overlapping parts of a video that
+    were tracked independently into tracks with ids that are consistent over the whole video.
+
+    The tracks of each segment are matched to the tracks of the previous one on the frames both
+    segments cover (`match_tracks`, with box IoU and pose similarity) and take over their ids;
+    tracks that do not match get new ids. Each overlap is then split in the middle: the frames
+    before it are taken from the earlier segment, the others from the later one.
+
+    :param segments: A list of `(start, stop, tracks)` tuples ordered by `start`, where `start` and
+    `stop` are the first and last frame of the segment and `tracks` a dictionary of `KeypointTrack`
+    :param min_similarity: The minimum score of a match, defaults to 0.3 (optional)
+    :param keypoint_weight: The weight of the pose similarity in the score, defaults to 0.5 (optional)
+    :return: a dictionary mapping each integer id to its `KeypointTrack`, ordered by id.
+    """
+    pieces = {}
+    next_id = 1
+    previous = None
+    for index, (start, stop, tracks) in enumerate(segments):
+        mapping = {}
+        if previous is not None:
+            previous_start, previous_stop, previous_tracks = previous
+            overlap = (max(start, previous_start), min(stop, previous_stop))
+            if overlap[0] <= overlap[1]:
+                mapping = match_tracks({id: track.between(*overlap) for id, track in previous_tracks.items()},
+                                       {id: track.between(*overlap) for id, track in tracks.items()},
+                                       min_similarity, keypoint_weight)
+        renamed = {}
+        for id in sorted(tracks):
+            if id in mapping:
+                renamed[mapping[id]] = tracks[id]
+            else:
+                renamed[next_id] = tracks[id]
+                next_id += 1
+        # The frames of an overlap are split in the middle between the two segments
+        first = start if index == 0 else (start + segments[index - 1][1]) // 2 + 1
+        last = stop if index == len(segments) - 1 else (segments[index + 1][0] + stop) // 2
+        for id, track in renamed.items():
+            pieces.setdefault(id, []).append(track.between(first, last))
+        previous = (start, stop, renamed)
+
+    stitched = {}
+    for id in sorted(pieces):
+        id_pieces = [piece for piece in pieces[id] if len(piece)]
+        if not id_pieces:
+            continue
+        stitched[id] = KeypointTrack(id, np.concatenate([piece.frames for piece in id_pieces]),
+                                     np.concatenate([piece.boxes for piece in id_pieces]),
+                                     np.concatenate([piece.keypoints for piece in id_pieces]))
+    return stitched
@@ -0,0 +1,241 @@
+import numpy as np
+
+from .cache import keypoints_data_to_arrays
+
+
+class KeypointTrack:
+    """
+    The keypoints of one tracked person stored as contiguous arrays, one row per frame in which the
+    person was detected.
+
+    :param track_id: The tracker id of the person
+    :param frames: Sorted frame numbers, shape (n,)
+    :param boxes: Bounding boxes in xyxy format, shape (n, 4)
+    :param keypoints: Keypoints as (x, y, confidence), shape (n, 17, 3)
+    """
+
+    __slots__ = ("track_id", "frames", "boxes", "keypoints")
+
+    def __init__(self, track_id, frames, boxes, keypoints):
+        self.track_id = int(track_id)
+        self.frames = frames
+        self.boxes = boxes
+        self.keypoints = keypoints
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __contains__(self, frame):
+        return self.index_of(frame) is not None
+
+    def __repr__(self):
+        return f"KeypointTrack(id={self.track_id}, frames={len(self)})"
+
+    @property
+    def nbytes(self):
+        return self.frames.nbytes + self.boxes.nbytes + self.keypoints.nbytes
+
+    def index_of(self, frame):
+        """
+        Returns the row holding `frame`, or None if the person was not detected in that frame.
+        """
+        i = int(np.searchsorted(self.frames, frame))
+        if i < len(self.frames) and self.frames[i] == frame:
+            return i
+        return None
+
+    def get(self, frame):
+        """
+        Returns the `(box, keypoints)` pair of `frame`, or None if the person was not detected in
+        that frame.
+        """
+        i = self.index_of(frame)
+        if i is None:
+            return None
+        return self.boxes[i], self.keypoints[i]
+
+    def joint(self, index):
+        """
+        Returns the (x, y) trajectory of one keypoint as a view of shape (n, 2).
+        """
+        return self.keypoints[:, index, :2]
+
+    def between(self, first, last):
+        """
+        Returns the part of the track from frame `first` to frame `last` (both inclusive) as a new
+        `KeypointTrack` made of views, so a memory mapped track is not read beyond that range.
+        """
+        start = int(np.searchsorted(self.frames, first, side="left"))
+        stop = int(np.searchsorted(self.frames, last, side="right"))
+        return KeypointTrack(self.track_id, self.frames[start:stop], self.boxes[start:stop],
+                             self.keypoints[start:stop])
+
+
+def tracks_from_arrays(arrays):
+    """
+    The function `tracks_from_arrays` splits columnar keypoints arrays into one `KeypointTrack` per
+    id. The tracks are views of the input arrays, so memory mapped columns are not copied.
+
+    :param arrays: A dictionary with the `track_ids`, `offsets`, `frames`, `boxes` and `keypoints` arrays
+    :return: a dictionary mapping each integer id to its `KeypointTrack`.
+    """
+    tracks = {}
+    offsets = arrays["offsets"]
+    for i, id in enumerate(arrays["track_ids"].tolist()):
+        start, end = int(offsets[i]), int(offsets[i + 1])
+        tracks[id] = KeypointTrack(id, arrays["frames"][start:end], arrays["boxes"][start:end],
+                                   arrays["keypoints"][start:end])
+    return tracks
+
+
+def tracks_to_arrays(tracks):
+    """
+    Concatenates a dictionary of `KeypointTrack` back into columnar arrays, ordered by id.
+    """
+    ordered = [tracks[id] for id in sorted(tracks)]
+    offsets = np.zeros(len(ordered) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(track) for track in ordered])
+    if not ordered:
+        return {
+            "track_ids": np.zeros(0, dtype=np.int64),
+            "offsets": offsets,
+            "frames": np.zeros(0, dtype=np.int32),
+            "boxes": np.zeros((0, 4), dtype=np.float32),
+            "keypoints": np.zeros((0, 17, 3), dtype=np.float32),
+        }
+    return {
+        "track_ids": np.asarray([track.track_id for track in ordered], dtype=np.int64),
+        "offsets": offsets,
+        "frames": np.concatenate([track.frames for track in ordered]).astype(np.int32, copy=False),
+        "boxes": np.concatenate([track.boxes for track in ordered]).astype(np.float32, copy=False),
+        "keypoints": np.concatenate([track.keypoints for track in ordered]).astype(np.float32, copy=False),
+    }
+
+
+class _TrackBuffer:
+    """
+    Growable arrays holding the rows of one track. The capacity doubles when it is full, so appending
+    a row is amortized O(1) and never goes through Python lists.
+    """
+
+    __slots__ = ("frames", "boxes", "keypoints", "size")
+
+    def __init__(self, capacity, keypoints_shape):
+        self.frames = np.empty(capacity, dtype=np.int32)
+        self.boxes = np.empty((capacity, 4), dtype=np.float32)
+        self.keypoints = np.empty((capacity, *keypoints_shape), dtype=np.float32)
+        self.size = 0
+
+    def append(self, frame, box, keypoints):
+        if self.size == len(self.frames):
+            self._grow(2 * len(self.frames))
+        self.frames[self.size] = frame
+        self.boxes[self.size] = box
+        self.keypoints[self.size] = keypoints
+        self.size += 1
+
+    def _grow(self, capacity):
+        for name in ("frames", "boxes", "keypoints"):
+            old = getattr(self, name)
+            new = np.empty((capacity, *old.shape[1:]), dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def trimmed(self, track_id):
+        # Copies the rows to arrays of the exact size so the spare capacity is freed
+        return KeypointTrack(track_id, self.frames[:self.size].copy(), self.boxes[:self.size].copy(),
+                             self.keypoints[:self.size].copy())
+
+
+class TrackBuilder:
+    """
+    Collects per-frame detections into one `KeypointTrack` per id, writing them straight into
+    preallocated arrays.
+
+    :param capacity: The initial number of rows of every track, defaults to 256 (optional)
+    """
+
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self._buffers = {}
+
+    def add(self, frame, ids, boxes, keypoints):
+        """
+        Appends the detections of one frame, with `ids` of shape (n,), `boxes` of shape (n, 4) and
+        `keypoints` of shape (n, 17, 3).
+        """
+        buffers = self._buffers
+        for i, id in enumerate(ids.tolist() if hasattr(ids, "tolist") else ids):
+            buffer = buffers.get(id)
+            if buffer is None:
+                buffer = buffers[id] = _TrackBuffer(self.capacity, np.shape(keypoints)[1:])
+            buffer.append(frame, boxes[i], keypoints[i])
+
+    def build(self):
+        """
+        Returns the collected tracks as a dictionary mapping each integer id to its `KeypointTrack`,
+        and empties the builder.
+        """
+        tracks = {}
+        buffers, self._buffers = self._buffers, {}
+        # The ids keep the order in which they first appeared
+        for id in list(buffers):
+            tracks[int(id)] = buffers.pop(id).trimmed(id)
+        return tracks
+
+
+def tracks_from_frames(frames, capacity=256):
+    """
+    The function `tracks_from_frames` collects per-frame detections into one `KeypointTrack` per id.
+
+    :param frames: An iterable of `(frame, ids, boxes, keypoints)` tuples, as yielded by `iter_key_points`
+    :param capacity: The initial number of rows allocated for every track, defaults to 256 (optional)
+    :return: a dictionary mapping each integer id to its `KeypointTrack`.
+    """
+    builder = TrackBuilder(capacity)
+    for frame, ids, boxes, keypoints in frames:
+        builder.add(frame, ids, boxes, keypoints)
+    return builder.build()
+
+
+def tracks_in_range(tracks, first, last):
+    """
+    Returns the tracks restricted to the frames `first` to `last` (both inclusive), see
+    `KeypointTrack.between`. Tracks without any frame in that range are left out.
+    """
+    ranged = {id: track.between(first, last) for id, track in tracks.items()}
+    return {id: track for id, track in ranged.items() if len(track)}
+
+
+def tracks_from_rows(ids, frames, boxes, keypoints):
+    """
+    The function `tracks_from_rows` groups detection rows of any order into one `KeypointTrack` per
+    id, with the rows of every track sorted by frame.
+
+    :param ids: The track id of every row, shape (n,)
+    :param frames: The frame of every row, shape (n,)
+    :param boxes: Shape (n, 4)
+    :param keypoints: Shape (n, 17, 3)
+    :return: a dictionary mapping each integer id to its `KeypointTrack`, ordered by id.
+    """
+    order = np.lexsort((frames, ids))
+    ids = np.asarray(ids)[order]
+    unique_ids, starts = np.unique(ids, return_index=True)
+    ends = np.append(starts[1:], len(ids))
+    frames = np.asarray(frames, dtype=np.int32)[order]
+    boxes = np.asarray(boxes, dtype=np.float32)[order]
+    keypoints = np.asarray(keypoints, dtype=np.float32)[order]
+    return {int(id): KeypointTrack(id, frames[start:end], boxes[start:end], keypoints[start:end])
+            for id, start, end in zip(unique_ids.tolist(), starts.tolist(), ends.tolist())}
+
+
+def as_tracks(keypoints_data):
+    """
+    The function `as_tracks` returns `keypoints_data` as a dictionary of `KeypointTrack`. Nested
+    `{id: {frame: {"box": ..., "keypoints": ...}}}` dictionaries, as returned by earlier versions of
+    `get_key_points` and stored in the old JSON caches, are converted; track dictionaries are returned
+    unchanged.
+    """
+    if all(isinstance(track, KeypointTrack) for track in keypoints_data.values()):
+        return keypoints_data
+    return tracks_from_arrays(keypoints_data_to_arrays(keypoints_data))
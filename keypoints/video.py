@@ -0,0 +1,38 @@
+import cv2
+
+
+def video_properties(video_path):
+    """
+    Returns the frame rate, frame count, width and height of a video.
+    """
+    video = cv2.VideoCapture(video_path)
+    try:
+        return (video.get(cv2.CAP_PROP_FPS) or 30, int(video.get(cv2.CAP_PROP_FRAME_COUNT)),
+                int(video.get(cv2.CAP_PROP_FRAME_WIDTH)), int(video.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    finally:
+        video.release()
+
+
+def read_frames(video_path, start=1, stop=None):
+    """
+    The function `read_frames` decodes the frames `start` to `stop` (inclusive, numbered from 1 like
+    everywhere else in the project) of a video, seeking directly to `start`.
+
+    :param video_path: The path to the video file
+    :param start: The first frame to decode, defaults to 1 (optional)
+    :param stop: The last frame to decode, defaults to the end of the video (optional)
+    :return: a generator of `(frame, image)` tuples.
+    """
+    video = cv2.VideoCapture(video_path)
+    try:
+        if start > 1:
+            video.set(cv2.CAP_PROP_POS_FRAMES, start - 1)
+        frame = start
+        while stop is None or frame <= stop:
+            ret, image = video.read()
+            if not ret:
+                break
+            yield frame, image
+            frame += 1
+    finally:
+        video.release()
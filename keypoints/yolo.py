@@ -1,37 +1,192 @@
-from ultralytics import YOLO
-from tqdm import tqdm
+import numpy as np
 
-model = YOLO("yolov8n-pose.pt")
+from utils import profiling
 
-def get_key_points(path="test_videos/test1.mp4"):
+from .track import TrackBuilder
+
+MODEL_NAME = "yolov8n-pose.pt"
+TRACKER = "botsort.yaml"
+
+_models = {}
+
+
+def load_model(model_name=MODEL_NAME):
+    """
+    Returns the pose model `model_name`, loading it on the first call. Later calls in the same process
+    reuse the loaded model. `ultralytics` is only imported here, so importing this module stays cheap
+    when the keypoints come from the cache.
+    """
+    if model_name not in _models:
+        from ultralytics import YOLO
+        _models[model_name] = YOLO(model_name)
+    return _models[model_name]
+
+
+def iter_key_points(path="test_videos/test1.mp4", model_name=MODEL_NAME, vid_stride=1, batch_size=1):
+    """
+    The function `iter_key_points` runs the pose model and tracker on a video and yields the results
+    frame by frame, as soon as each frame has been processed.
+
+    :param path: The path to the video file, or any other source supported by the model
+    :param model_name: The pose model to use, defaults to yolov8n-pose.pt (optional)
+    :param vid_stride: Only every `vid_stride`-th frame is processed, starting with frame `vid_stride`,
+    defaults to 1 (optional)
+    :param batch_size: The number of frames run through the model at once. Batches keep all CPU cores
+    busy during inference; the tracker still sees the frames one by one and in order, defaults to 1
+    (optional)
+    :return: a generator of `(frame, ids, boxes, keypoints)` tuples, where `frame` is the frame number
+    starting at 1, `ids` is an integer array, `boxes` has shape (n, 4) and `keypoints` has shape
+    (n, 17, 3).
+    """
+    options = {"batch": batch_size} if batch_size > 1 else {}
+    results = load_model(model_name).track(source = path, save=False, show=False, tracker=TRACKER, stream=True,
+                                           verbose=False, vid_stride=vid_stride, **options)
+
+    # The video loader grabs `vid_stride` frames before each one it returns, so the frames processed
+    # are vid_stride, 2 * vid_stride, ... (1, 2, ... without a stride)
+    frame_count = 0
+    for result in profiling.iterate(results, "yolo.track"):
+        frame_count += vid_stride
+        _record_speed(result)
+        with profiling.stage("yolo.to_numpy"):
+            arrays = result_arrays(result)
+        yield (frame_count, *arrays)
+
+
+def _record_speed(result):
+    # Splits the time of a tracked frame into the model stages timed by ultralytics (in ms) and the
+    # rest, i.e. decoding and tracking
+    profiler = profiling.active()
+    if profiler is None:
+        return
+    speed = getattr(result, "speed", None) or {}
+    for name, milliseconds in speed.items():
+        if milliseconds is not None:
+            profiler.record(f"yolo.{name}", milliseconds / 1000)
+    model_time = sum(milliseconds or 0 for milliseconds in speed.values()) / 1000
+    profiler.record("yolo.decode_and_tracking", max(profiler.last("yolo.track") - model_time, 0.0))
+
+
+def result_arrays(result):
+    """
+    Returns the ids, boxes and keypoints of one tracking result as arrays, empty if nothing is tracked.
+    """
+    if result.boxes.id is None:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, 4), dtype=np.float32), np.zeros((0, 17, 3), dtype=np.float32)
+    ids = result.boxes.id.cpu().numpy().astype(np.int64)
+    boxes = result.boxes.xyxy.cpu().numpy()
+    keypoints = result.keypoints.data.cpu().numpy()
+    return ids, boxes, keypoints
+
+
+def track_frame(frame, model_name=MODEL_NAME):
+    """
+    The function `track_frame` runs the pose model and tracker on one decoded frame. The tracker state
+    is kept between calls, so consecutive frames of a video keep their ids.
+
+    :param frame: A BGR image, as returned by `cv2.VideoCapture.read`
+    :param model_name: The pose model to use, defaults to yolov8n-pose.pt (optional)
+    :return: the ids, boxes and keypoints arrays of the frame.
     """
-    The function `get_key_points` takes a video path as input and returns a dictionary containing
-    keypoints data for each frame and each object ID in the video.
+    model = load_model(model_name)
+    with profiling.stage("yolo.track"):
+        result = model.track(source=frame, save=False, show=False, tracker=TRACKER, persist=True, verbose=False)[0]
+    _record_speed(result)
+    with profiling.stage("yolo.to_numpy"):
+        return result_arrays(result)
+
+
+def track_frames(images, model_name=MODEL_NAME):
+    """
+    The function `track_frames` runs the pose model on several consecutive decoded frames at once and
+    the tracker on each of them in order, keeping the tracker state between calls like `track_frame`.
+
+    :param images: A list of BGR images
+    :param model_name: The pose model to use, defaults to yolov8n-pose.pt (optional)
+    :return: a list with the ids, boxes and keypoints arrays of every frame.
+    """
+    model = load_model(model_name)
+    with profiling.stage("yolo.track"):
+        results = model.track(source=list(images), save=False, show=False, tracker=TRACKER, persist=True,
+                              verbose=False)
+    arrays = []
+    for result in results:
+        _record_speed(result)
+        with profiling.stage("yolo.to_numpy"):
+            arrays.append(result_arrays(result))
+    return arrays
+
+
+def iter_key_points_from_frames(frames, model_name=MODEL_NAME, batch_size=1):
+    """
+    The function `iter_key_points_from_frames` runs the pose model and a fresh tracker on already
+    decoded frames, e.g. a window returned by `read_frames`.
+
+    :param frames: An iterable of `(frame, image)` tuples
+    :param model_name: The pose model to use, defaults to yolov8n-pose.pt (optional)
+    :param batch_size: The number of frames run through the model at once, see `iter_key_points`,
+    defaults to 1 (optional)
+    :return: a generator of `(frame, ids, boxes, keypoints)` tuples, like `iter_key_points`.
+    """
+    reset_tracker(model_name)
+    if batch_size <= 1:
+        for frame, image in frames:
+            yield (frame, *track_frame(image, model_name))
+        return
+    batch = []
+    for item in frames:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield from _track_batch(batch, model_name)
+            batch = []
+    yield from _track_batch(batch, model_name)
+
+
+def _track_batch(batch, model_name):
+    if not batch:
+        return
+    for (frame, _), arrays in zip(batch, track_frames([image for _, image in batch], model_name)):
+        yield (frame, *arrays)
+
+
+def reset_tracker(model_name=MODEL_NAME):
+    """
+    Clears the tracker state kept by `track_frame`, call it before starting a new video.
+    """
+    predictor = getattr(_models.get(model_name), "predictor", None)
+    for tracker in getattr(predictor, "trackers", None) or []:
+        tracker.reset()
+
+
+def get_key_points(path="test_videos/test1.mp4", model_name=MODEL_NAME, batch_size=1, progress=None):
+    """
+    The function `get_key_points` takes a video path as input and returns the keypoints data of each
+    object ID in the video.
+
+    The detections of every frame are written straight into growable arrays, one set per ID, without
+    going through Python lists.
     
     :param path: The `path` parameter is the path to the video file from which you want to extract
     keypoints data. By default, it is set to "test_videos/test1.mp4", defaults to test_videos/test1.mp4
     (optional)
-    :return: a dictionary containing keypoints data for each id in each frame of the video.
+    :param model_name: The pose model to use, defaults to yolov8n-pose.pt (optional)
+    :param batch_size: The number of frames run through the model at once, see `iter_key_points`,
+    defaults to 1 (optional)
+    :param progress: A function called with the frame number after every frame, e.g. to report the
+    progress of a job (optional)
+    :return: a dictionary mapping each ID to a `KeypointTrack` holding the frame numbers, boxes and
+    keypoints of every frame in which the ID was detected.
     """
     
+    from tqdm import tqdm
+
     print("***Getting keypoints data***")
-    results = model.track(source = path, save=False, show=False, tracker="botsort.yaml", stream=True, verbose=False)
 
-    # dictionary to store keypoints data against each id for all frames
-    keypoints_data = {}
-    frame_count = 0
-    for result in tqdm(results):
-        frame_count += 1
-        ids = result.boxes.id.cpu().numpy().tolist() if result.boxes.id is not None else []
-        ids = [int(id) for id in ids]
-        boxes = result.boxes.xyxy.cpu().numpy().tolist() if result.boxes.xyxy is not None else []
-        keypoints = result.keypoints.data.cpu().numpy().tolist() if result.keypoints.data is not None else []
-        for i, id in enumerate(ids):
-            if id not in keypoints_data:
-                keypoints_data[id] = {}
-            keypoints_data[id][frame_count] = {
-                "box": boxes[i],
-                "keypoints": keypoints[i]
-            }
-
-    return keypoints_data
\ No newline at end of file
+    builder = TrackBuilder()
+    for frame_count, ids, boxes, keypoints in tqdm(iter_key_points(path, model_name, batch_size=batch_size)):
+        with profiling.stage("get_key_points.collect"):
+            builder.add(frame_count, ids, boxes, keypoints)
+        if progress is not None:
+            progress(frame_count)
+
+    return builder.build()
@@ -1,10 +1,11 @@
+import sys
 import cv2
 from analyzer import analyze_jump
 from utils.visualization import save_and_show_output
 from keypoints.data_loader import load_keypoints_data
 from keypoints.yolo import get_key_points
 
-video_path = "test_videos/test1.mp4"
+video_path = sys.argv[1] if len(sys.argv) > 1 else "test_videos/test1.mp4"
 video = cv2.VideoCapture(video_path)
 fps = video.get(cv2.CAP_PROP_FPS)
 
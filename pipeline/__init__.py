@@ -0,0 +1,15 @@
+def __getattr__(name):
+    # The pipelines pull in cv2 and the pose model, only import them when they are used
+    if name == "run_single_pass":
+        from .single_pass import run_single_pass
+        return run_single_pass
+    if name == "run_batch":
+        from .batch import run_batch
+        return run_batch
+    if name == "get_key_points_segmented":
+        from .segmented import get_key_points_segmented
+        return get_key_points_segmented
+    if name == "AnalysisService":
+        from .service import AnalysisService
+        return AnalysisService
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
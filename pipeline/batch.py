@@ -0,0 +1,283 @@
+import argparse
+import csv
+import glob
+import json
+import multiprocessing
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".avi", ".mkv", ".webm")
+JUMP_FIELDS = ["jumping", "launch_frame", "landing_frame", "jump_height", "launch_velocity"]
+CSV_FIELDS = ["video", "id"] + JUMP_FIELDS
+MAX_ATTEMPTS = 2
+
+# Set in a worker process by `_init_worker` when the pose model could not be loaded
+_init_error = None
+
+
+def find_videos(source, extensions=VIDEO_EXTENSIONS):
+    """
+    Returns the sorted video files of a directory, or the files matching a glob pattern.
+    """
+    if os.path.isdir(source):
+        paths = [os.path.join(source, name) for name in os.listdir(source)]
+    else:
+        paths = glob.glob(source, recursive=True)
+    return sorted(path for path in paths if os.path.isfile(path) and path.lower().endswith(extensions))
+
+
+def to_json_value(value):
+    """
+    Converts NumPy scalars (and lists or dictionaries of them) in `jump_data` to plain Python values.
+    """
+    if isinstance(value, dict):
+        return {key: to_json_value(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_json_value(item) for item in value]
+    if hasattr(value, "item"):
+        return value.item()
+    return value
+
+
+def _init_worker(model_name):
+    # Load the model once per worker process, every video handled by this worker reuses it. An error
+    # would kill the worker and be reported as a dead worker, so it is kept for the videos to raise.
+    global _init_error
+    from keypoints.yolo import load_model
+    try:
+        load_model(model_name)
+    except Exception:
+        _init_error = traceback.format_exc(limit=5)
+
+
+def analyze_video(video_path, model_name, cache_dir, ignore_cache=False, batch_size=1, checkpoint_every=None,
+                  progress=None):
+    """
+    The function `analyze_video` extracts the keypoints of one video (or loads them from the cache)
+    and analyses the jumps.
+
+    :param video_path: The path to the video file
+    :param model_name: The pose model to use
+    :param cache_dir: The keypoints cache directory
+    :param ignore_cache: If True, the keypoints are extracted even if they are cached
+    :param batch_size: The number of frames run through the model at once, defaults to 1 (optional)
+    :param checkpoint_every: If set, the extraction is checkpointed every `checkpoint_every` frames and
+    an interrupted one is resumed, see `load_keypoints_data` (optional)
+    :param progress: A function called with the frame number after every extracted frame, see
+    `get_key_points`; it is not called when the keypoints come from the cache (optional)
+    :return: the `jump_data` dictionary, with plain Python values.
+    """
+    if _init_error is not None:
+        raise RuntimeError(f"The pose model {model_name} could not be loaded:\n{_init_error}")
+
+    import cv2
+    from analyzer import analyze_jump
+    from keypoints.data_loader import load_keypoints_data
+    from keypoints.yolo import get_key_points
+
+    video = cv2.VideoCapture(video_path)
+    fps = video.get(cv2.CAP_PROP_FPS) or 30
+    video.release()
+
+    get_key_points_function = partial(get_key_points, model_name=model_name, batch_size=batch_size,
+                                      progress=progress)
+    keypoints_data = load_keypoints_data(video_path, get_key_points_function, ignore_cache=ignore_cache,
+                                         model_name=model_name, cache_dir=cache_dir,
+                                         checkpoint_every=checkpoint_every)
+    return to_json_value(analyze_jump(keypoints_data, fps, batch=True, verbose=False))
+
+
+def process_video(video_path, model_name, cache_dir, ignore_cache=False, batch_size=1, checkpoint_every=None):
+    """
+    The function `process_video` analyses one video with `analyze_video` and returns one result row
+    per tracked ID.
+
+    :param video_path: The path to the video file
+    :param model_name: The pose model to use
+    :param cache_dir: The keypoints cache directory
+    :param ignore_cache: If True, the keypoints are extracted even if they are cached
+    :param batch_size: The number of frames run through the model at once, defaults to 1 (optional)
+    :param checkpoint_every: If set, the extraction is checkpointed every `checkpoint_every` frames and
+    an interrupted one is resumed, see `load_keypoints_data` (optional)
+    :return: a list of dictionaries with the video path, the ID and the `jump_data` fields.
+    """
+    jump_data = analyze_video(video_path, model_name, cache_dir, ignore_cache, batch_size, checkpoint_every)
+    return [dict(video=video_path, id=int(id), **entry) for id, entry in jump_data.items()]
+
+
+def _video_key(video_path):
+    stat = os.stat(video_path)
+    return f"{os.path.abspath(video_path)}:{stat.st_size}:{int(stat.st_mtime)}"
+
+
+def read_manifest(manifest_path):
+    """
+    Returns the keys of the videos that were processed successfully according to the manifest.
+    """
+    done = set()
+    if not os.path.exists(manifest_path):
+        return done
+    with open(manifest_path, "r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # line cut short by an interrupted run
+            if record.get("status") == "done":
+                done.add(record["key"])
+    return done
+
+
+class _ResultSink:
+    """
+    Appends result rows to a JSONL or CSV file (chosen by extension) and records each finished video in
+    the manifest. Everything is flushed after every video, so an interrupted run loses nothing.
+    """
+
+    def __init__(self, output_path, manifest_path):
+        self.csv = output_path.lower().endswith(".csv")
+        new_file = not os.path.exists(output_path) or os.path.getsize(output_path) == 0
+        self.output = open(output_path, "a", newline="")
+        self.manifest = open(manifest_path, "a")
+        if self.csv:
+            self.writer = csv.DictWriter(self.output, fieldnames=CSV_FIELDS, extrasaction="ignore")
+            if new_file:
+                self.writer.writeheader()
+
+    def write(self, video_path, rows):
+        for row in rows:
+            if self.csv:
+                self.writer.writerow(row)
+            else:
+                self.output.write(json.dumps(row) + "\n")
+        self.output.flush()
+        self._record(video_path, "done")
+
+    def fail(self, video_path, error):
+        self._record(video_path, "failed", error)
+
+    def _record(self, video_path, status, error=None):
+        record = {"video": video_path, "key": _video_key(video_path), "status": status}
+        if error is not None:
+            record["error"] = error
+        self.manifest.write(json.dumps(record) + "\n")
+        self.manifest.flush()
+
+    def close(self):
+        self.output.close()
+        self.manifest.close()
+
+
+def run_batch(videos, output_path, workers=None, model_name="yolov8n-pose.pt", cache_dir="keypoints_cache",
+              ignore_cache=False, manifest_path=None, batch_size=1, checkpoint_every=None):
+    """
+    The function `run_batch` analyses many videos on a pool of worker processes. Every worker loads
+    the pose model once and reuses it for all the videos it handles. Results are appended to
+    `output_path` as soon as each video finishes; a failing video is recorded in the manifest and does
+    not stop the others. When a worker process dies, the videos that were unfinished on its pool are
+    retried one at a time, each on a new pool of its own. If the pose model cannot be loaded, every
+    video fails with the error of the model. Videos already marked as done in the manifest are
+    skipped, so an interrupted batch can simply be started again.
+
+    :param videos: The paths of the videos to analyse
+    :param output_path: A `.jsonl` or `.csv` file to which the result rows are appended
+    :param workers: The number of worker processes, defaults to the number of CPUs (optional)
+    :param model_name: The pose model to use, defaults to yolov8n-pose.pt (optional)
+    :param cache_dir: The keypoints cache directory, defaults to keypoints_cache (optional)
+    :param ignore_cache: If True, keypoints are extracted even if they are cached, defaults to False
+    (optional)
+    :param manifest_path: The manifest file, defaults to `output_path` + ".manifest.jsonl" (optional)
+    :param batch_size: The number of frames each worker runs through the model at once, defaults to 1
+    (optional)
+    :param checkpoint_every: Checkpoint the extraction of every video every `checkpoint_every` frames,
+    so a video interrupted by a crash resumes where it stopped (optional)
+    :return: a tuple with the number of processed, failed and skipped videos.
+    """
+    manifest_path = manifest_path or output_path + ".manifest.jsonl"
+    done = read_manifest(manifest_path)
+    pending = [video for video in videos if _video_key(video) not in done]
+    skipped = len(videos) - len(pending)
+    attempts = {video: 0 for video in pending}
+    processed = failed = 0
+
+    sink = _ResultSink(output_path, manifest_path)
+    context = multiprocessing.get_context("spawn")
+    try:
+        isolated = False
+        while pending:
+            retry = []
+            # A worker that dies breaks every unfinished future of its pool, not just its own. The
+            # videos caught in it are retried one per pool, so only the one that kills its worker
+            # fails again.
+            groups = [[video] for video in pending] if isolated else [pending]
+            for group in groups:
+                with ProcessPoolExecutor(max_workers=1 if isolated else workers, mp_context=context,
+                                         initializer=_init_worker, initargs=(model_name,)) as pool:
+                    futures = {pool.submit(process_video, video, model_name, cache_dir, ignore_cache,
+                                           batch_size, checkpoint_every): video
+                               for video in group}
+                    for future in as_completed(futures):
+                        video = futures[future]
+                        try:
+                            rows = future.result()
+                        except BrokenProcessPool:
+                            attempts[video] += 1
+                            if attempts[video] < MAX_ATTEMPTS:
+                                retry.append(video)
+                            else:
+                                sink.fail(video, "worker process died")
+                                failed += 1
+                                print(f"Failed: {video}")
+                        except Exception:
+                            sink.fail(video, traceback.format_exc(limit=5))
+                            failed += 1
+                            print(f"Failed: {video}")
+                        else:
+                            sink.write(video, rows)
+                            processed += 1
+                            print(f"Done: {video} ({processed + failed}/{len(videos) - skipped})")
+            isolated = True
+            pending = retry
+    finally:
+        sink.close()
+    return processed, failed, skipped
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyse the jumps in a directory of videos.")
+    parser.add_argument("source", help="a directory of videos or a glob pattern")
+    parser.add_argument("-o", "--output", default="jump_results.jsonl", help="a .jsonl or .csv results file")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--model", default="yolov8n-pose.pt", help="pose model to use")
+    parser.add_argument("--cache-dir", default="keypoints_cache", help="keypoints cache directory")
+    parser.add_argument("--ignore-cache", action="store_true", help="extract keypoints even if cached")
+    parser.add_argument("--batch-size", type=int, default=1, help="frames per model call")
+    parser.add_argument("--checkpoint-every", type=int, default=None, metavar="FRAMES",
+                        help="save extracted keypoints every FRAMES frames and resume interrupted videos")
+    parser.add_argument("--manifest", default=None, help="manifest file used to resume the batch")
+    parser.add_argument("--profile", default=None, metavar="PATH",
+                        help="write a per-stage profile of every worker to PATH-<pid>.json")
+    parser.add_argument("--profile-trace", default=None, metavar="PATH",
+                        help="also write a Chrome trace of every worker to PATH-<pid>.json")
+    args = parser.parse_args(argv)
+
+    # The workers are spawned with this environment and enable profiling when they import it
+    if args.profile or args.profile_trace:
+        os.environ["JUMP_PROFILE"] = args.profile or "1"
+    if args.profile_trace:
+        os.environ["JUMP_PROFILE_TRACE"] = args.profile_trace
+
+    videos = find_videos(args.source)
+    processed, failed, skipped = run_batch(videos, args.output, workers=args.workers, model_name=args.model,
+                                           cache_dir=args.cache_dir, ignore_cache=args.ignore_cache,
+                                           manifest_path=args.manifest, batch_size=args.batch_size,
+                                           checkpoint_every=args.checkpoint_every)
+    print(f"Processed: {processed}, failed: {failed}, skipped: {skipped}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,142 @@
+"""
+Extracts the keypoints of one long video on several processes. The video is split into overlapping
+segments, each segment is tracked on its own worker process and the track ids are stitched across the
+segment boundaries.
+"""
+import argparse
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+SEGMENT_OVERLAP = 60
+# Segments shorter than this are not worth a worker of their own
+MIN_SEGMENT_LENGTH = 300
+
+
+def split_segments(n_frames, n_segments, overlap=SEGMENT_OVERLAP):
+    """
+    The function `split_segments` splits the frames 1 to `n_frames` into `n_segments` parts of about
+    the same length, each extended by `overlap` frames into the next one.
+
+    :param n_frames: The number of frames of the video
+    :param n_segments: The number of segments
+    :param overlap: The number of frames shared by consecutive segments, defaults to 60 (optional)
+    :return: a list of `(start, stop)` frame ranges, both inclusive.
+    """
+    n_segments = max(min(n_segments, n_frames), 1)
+    bounds = [1 + round(i * n_frames / n_segments) for i in range(n_segments + 1)]
+    return [(start, min(stop - 1 + (overlap if stop <= n_frames else 0), n_frames))
+            for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
+def count_segments(n_frames, workers):
+    """
+    Returns the number of segments a video of `n_frames` frames is split into on `workers` processes.
+    """
+    return max(min(workers, n_frames // MIN_SEGMENT_LENGTH), 1)
+
+
+def _init_segment_worker(model_name, threads):
+    # Every worker gets its share of the cores, instead of each of them using all of them
+    import cv2
+    import torch
+    from keypoints.yolo import load_model
+
+    torch.set_num_threads(threads)
+    cv2.setNumThreads(1)
+    load_model(model_name)
+
+
+def track_segment(video_path, start, stop, model_name):
+    """
+    Runs the pose model and a fresh tracker on the frames `start` to `stop` of a video, or to its end
+    if `stop` is None, and returns `(start, last, tracks)` where `last` is the last frame read.
+    """
+    from keypoints.track import tracks_from_frames
+    from keypoints.video import read_frames
+    from keypoints.yolo import iter_key_points_from_frames
+
+    last = start - 1
+
+    def frames():
+        nonlocal last
+        for frame, image in read_frames(video_path, start, stop):
+            last = frame
+            yield frame, image
+
+    tracks = tracks_from_frames(iter_key_points_from_frames(frames(), model_name))
+    return start, last, tracks
+
+
+def get_key_points_segmented(path="test_videos/test1.mp4", workers=None, overlap=SEGMENT_OVERLAP,
+                             model_name="yolov8n-pose.pt"):
+    """
+    The function `get_key_points_segmented` extracts the keypoints of a video like `get_key_points`,
+    but splits it into `workers` overlapping segments that are tracked in parallel, one process per
+    segment. The segments are cut from the frame count reported by the container, the last one is
+    read to the end of the video whatever that count says.
+
+    The ids of the tracker of each segment are then stitched to those of the previous segment by
+    comparing the tracks on the `overlap` frames both segments processed (`stitch_segments`). The
+    tracker needs a few frames to confirm a new person, so the overlap must be longer than that;
+    the frames of an overlap are then taken half from each segment.
+
+    :param path: The path to the video file
+    :param workers: The number of worker processes, defaults to the number of CPUs (optional)
+    :param overlap: The number of frames shared by consecutive segments, defaults to 60 (optional)
+    :param model_name: The pose model to use, defaults to yolov8n-pose.pt (optional)
+    :return: a dictionary mapping each integer id to its `KeypointTrack`, as returned by
+    `get_key_points`.
+    """
+    from keypoints.stitching import stitch_segments
+    from keypoints.video import video_properties
+
+    workers = workers or os.cpu_count() or 1
+    n_frames = video_properties(path)[1]
+    segments = split_segments(n_frames, count_segments(n_frames, workers), overlap)
+    # The frame count of many containers is an estimate, the last segment reads to the end of the video
+    segments[-1] = (segments[-1][0], None)
+    print(f"***Getting keypoints data ({len(segments)} segments)***")
+
+    threads = max((os.cpu_count() or 1) // len(segments), 1)
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=len(segments), mp_context=context, initializer=_init_segment_worker,
+                             initargs=(model_name, threads)) as pool:
+        futures = [pool.submit(track_segment, path, start, stop, model_name) for start, stop in segments]
+        results = [future.result() for future in futures]
+    if results[-1][1] != n_frames:
+        print(f"The video has {results[-1][1]} frames, its container reported {n_frames}")
+    return stitch_segments(results)
+
+
+def main(argv=None):
+    from functools import partial
+
+    from analyzer import analyze_jump
+    from keypoints.data_loader import load_keypoints_data
+    from keypoints.video import video_properties
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("video", help="the video to analyse")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--overlap", type=int, default=SEGMENT_OVERLAP, help="frames shared by segments")
+    parser.add_argument("--model", default="yolov8n-pose.pt", help="pose model to use")
+    parser.add_argument("--cache-dir", default="keypoints_cache", help="keypoints cache directory")
+    parser.add_argument("--ignore-cache", action="store_true", help="extract keypoints even if cached")
+    args = parser.parse_args(argv)
+
+    fps, n_frames = video_properties(args.video)[:2]
+    workers = args.workers or os.cpu_count() or 1
+    get_key_points_function = partial(get_key_points_segmented, workers=workers, overlap=args.overlap,
+                                      model_name=args.model)
+    # The stitched ids depend on where the segments are cut
+    extra_settings = {"segment_overlap": args.overlap, "segments": count_segments(n_frames, workers)}
+    keypoints_data = load_keypoints_data(args.video, get_key_points_function, ignore_cache=args.ignore_cache,
+                                         model_name=args.model, cache_dir=args.cache_dir,
+                                         extra_settings=extra_settings)
+    analyze_jump(keypoints_data, fps)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
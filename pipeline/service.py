@@ -0,0 +1,530 @@
+"""
+A local HTTP service that analyses videos on a pool of worker processes which keep the pose model
+loaded, so a request does not pay for the interpreter startup and the model load.
+
+Endpoints (JSON in and out):
+
+- `POST /jobs` with `{"video": "path/to/video.mp4"}`, or with the video file itself as the body and
+  its name in `?name=`, queues a job and answers 202 with the job. With `?wait=1` the answer is sent
+  once the job is finished; with `?stream=1` the job events are streamed as JSON lines until then.
+  When the queue is full the answer is 503 with a `Retry-After` header.
+- `GET /jobs/<id>` returns a job, with its `jump_data` once it is done.
+- `GET /jobs/<id>/events` streams the events of a job as JSON lines: `queued`, `started`,
+  `progress` (frame and number of frames, while the keypoints are extracted; none when they come
+  from the cache), then `done` or `failed`. A stream always ends with one of the last two, even if
+  it breaks after its head was sent.
+- `GET /health` returns the number of workers and of queued and running jobs.
+
+The service only listens on localhost, or on a Unix socket with `--unix`.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import parse_qs, urlsplit
+
+from .batch import _init_worker, analyze_video
+
+HOST = "127.0.0.1"
+PORT = 8765
+LOCAL_HOSTS = ("127.0.0.1", "localhost", "::1")
+QUEUE_SIZE = 16
+UPLOAD_DIR = "uploads"
+MAX_UPLOAD_BYTES = 2 << 30
+MAX_FINISHED_JOBS = 1000
+# Seconds between the progress events of a job
+PROGRESS_INTERVAL = 0.5
+RETRY_AFTER = 1
+
+STATUS_TEXT = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               411: "Length Required", 413: "Payload Too Large", 500: "Internal Server Error",
+               503: "Service Unavailable"}
+
+# Set in every worker process by `_init_service_worker`
+_progress_queue = None
+
+
+def _init_service_worker(model_name, progress_queue):
+    global _progress_queue
+    _progress_queue = progress_queue
+    _init_worker(model_name)
+    # Imported now rather than by the first job
+    import cv2  # noqa: F401
+    import analyzer  # noqa: F401
+    import keypoints.data_loader  # noqa: F401
+
+
+def _worker_ready():
+    return os.getpid()
+
+
+def run_job(job_id, video_path, model_name, cache_dir, ignore_cache=False, batch_size=1):
+    """
+    Runs `analyze_video` in a worker process and sends the progress of the keypoint extraction to
+    the service, at most every `PROGRESS_INTERVAL` seconds.
+    """
+    from keypoints.video import video_properties
+
+    n_frames = video_properties(video_path)[1]
+    last = [0.0]
+
+    def progress(frame):
+        now = time.monotonic()
+        if _progress_queue is not None and (now - last[0] >= PROGRESS_INTERVAL or frame == n_frames):
+            last[0] = now
+            _progress_queue.put((job_id, {"event": "progress", "frame": frame, "frames": n_frames}))
+
+    return analyze_video(video_path, model_name, cache_dir, ignore_cache, batch_size, progress=progress)
+
+
+class Job:
+    """
+    A video analysis requested from the service, with the events published so far.
+    """
+
+    def __init__(self, id, video, ignore_cache=False, upload_dir=None):
+        self.id = id
+        self.video = video
+        self.ignore_cache = ignore_cache
+        self.upload_dir = upload_dir
+        self.status = "queued"
+        self.jump_data = None
+        self.error = None
+        self.created = time.monotonic()
+        self.started = None
+        self.finished = None
+        self.events = []
+        self.subscribers = []
+        self.done = asyncio.Event()
+
+    def publish(self, event):
+        event = dict(event, job=self.id)
+        if event["event"] == "progress" and self.events and self.events[-1]["event"] == "progress":
+            self.events[-1] = event  # only the latest progress is kept for replay
+        else:
+            self.events.append(event)
+        for queue in self.subscribers:
+            queue.put_nowait(event)
+
+    def to_json(self):
+        job = {"id": self.id, "video": os.path.basename(self.video) if self.upload_dir else self.video,
+               "status": self.status}
+        if self.started is not None:
+            job["queued_seconds"] = self.started - self.created
+        if self.finished is not None:
+            job["run_seconds"] = self.finished - self.started
+        if self.status == "done":
+            job["jump_data"] = self.jump_data
+        if self.error is not None:
+            job["error"] = self.error
+        return job
+
+
+class AnalysisService:
+    """
+    The job queue and the worker pool of the service. Jobs wait in a bounded queue, so a burst of
+    requests is turned away with 503 instead of piling up, and `workers` jobs run at once, each on a
+    worker process that loaded the pose model when the service started.
+
+    :param workers: The number of worker processes, defaults to 1 (optional)
+    :param queue_size: The number of jobs that can wait for a worker, defaults to 16 (optional)
+    :param model_name: The pose model to use, defaults to yolov8n-pose.pt (optional)
+    :param cache_dir: The keypoints cache directory, defaults to keypoints_cache (optional)
+    :param upload_dir: The directory in which uploaded videos are kept while they are analysed,
+    defaults to uploads (optional)
+    :param batch_size: The number of frames run through the model at once, defaults to 1 (optional)
+    """
+
+    def __init__(self, workers=1, queue_size=QUEUE_SIZE, model_name="yolov8n-pose.pt", cache_dir="keypoints_cache",
+                 upload_dir=UPLOAD_DIR, batch_size=1):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.model_name = model_name
+        self.cache_dir = cache_dir
+        self.upload_dir = upload_dir
+        self.batch_size = batch_size
+        self.jobs = OrderedDict()
+        self.running = 0
+        self._ids = itertools.count(1)
+        self._uploads = itertools.count(1)
+        self._context = multiprocessing.get_context("spawn")
+        self._progress_queue = None
+        self._progress_thread = None
+        self._pool = None
+        self._queue = None
+        self._dispatchers = []
+        self._loop = None
+
+    async def start(self):
+        """
+        Starts the worker processes, waits until every one of them has loaded the model, and starts
+        taking jobs.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(self.queue_size)
+        self._progress_queue = self._context.Queue()
+        self._progress_thread = threading.Thread(target=self._forward_progress, daemon=True)
+        self._progress_thread.start()
+        await self._start_pool()
+        self._dispatchers = [asyncio.create_task(self._dispatch()) for _ in range(self.workers)]
+
+    async def _start_pool(self):
+        self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=self._context,
+                                         initializer=_init_service_worker,
+                                         initargs=(self.model_name, self._progress_queue))
+        # All the workers are busy at once, so every process is started and loads the model now
+        await asyncio.gather(*(self._loop.run_in_executor(self._pool, _worker_ready) for _ in range(self.workers)))
+
+    async def stop(self):
+        for task in self._dispatchers:
+            task.cancel()
+        await asyncio.gather(*self._dispatchers, return_exceptions=True)
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+        if self._progress_queue is not None:
+            self._progress_queue.put(None)
+            self._progress_thread.join()
+
+    def _forward_progress(self):
+        # Runs on a thread: hands the progress events of the workers over to the event loop
+        while True:
+            item = self._progress_queue.get()
+            if item is None:
+                return
+            self._loop.call_soon_threadsafe(self._on_progress, *item)
+
+    def _on_progress(self, job_id, event):
+        job = self.jobs.get(job_id)
+        if job is not None and job.status == "running":
+            job.publish(event)
+
+    def submit(self, video, ignore_cache=False, upload_dir=None):
+        """
+        Queues a job, or returns None when the queue is full.
+        """
+        if self._queue.full():
+            return None
+        job = Job(next(self._ids), video, ignore_cache, upload_dir)
+        self.jobs[job.id] = job
+        self._queue.put_nowait(job)
+        job.publish({"event": "queued", "position": self._queue.qsize()})
+        return job
+
+    async def _dispatch(self):
+        while True:
+            job = await self._queue.get()
+            self.running += 1
+            job.status = "running"
+            job.started = time.monotonic()
+            job.publish({"event": "started"})
+            pool = self._pool
+            try:
+                job.jump_data = await self._loop.run_in_executor(
+                    pool, run_job, job.id, job.video, self.model_name, self.cache_dir, job.ignore_cache,
+                    self.batch_size)
+                job.status = "done"
+            except BrokenProcessPool:
+                job.status = "failed"
+                job.error = "worker process died"
+                if self._pool is pool:
+                    # Replace the pool once, the other jobs that were running on it fail the same way
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    await self._start_pool()
+            except asyncio.CancelledError:
+                job.status = "failed"
+                job.error = "service stopped"
+                raise
+            except Exception:
+                job.status = "failed"
+                job.error = traceback.format_exc(limit=5)
+            finally:
+                self.running -= 1
+                job.finished = time.monotonic()
+                if job.upload_dir:
+                    shutil.rmtree(job.upload_dir, ignore_errors=True)
+                self._finish(job)
+
+    def _finish(self, job):
+        if job.status == "done":
+            job.publish({"event": "done", "jump_data": job.jump_data})
+        else:
+            job.publish({"event": "failed", "error": job.error})
+        job.done.set()
+        finished = [id for id, other in self.jobs.items() if other.done.is_set()]
+        for id in finished[:max(len(finished) - MAX_FINISHED_JOBS, 0)]:
+            del self.jobs[id]
+
+    def health(self):
+        return {"workers": self.workers, "queued": self._queue.qsize(), "queue_size": self.queue_size,
+                "running": self.running, "jobs": len(self.jobs)}
+
+    async def save_upload(self, reader, length, name):
+        """
+        Writes an uploaded video to its own directory under `upload_dir` and returns its path. The
+        file keeps its name, so the keypoints cache of the same video uploaded again is found.
+        """
+        name = re.sub(r"[^\w.-]", "_", os.path.basename(name or "upload.mp4")) or "upload.mp4"
+        directory = os.path.join(self.upload_dir, f"{os.getpid()}-{next(self._uploads)}")
+        os.makedirs(directory)
+        path = os.path.join(directory, name)
+        with open(path, "wb") as f:
+            while length > 0:
+                chunk = await reader.read(min(length, 1 << 20))
+                if not chunk:
+                    raise ConnectionError("upload cut short")
+                f.write(chunk)
+                length -= len(chunk)
+        return path, directory
+
+
+class _HttpError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+async def _read_request(reader):
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    try:
+        method, target, _ = request_line.decode("latin-1").split(" ", 2)
+    except ValueError:
+        raise _HttpError(400, "malformed request line")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return method.upper(), target, headers
+
+
+def _response_head(status, content_type, length=None, headers=None):
+    lines = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}", f"Content-Type: {content_type}",
+             "Connection: close"]
+    if length is not None:
+        lines.append(f"Content-Length: {length}")
+    lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+async def _send_json(writer, status, value, headers=None):
+    body = json.dumps(value).encode()
+    writer.write(_response_head(status, "application/json", len(body), headers) + body)
+    await writer.drain()
+
+
+async def _stream_events(writer, job):
+    # Replays the events published so far, then follows the job until it is finished
+    queue = asyncio.Queue()
+    job.subscribers.append(queue)
+    try:
+        writer.write(_response_head(200, "application/x-ndjson"))
+        for event in list(job.events):
+            writer.write(json.dumps(event).encode() + b"\n")
+        await writer.drain()
+        while not job.done.is_set() or not queue.empty():
+            event = await queue.get()
+            writer.write(json.dumps(event).encode() + b"\n")
+            await writer.drain()
+    except ConnectionError:
+        raise
+    except Exception:
+        # The response head is already sent, so the error ends the stream as a last event instead of
+        # a second response
+        failed = {"event": "failed", "job": job.id, "error": traceback.format_exc(limit=5)}
+        writer.write(json.dumps(failed).encode() + b"\n")
+        await writer.drain()
+    finally:
+        job.subscribers.remove(queue)
+
+
+def _flag(query, name):
+    return query.get(name, ["0"])[-1].lower() in ("1", "true", "yes")
+
+
+async def _handle(service, reader, writer):
+    request = await _read_request(reader)
+    if request is None:
+        return
+    method, target, headers = request
+    url = urlsplit(target)
+    query = parse_qs(url.query)
+    parts = [part for part in url.path.split("/") if part]
+    length = int(headers.get("content-length", 0) or 0)
+
+    if parts == ["health"] and method == "GET":
+        return await _send_json(writer, 200, service.health())
+
+    if parts == ["jobs"] and method == "POST":
+        upload_dir = None
+        if headers.get("content-type", "").startswith("application/json"):
+            try:
+                body = json.loads(await reader.readexactly(length) if length else b"{}")
+                video = body["video"]
+            except (ValueError, KeyError, TypeError):
+                raise _HttpError(400, 'expected {"video": "<path>"}')
+            if not os.path.isfile(video):
+                raise _HttpError(404, f"no such video: {video}")
+            ignore_cache = bool(body.get("ignore_cache"))
+        else:
+            if "content-length" not in headers:
+                raise _HttpError(411, "uploads need a Content-Length")
+            if length > MAX_UPLOAD_BYTES:
+                raise _HttpError(413, f"uploads are limited to {MAX_UPLOAD_BYTES} bytes")
+            if service._queue.full():
+                raise _HttpError(503, "queue full", {"Retry-After": RETRY_AFTER})
+            video, upload_dir = await service.save_upload(reader, length, query.get("name", [None])[-1])
+            ignore_cache = _flag(query, "ignore_cache")
+
+        job = service.submit(video, ignore_cache, upload_dir)
+        if job is None:
+            if upload_dir:
+                shutil.rmtree(upload_dir, ignore_errors=True)
+            raise _HttpError(503, "queue full", {"Retry-After": RETRY_AFTER})
+        if _flag(query, "stream"):
+            return await _stream_events(writer, job)
+        if _flag(query, "wait"):
+            await job.done.wait()
+            return await _send_json(writer, 200, job.to_json())
+        return await _send_json(writer, 202, job.to_json(), {"Location": f"/jobs/{job.id}"})
+
+    if len(parts) in (2, 3) and parts[0] == "jobs" and method == "GET":
+        job = service.jobs.get(int(parts[1])) if parts[1].isdigit() else None
+        if job is None:
+            raise _HttpError(404, "no such job")
+        if len(parts) == 2:
+            return await _send_json(writer, 200, job.to_json())
+        if parts[2] == "events":
+            return await _stream_events(writer, job)
+
+    raise _HttpError(404 if method in ("GET", "POST") else 405, f"no route for {method} {url.path}")
+
+
+def _connection_handler(service):
+    async def handle(reader, writer):
+        try:
+            await _handle(service, reader, writer)
+        except _HttpError as error:
+            await _send_json(writer, error.status, {"error": str(error)}, error.headers)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception:
+            await _send_json(writer, 500, {"error": traceback.format_exc(limit=5)})
+        finally:
+            writer.close()
+    return handle
+
+
+async def start_server(service, host=HOST, port=PORT, unix_path=None):
+    """
+    The function `start_server` starts the service and serves it on a localhost port, or on a Unix
+    socket if `unix_path` is given.
+
+    :param service: An `AnalysisService`, started here
+    :param host: The address to listen on, only loopback addresses are accepted, defaults to 127.0.0.1
+    (optional)
+    :param port: The port to listen on, 0 picks a free one, defaults to 8765 (optional)
+    :param unix_path: The path of a Unix socket to listen on instead (optional)
+    :return: the `asyncio.Server`.
+    """
+    if unix_path is None and host not in LOCAL_HOSTS:
+        raise ValueError(f"the service only listens on localhost, not on {host}")
+    await service.start()
+    if unix_path is not None:
+        if os.path.exists(unix_path):
+            os.remove(unix_path)
+        return await asyncio.start_unix_server(_connection_handler(service), unix_path)
+    return await asyncio.start_server(_connection_handler(service), host, port)
+
+
+async def request(method, path, body=None, headers=None, host=HOST, port=PORT, unix_path=None):
+    """
+    The function `request` sends one request to the service and reads the whole response.
+
+    :param method: The HTTP method
+    :param path: The path and query, e.g. "/jobs?wait=1"
+    :param body: A JSON serializable value, or bytes sent as is (optional)
+    :param headers: Other request headers (optional)
+    :param host: The host of the service, defaults to 127.0.0.1 (optional)
+    :param port: The port of the service, defaults to 8765 (optional)
+    :param unix_path: The Unix socket of the service, used instead of `host` and `port` (optional)
+    :return: a tuple with the status code, the response headers and the body (decoded if JSON).
+    """
+    headers = dict(headers or {})
+    if body is not None and not isinstance(body, bytes):
+        body = json.dumps(body).encode()
+        headers.setdefault("Content-Type", "application/json")
+    body = body or b""
+    if unix_path is not None:
+        reader, writer = await asyncio.open_unix_connection(unix_path)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+    try:
+        head = [f"{method} {path} HTTP/1.1", f"Host: {host}", f"Content-Length: {len(body)}", "Connection: close"]
+        head += [f"{name}: {value}" for name, value in headers.items()]
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+        status_line = await reader.readline()
+        status = int(status_line.split()[1])
+        response_headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            response_headers[name.strip().lower()] = value.strip()
+        content = await reader.read()
+    finally:
+        writer.close()
+    if response_headers.get("content-type") == "application/json":
+        content = json.loads(content)
+    return status, response_headers, content
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default=HOST, help="loopback address to listen on")
+    parser.add_argument("--port", type=int, default=PORT, help="port to listen on")
+    parser.add_argument("--unix", default=None, metavar="PATH", help="listen on a Unix socket instead")
+    parser.add_argument("-j", "--workers", type=int, default=1, help="number of worker processes")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE, help="jobs that can wait for a worker")
+    parser.add_argument("--model", default="yolov8n-pose.pt", help="pose model to use")
+    parser.add_argument("--cache-dir", default="keypoints_cache", help="keypoints cache directory")
+    parser.add_argument("--upload-dir", default=UPLOAD_DIR, help="directory of the uploaded videos")
+    parser.add_argument("--batch-size", type=int, default=1, help="frames per model call")
+    args = parser.parse_args(argv)
+
+    async def serve():
+        service = AnalysisService(args.workers, args.queue_size, args.model, args.cache_dir, args.upload_dir,
+                                  args.batch_size)
+        server = await start_server(service, args.host, args.port, args.unix)
+        print(f"Serving on {args.unix or f'http://{args.host}:{args.port}'} with {args.workers} workers")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await service.stop()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,191 @@
+import os
+import queue
+import threading
+from collections import deque
+
+import cv2
+
+from analyzer.motion_analysis import JUMP_KEYS, jump_entry, with_jumps
+from analyzer.online import OnlineJumpDetector
+from keypoints.yolo import reset_tracker, track_frame
+from utils import profiling
+from utils.visualization import draw_jump_overlays
+
+QUEUE_SIZE = 32
+_END = object()
+
+
+class _Stage(threading.Thread):
+    """
+    Runs `target(*args)` on its own thread and keeps the exception it raised, if any. The exception
+    also sets `stop`, so the other stages do not wait forever on a queue this one no longer serves.
+    """
+
+    def __init__(self, stop, target, *args):
+        super().__init__(daemon=True)
+        self._stop_event = stop
+        self._target_function = target
+        self._args = args
+        self.error = None
+
+    def run(self):
+        try:
+            self._target_function(*self._args)
+        except BaseException as e:
+            self.error = e
+            self._stop_event.set()
+
+
+def _put(output, item, stop):
+    while not stop.is_set():
+        try:
+            output.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(input, stop):
+    while not stop.is_set():
+        try:
+            return input.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _END
+
+
+def _decode(video, output, stop):
+    frame_count = 0
+    try:
+        while not stop.is_set():
+            with profiling.stage("single_pass.decode"):
+                ret, frame = video.read()
+            if not ret:
+                break
+            frame_count += 1
+            if not _put(output, (frame_count, frame), stop):
+                break
+    finally:
+        _put(output, _END, stop)
+
+
+def _render(input, out, detector, delay, jump_data, stop):
+    # Frames wait in `pending` until the detector has had `delay` newer frames to report the jumps
+    # they belong to, then they are annotated and encoded.
+    pending = deque()
+
+    def encode(frame_count, frame, detections):
+        with profiling.stage("single_pass.draw"):
+            draw_jump_overlays(frame, frame_count, jump_data, detections.get, detector.fps)
+        with profiling.stage("single_pass.encode"):
+            out.write(frame)
+
+    while True:
+        item = _get(input, stop)
+        if item is _END:
+            break
+        frame_count, frame, ids, boxes, keypoints = item
+        with profiling.stage("single_pass.detect"):
+            events = detector.update(frame_count, ids, keypoints)
+        for event in events:
+            _add_jump(jump_data, event)
+        for id in ids:
+            if int(id) not in jump_data:
+                jump_data[int(id)] = with_jumps(jump_entry(None, None))
+        pending.append((frame_count, frame, {int(id): (box, kps) for id, box, kps in zip(ids, boxes, keypoints)}))
+        if len(pending) > delay:
+            encode(*pending.popleft())
+    if stop.is_set():
+        return
+
+    for event in detector.flush():
+        _add_jump(jump_data, event)
+    while pending:
+        encode(*pending.popleft())
+
+
+def _add_jump(jump_data, event):
+    # The entry of an ID is its last jump, and "jumps" lists all of its jumps as in `analyze_jump`
+    jumps = jump_data[event.track_id]["jumps"] if event.track_id in jump_data else []
+    entry = {
+        "jumping": True,
+        "launch_frame": event.launch_frame,
+        "landing_frame": event.landing_frame,
+        "jump_height": event.jump_height,
+        "launch_velocity": event.launch_velocity
+    }
+    jumps.append(dict({key: entry[key] for key in JUMP_KEYS}, residual=None))
+    jump_data[event.track_id] = with_jumps(entry, jumps)
+
+
+def run_single_pass(video_path, output_dir="output_videos", delay=None, queue_size=QUEUE_SIZE, **detector_kwargs):
+    """
+    The function `run_single_pass` analyses a video and writes the annotated output while decoding
+    every frame only once.
+
+    Decoding, pose inference and annotation/encoding run as three stages connected by bounded
+    queues: a decoder thread reads frames, the calling thread runs the model and tracker on them, and
+    an encoder thread feeds the detections to an `OnlineJumpDetector` and writes the annotated frames.
+    Since jumps are only known some frames after they happen, the encoder holds back the last `delay`
+    frames before drawing them; overlays of a jump are complete as long as the jump is reported
+    within `delay` frames of its launch.
+
+    :param video_path: The path to the input video file
+    :param output_dir: The directory in which the annotated video is written, defaults to output_videos
+    :param delay: The number of frames held back by the encoder, defaults to the detector history
+    (optional)
+    :param queue_size: The capacity of each queue between the stages, defaults to 32 (optional)
+    :param detector_kwargs: Other arguments of `OnlineJumpDetector`
+    :return: a `jump_data` dictionary in the format returned by `analyze_jump`, holding the last jump
+    of every ID and, under "jumps", all of its jumps, with launch and landing given as frame numbers.
+    """
+    video = cv2.VideoCapture(video_path)
+    fps = video.get(cv2.CAP_PROP_FPS) or 30
+    detector = OnlineJumpDetector(fps=fps, **detector_kwargs)
+    delay = detector.history if delay is None else delay
+
+    os.makedirs(output_dir, exist_ok=True)
+    output_video_path = os.path.join(output_dir, os.path.basename(video_path))
+    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+    out = cv2.VideoWriter(output_video_path, fourcc, fps, (int(video.get(3)), int(video.get(4))))
+
+    frames = queue.Queue(maxsize=queue_size)
+    detections = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    jump_data = {}
+    decoder = _Stage(stop, _decode, video, frames, stop)
+    encoder = _Stage(stop, _render, detections, out, detector, delay, jump_data, stop)
+
+    reset_tracker()
+    decoder.start()
+    encoder.start()
+    try:
+        while True:
+            item = _get(frames, stop)
+            if item is _END or encoder.error is not None:
+                break
+            frame_count, frame = item
+            ids, boxes, keypoints = track_frame(frame)
+            if not _put(detections, (frame_count, frame, ids, boxes, keypoints), stop):
+                break
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        while encoder.is_alive() and not stop.is_set():
+            try:
+                detections.put(_END, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        encoder.join()
+        stop.set()
+        decoder.join()
+        video.release()
+        out.release()
+
+    for stage in (decoder, encoder):
+        if stage.error is not None:
+            raise stage.error
+    return jump_data
@@ -1,2 +1,12 @@
 from .calculations import calculate_jump_height, calculate_launch_velocity
-from .visualization import save_and_show_output
\ No newline at end of file
+
+
+def __getattr__(name):
+    # cv2 is only imported when the renderer is actually used
+    if name == "save_and_show_output":
+        from .visualization import save_and_show_output
+        return save_and_show_output
+    if name == "export_highlights":
+        from .highlights import export_highlights
+        return export_highlights
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
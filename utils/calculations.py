@@ -1,18 +1,62 @@
 import numpy as np
-import warnings
-from numpy import RankWarning
-from scipy.signal import find_peaks
 from numpy.polynomial.polynomial import Polynomial
 
 GRAVITY = 9.81
 
-def linear_model(x, a, b):
-    return a * x + b
+def local_maxima(signal):
+    """
+    Returns the indices of the local maxima of a signal, using the middle of flat peaks, like
+    `scipy.signal.find_peaks`.
+    """
+    if len(signal) < 3:
+        return np.zeros(0, dtype=np.int64)
+    # Collapse runs of equal samples, a peak is a run that is higher than both of its neighbours
+    changes = np.flatnonzero(np.diff(signal) != 0)
+    run_starts = np.concatenate(([0], changes + 1))
+    run_ends = np.concatenate((changes, [len(signal) - 1]))
+    values = signal[run_starts]
+    peak_runs = np.flatnonzero((values[1:-1] > values[:-2]) & (values[1:-1] > values[2:])) + 1
+    return (run_starts[peak_runs] + run_ends[peak_runs]) // 2
+
+
+def peak_prominence(signal, peak):
+    """
+    Returns the prominence of one peak, as defined by `scipy.signal.peak_prominences`.
+    """
+    value = signal[peak]
+    higher_left = np.flatnonzero(signal[:peak] > value)
+    higher_right = np.flatnonzero(signal[peak + 1:] > value)
+    left = higher_left[-1] + 1 if len(higher_left) else 0
+    right = higher_right[0] + peak + 1 if len(higher_right) else len(signal)
+    return value - max(signal[left:peak + 1].min(), signal[peak:right].min())
+
+
+def highest_prominent_peak(signal, prominence, max_candidates=32):
+    """
+    The function `highest_prominent_peak` returns the highest of the peaks of `signal` whose
+    prominence is at least `prominence` (the first one on ties), or None if there is none. This is
+    the peak that `find_peaks(signal, prominence=prominence)` followed by an argmax selects.
 
-def quadratic_model(x, a, b, c):
-    return a * x**2 + b * x + c
-    
-def find_parabolic_curve(signal, window_size=20, threshold=1, find_minimum_peak=True):
+    Peaks are checked from the highest down and the first prominent one is returned, which usually is
+    the first or second candidate. Only when more than `max_candidates` peaks have to be checked is
+    the search handed to scipy, which keeps scipy (slow to import) out of most analyses.
+    """
+    peaks = local_maxima(signal)
+    order = np.lexsort((peaks, -signal[peaks]))
+    for peak in peaks[order[:max_candidates]]:
+        if peak_prominence(signal, peak) >= prominence:
+            return int(peak)
+    if len(peaks) <= max_candidates:
+        return None
+
+    from scipy.signal import find_peaks
+    peaks, _ = find_peaks(signal, prominence=prominence)
+    if len(peaks) == 0:
+        return None
+    return int(peaks[np.argmax(signal[peaks])])
+
+
+def find_parabolic_curve(signal, window_size=20, threshold=1, find_minimum_peak=True, prominence=30):
     """
     Find the start and end points of a concave-up parabolic curve in a signal.
 
@@ -21,6 +65,7 @@ def find_parabolic_curve(signal, window_size=20, threshold=1, find_minimum_peak=
     window_size (int): The size of the window around the peak or valley for curve fitting.
     threshold (float): The threshold for deviation from the fitted curve to determine the bounds.
     find_minimum_peak (bool): If True, finds the curve around the minimum peak (valley); otherwise, the maximum peak.
+    prominence (float): The required prominence of the peak or valley.
 
     Returns:
     tuple: Start and end points of the parabolic curve.
@@ -39,14 +84,11 @@ def find_parabolic_curve(signal, window_size=20, threshold=1, find_minimum_peak=
         # Invert the signal if finding minimum peak (valley)
         processed_signal = -signal if find_minimum_peak else signal
 
-        # Find peaks or valleys based on the processed signal
-        peaks, _ = find_peaks(processed_signal, prominence=30)
-        if len(peaks) == 0:
+        # Find the highest peak of the processed signal that is prominent enough
+        target_peak = highest_prominent_peak(processed_signal, prominence)
+        if target_peak is None:
             return None, None
 
-        # Choose the most prominent peak or valley
-        target_peak = peaks[np.argmin(signal[peaks])] if find_minimum_peak else peaks[np.argmax(signal[peaks])]
-
         # Define the window for curve fitting
         start = max(target_peak - window_size, 0)
         end = min(target_peak + window_size, len(signal))
@@ -85,55 +127,3 @@ def calculate_jump_height(total_air_time):
 def calculate_launch_velocity(total_air_time):
     launch_velocity = GRAVITY * total_air_time / 2
     return launch_velocity
-
-"""
-The following function is from an earlier version of the code. It is not used in the current version of the code.
-"""
-
-def calculate_loss_and_params(params, y_coords, time_steps):
-    try:
-        with warnings.catch_warnings():
-            warnings.simplefilter('ignore', RankWarning)
-            y_coords_array = np.array(y_coords)
-            # replace y_coords_array with a smoothed version of itself
-            time_steps_array = np.array(time_steps)
-
-            launch_frame = int(np.round(params[0]))
-            landing_frame = int(np.round(params[1]))
-
-            launch_frame = max(1, min(launch_frame, len(time_steps_array) - 1))
-            landing_frame = max(launch_frame + 1, min(landing_frame, len(time_steps_array)))
-
-            pre_jump = y_coords_array[time_steps_array <= launch_frame]
-            during_jump = y_coords_array[(time_steps_array > launch_frame) & (time_steps_array <= landing_frame)]
-            post_jump = y_coords_array[time_steps_array > landing_frame]
-            if pre_jump.size == 0 or during_jump.size == 0 or post_jump.size == 0:
-                return float('inf'), None
-            # remove outliers from pre_jump, during_jump and post_jump
-            pre_jump_mean = np.mean(pre_jump)
-            pre_jump_std = np.std(pre_jump)
-            pre_jump = pre_jump[abs(pre_jump - pre_jump_mean) < 3 * pre_jump_std]
-
-            during_jump_mean = np.mean(during_jump)
-            during_jump_std = np.std(during_jump)
-            during_jump = during_jump[abs(during_jump - during_jump_mean) < 3 * during_jump_std]
-
-            post_jump_mean = np.mean(post_jump)
-            post_jump_std = np.std(post_jump)
-            post_jump = post_jump[abs(post_jump - post_jump_mean) < 3 * post_jump_std]
-
-            time_pre_jump = time_steps_array[time_steps_array <= launch_frame]
-            time_during_jump = time_steps_array[(time_steps_array > launch_frame) & (time_steps_array <= landing_frame)]
-            time_post_jump = time_steps_array[time_steps_array > landing_frame]
-
-            linear_params_pre = np.polyfit(time_pre_jump, pre_jump, 1)
-            linear_params_post = np.polyfit(time_post_jump, post_jump, 1)
-            quadratic_params = np.polyfit(time_during_jump, during_jump, 2)
-
-            loss = np.sum((linear_model(time_pre_jump, *linear_params_pre) - pre_jump) ** 2)
-            loss += np.sum((quadratic_model(time_during_jump, *quadratic_params) - during_jump) ** 2)
-            loss += np.sum((linear_model(time_post_jump, *linear_params_post) - post_jump) ** 2)
-
-            return loss, quadratic_params
-    except Exception as e:
-        return float('inf'), None
@@ -0,0 +1,128 @@
+"""
+Exports short annotated clips of the jumps of a video, decoding only the frames around each jump.
+"""
+import argparse
+import os
+
+import cv2
+
+from .visualization import build_overlay_plan
+
+HIGHLIGHTS_DIR = "output_videos/highlights"
+PADDING = 1.0
+
+
+def jump_windows(jump_data, padding_before, padding_after, n_frames=None):
+    """
+    The function `jump_windows` lists the frame windows of every jump in `jump_data`. The launch and
+    landing frames of `analyze_jump` are frame numbers of the video with every segmentation, so the
+    windows can be read straight from the video, whenever the track of the player starts.
+
+    :param jump_data: The `jump_data` dictionary returned by `analyze_jump`
+    :param padding_before: The number of frames shown before the launch
+    :param padding_after: The number of frames shown after the landing
+    :param n_frames: The number of frames of the video, windows are clipped to it (optional)
+    :return: a list of `(id, number, jump, start, stop)` tuples sorted by `start`, where `number` counts
+    the jumps of each ID from 1, `jump` is the jump dictionary and `start` and `stop` are inclusive.
+    """
+    windows = []
+    for id, entry in jump_data.items():
+        jumps = entry.get("jumps")
+        if jumps is None:
+            jumps = [entry] if entry["jumping"] else []
+        for number, jump in enumerate(jumps, 1):
+            start = max(int(jump["launch_frame"]) - padding_before, 1)
+            stop = int(jump["landing_frame"]) + padding_after
+            if n_frames:
+                stop = min(stop, n_frames)
+            windows.append((id, number, jump, start, stop))
+    return sorted(windows, key=lambda window: window[3])
+
+
+def export_highlights(video_path, jump_data, keypoints_data, fps=None, padding=PADDING, output_dir=HIGHLIGHTS_DIR,
+                      reel=False):
+    """
+    The function `export_highlights` writes an annotated clip of every jump, seeking directly to each
+    jump instead of decoding and re-encoding the whole video. The time and the disk space it takes
+    grow with the number of jumps, not with the length of the video.
+
+    The overlays are the ones of `save_and_show_output`: the box, height and skeleton of the player
+    while in the air and the result banners after the landing. In the clip of a jump, the player's
+    overlays are those of that jump, so every jump of a player found by the "rolling" segmentation
+    gets its own clip.
+
+    :param video_path: The path to the input video file
+    :param jump_data: The `jump_data` dictionary returned by `analyze_jump`
+    :param keypoints_data: A dictionary mapping each ID to its `KeypointTrack`
+    :param fps: The frame rate of the video, read from the video by default (optional)
+    :param padding: The time shown before the launch and after the landing, in seconds, defaults to 1
+    (optional)
+    :param output_dir: The directory in which the clips are written, defaults to
+    output_videos/highlights (optional)
+    :param reel: If True, all the clips are joined into a single highlight reel instead, defaults to
+    False (optional)
+    :return: the paths of the files written.
+    """
+    from analyzer.motion_analysis import JUMP_KEYS
+    from keypoints.video import read_frames, video_properties
+
+    video_fps, n_frames, width, height = video_properties(video_path)
+    fps = fps or video_fps
+    pad = int(round(padding * fps))
+    windows = jump_windows(jump_data, pad, pad, n_frames)
+    os.makedirs(output_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(video_path))[0]
+    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+
+    paths = []
+    out = None
+    if reel and windows:
+        paths.append(os.path.join(output_dir, f"{stem}_highlights.mp4"))
+        out = cv2.VideoWriter(paths[-1], fourcc, fps, (width, height))
+    try:
+        for id, number, jump, start, stop in windows:
+            # This jump replaces the player's entry, so the clip shows the overlays of this jump
+            clip_jump_data = dict(jump_data)
+            clip_jump_data[id] = dict(jump_data[id], jumping=True, **{key: jump[key] for key in JUMP_KEYS})
+            plan = build_overlay_plan(clip_jump_data, keypoints_data, fps, frame_range=(start, stop))
+            if not reel:
+                paths.append(os.path.join(output_dir, f"{stem}_id{id}_jump{number}.mp4"))
+                out = cv2.VideoWriter(paths[-1], fourcc, fps, (width, height))
+            for frame_count, frame in read_frames(video_path, start, stop):
+                plan.draw(frame, frame_count)
+                out.write(frame)
+            if not reel:
+                out.release()
+                out = None
+    finally:
+        if out is not None:
+            out.release()
+    return paths
+
+
+def main(argv=None):
+    from analyzer import analyze_jump
+    from analyzer.motion_analysis import SEGMENTATIONS
+    from keypoints.data_loader import load_keypoints_data
+    from keypoints.video import video_properties
+    from keypoints.yolo import get_key_points
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("video", help="the video to export the jumps of")
+    parser.add_argument("-o", "--output-dir", default=HIGHLIGHTS_DIR, help="directory of the clips")
+    parser.add_argument("--padding", type=float, default=PADDING, help="seconds before and after each jump")
+    parser.add_argument("--reel", action="store_true", help="join the clips into one highlight reel")
+    parser.add_argument("--segmentation", choices=SEGMENTATIONS, default="peak", help="how jumps are found")
+    args = parser.parse_args(argv)
+
+    fps = video_properties(args.video)[0]
+    keypoints_data = load_keypoints_data(args.video, get_key_points)
+    jump_data = analyze_jump(keypoints_data, fps, segmentation=args.segmentation)
+    for path in export_highlights(args.video, jump_data, keypoints_data, fps, args.padding, args.output_dir,
+                                  args.reel):
+        print(path)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
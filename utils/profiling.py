@@ -0,0 +1,265 @@
+"""
+Optional per-stage instrumentation of the pipeline.
+
+Profiling is off unless `enable` is called or the `JUMP_PROFILE` environment variable is set. With
+`JUMP_PROFILE=profile.json` (or `JUMP_PROFILE=1`, which writes `profile.json`), the report is written
+when the process exits; `JUMP_PROFILE_TRACE=trace.json` also writes the timed spans in the Chrome
+trace format, which can be opened in chrome://tracing or https://ui.perfetto.dev.
+
+When profiling is off, `stage` returns a shared no-op context manager and `record` returns at once,
+so the instrumented code only pays for a function call.
+"""
+import atexit
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+PROFILE_ENV = "JUMP_PROFILE"
+TRACE_ENV = "JUMP_PROFILE_TRACE"
+DEFAULT_REPORT_PATH = "profile.json"
+PERCENTILES = (50, 95, 99)
+
+_profiler = None
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        self.profiler.record(self.name, end - self.start, self.start)
+        return False
+
+
+class Profiler:
+    """
+    Collects the duration of every call of every stage. `durations` maps a stage name to the list of
+    its durations in seconds; with `trace` set, every span is also kept for the Chrome trace.
+    """
+
+    def __init__(self, trace=False):
+        self.trace = trace
+        self.durations = {}
+        self.events = []
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def stage(self, name):
+        """
+        Returns a context manager recording the time spent in its block as one call of stage `name`.
+        """
+        return _Stage(self, name)
+
+    def record(self, name, seconds, start=None):
+        """
+        Records one call of stage `name` that took `seconds`, and started at `start` (a
+        `time.perf_counter` value, defaults to `seconds` ago).
+        """
+        durations = self.durations.get(name)
+        if durations is None:
+            with self._lock:
+                durations = self.durations.setdefault(name, [])
+        durations.append(seconds)
+        if self.trace:
+            if start is None:
+                start = time.perf_counter() - seconds
+            self.events.append((name, start, seconds, threading.get_ident()))
+
+    def last(self, name):
+        """
+        Returns the duration of the last call of stage `name`, 0 if it was never called.
+        """
+        durations = self.durations.get(name)
+        return durations[-1] if durations else 0.0
+
+    def iterate(self, iterable, name):
+        """
+        Yields the items of `iterable`, recording the time spent waiting for each one as stage `name`.
+        """
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.record(name, time.perf_counter() - start, start)
+            yield item
+
+    def report(self):
+        """
+        The function `report` summarizes the recorded stages.
+
+        :return: a JSON serializable dictionary with the wall time since profiling started, the peak
+        memory and, for every stage, the number of calls, the total time, the calls per second of
+        stage time and the mean, p50, p95, p99 and max latency in milliseconds.
+        """
+        stages = {}
+        for name, durations in list(self.durations.items()):
+            values = np.array(durations, dtype=np.float64)
+            total = float(values.sum())
+            summary = {"calls": len(values), "total_seconds": total,
+                       "per_second": len(values) / total if total > 0 else None,
+                       "mean_ms": float(values.mean()) * 1000}
+            for q, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+                summary[f"p{q}_ms"] = float(value) * 1000
+            summary["max_ms"] = float(values.max()) * 1000
+            stages[name] = summary
+        return {
+            "pid": os.getpid(),
+            "wall_seconds": time.perf_counter() - self.started,
+            "peak_memory": peak_memory(),
+            "stages": dict(sorted(stages.items())),
+        }
+
+    def chrome_trace(self):
+        """
+        Returns the recorded spans in the Chrome trace event format.
+        """
+        pid = os.getpid()
+        events = [{"name": name, "ph": "X", "pid": pid, "tid": tid,
+                   "ts": (start - self.started) * 1e6, "dur": seconds * 1e6}
+                  for name, start, seconds, tid in list(self.events)]
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write(self, report_path=None, trace_path=None):
+        """
+        Writes the report and the Chrome trace as JSON files, each one only if its path is given.
+        """
+        for path, content in ((report_path, self.report), (trace_path, self.chrome_trace)):
+            if path:
+                with open(path, "w") as f:
+                    json.dump(content(), f, indent=2)
+
+
+def peak_memory():
+    """
+    Returns the peak resident memory of the process and, if torch is in use with CUDA, the peak GPU
+    memory allocated by torch, both in megabytes (None where unavailable).
+    """
+    peak = {"rss_mb": None, "cuda_mb": None}
+    try:
+        import resource
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        peak["rss_mb"] = max_rss / (1 << 20) if sys.platform == "darwin" else max_rss / (1 << 10)
+    except ImportError:
+        pass
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        peak["cuda_mb"] = torch.cuda.max_memory_allocated() / (1 << 20)
+    return peak
+
+
+def enable(trace=False):
+    """
+    Starts profiling in this process and returns the `Profiler`, replacing any previous one.
+    """
+    global _profiler
+    _profiler = Profiler(trace)
+    return _profiler
+
+
+def disable():
+    """
+    Stops profiling and returns the `Profiler` that was active, if any.
+    """
+    global _profiler
+    profiler, _profiler = _profiler, None
+    return profiler
+
+
+def active():
+    """
+    Returns the active `Profiler`, None when profiling is off.
+    """
+    return _profiler
+
+
+def stage(name):
+    """
+    Returns a context manager timing its block as stage `name`, a no-op when profiling is off.
+    """
+    profiler = _profiler
+    if profiler is None:
+        return _NULL_STAGE
+    return _Stage(profiler, name)
+
+
+def record(name, seconds, start=None):
+    """
+    Records one call of stage `name` timed by the caller, does nothing when profiling is off.
+    """
+    profiler = _profiler
+    if profiler is not None:
+        profiler.record(name, seconds, start)
+
+
+def iterate(iterable, name):
+    """
+    Times the wait for every item of `iterable` as stage `name`. Returns `iterable` itself when
+    profiling is off.
+    """
+    profiler = _profiler
+    if profiler is None:
+        return iterable
+    return profiler.iterate(iterable, name)
+
+
+def _output_path(path):
+    # Worker processes inherit the environment, each one writes its own files
+    if multiprocessing.parent_process() is not None:
+        root, ext = os.path.splitext(path)
+        path = f"{root}-{os.getpid()}{ext}"
+    return path
+
+
+def _write_at_exit(report_path, trace_path):
+    profiler = _profiler
+    if profiler is not None:
+        profiler.write(_output_path(report_path), trace_path and _output_path(trace_path))
+
+
+def enable_from_env(environ=os.environ):
+    """
+    Enables profiling if `JUMP_PROFILE` is set, and writes the report (and the Chrome trace if
+    `JUMP_PROFILE_TRACE` is set) when the process exits.
+    """
+    report_path = environ.get(PROFILE_ENV)
+    trace_path = environ.get(TRACE_ENV)
+    if not report_path and not trace_path:
+        return None
+    if report_path in (None, "", "1", "true", "yes"):
+        report_path = DEFAULT_REPORT_PATH
+    profiler = enable(trace=bool(trace_path))
+    atexit.register(_write_at_exit, report_path, trace_path)
+    return profiler
+
+
+enable_from_env()
@@ -0,0 +1,202 @@
+import numpy as np
+
+# Length of the blocks in which the prefix sums restart, small enough to keep the moments exact in float64
+BLOCK_SIZE = 256
+# Default residual limit of `find_parabolic_curves`, relative to the noise level and to the depth of the parabola
+NOISE_FACTOR = 1.5
+DEPTH_FACTOR = 0.02
+
+
+def _block_prefix_sums(signal, max_window, block_size):
+    """
+    Splits `signal` into blocks of `block_size` window starts, each with the `max_window - 1` samples
+    that follow it, and returns the prefix sums of y, y*t, y*t^2 and y^2 of every block, with t
+    counted from the start of the block. Restarting t in every block keeps the sums small, so the
+    window moments obtained by differencing them do not lose precision on long signals.
+    """
+    n_blocks = -(-len(signal) // block_size)
+    padded = np.zeros(n_blocks * block_size + max_window - 1)
+    padded[:len(signal)] = signal
+    blocks = np.lib.stride_tricks.sliding_window_view(padded, block_size + max_window - 1)[::block_size]
+    t = np.arange(block_size + max_window - 1, dtype=np.float64)
+    sums = np.zeros((4, n_blocks, block_size + max_window))
+    for k, values in enumerate((blocks, blocks * t, blocks * t ** 2, blocks ** 2)):
+        np.cumsum(values, axis=1, out=sums[k, :, 1:])
+    return sums
+
+
+def _rolling_fits(sums, n_samples, window, block_size):
+    n_windows = n_samples - window + 1
+    # Sums over the windows starting at s = 0 .. block_size - 1 of every block, t relative to the block
+    s0, s1, s2, syy = (sums[:, :, window:window + block_size] - sums[:, :, :block_size]).reshape(4, -1)[:, :n_windows]
+    # Move the origin of t to the middle of each window
+    shift = np.arange(n_windows) % block_size + (window - 1) / 2
+    su = s1 - shift * s0
+    suu = s2 - 2 * shift * s1 + shift ** 2 * s0
+
+    u = np.arange(window) - (window - 1) / 2
+    moments = [np.sum(u ** k) for k in range(5)]
+    normal = np.array([[moments[4], moments[3], moments[2]],
+                       [moments[3], moments[2], moments[1]],
+                       [moments[2], moments[1], moments[0]]])
+    right_hand_sides = np.stack([suu, su, s0], axis=1)
+    # One small inverse shared by all windows is much cheaper than solving every system
+    coefficients = right_hand_sides @ np.linalg.inv(normal).T
+    residuals = np.maximum(syy - np.einsum("ij,ij->i", coefficients, right_hand_sides), 0.0)
+    return coefficients, residuals
+
+
+def rolling_quadratic_fits(signal, window, block_size=BLOCK_SIZE):
+    """
+    The function `rolling_quadratic_fits` fits a parabola by least squares to every window of `window`
+    consecutive samples of a signal, in O(n) overall. The sums of y, y*t and y*t^2 over each window
+    are differences of prefix sums, and since every window has the same abscissas, the normal
+    equations of all windows share one matrix.
+
+    :param signal: A 1-D array
+    :param window: The number of samples of each window, at least 3
+    :param block_size: The number of windows whose prefix sums share an origin, defaults to 256
+    (optional)
+    :return: the coefficients `(a, b, c)` of `a*u^2 + b*u + c` for every window start, shape
+    (n - window + 1, 3), where u is the sample index relative to the middle of the window, and the
+    sum of squared residuals of every fit.
+    """
+    signal = np.asarray(signal, dtype=np.float64)
+    if window < 3 or len(signal) < window:
+        return np.zeros((0, 3)), np.zeros(0)
+    return _rolling_fits(_block_prefix_sums(signal, window, block_size), len(signal), window, block_size)
+
+
+def noise_level(signal):
+    """
+    Estimates the standard deviation of the white noise of a signal from the median absolute deviation
+    of its second differences, which smooth motion (including the flights) barely affects.
+    """
+    second = np.diff(np.asarray(signal, dtype=np.float64), 2)
+    if len(second) == 0:
+        return 0.0
+    return float(1.4826 * np.median(np.abs(second - np.median(second))) / np.sqrt(6))
+
+
+def find_parabolic_curves(signal, min_window, max_window, prominence=30, max_rmse=None, block_size=BLOCK_SIZE):
+    """
+    The function `find_parabolic_curves` finds every concave-up parabolic section of a signal (the
+    flights of a hip trajectory in image coordinates), not only the most prominent one.
+
+    Every window length from `min_window` to `max_window` is scored at every position with
+    `rolling_quadratic_fits`, so the scan is linear in the length of the signal. A window is a
+    candidate if its parabola opens upwards, has its vertex inside the window, is at least
+    `prominence` deep and fits with a root mean square residual of at most `max_rmse`. Keypoint noise
+    is partly correlated from frame to frame, so by default the residual may reach the larger of 1.5
+    times the estimated white noise and 2% of the depth of the parabola. Candidates are then taken
+    longest first (lowest residual on ties), skipping those that overlap a section already taken.
+
+    :param signal: A 1-D array, e.g. the y coordinates of the left hip
+    :param min_window: The shortest section, in samples
+    :param max_window: The longest section, in samples
+    :param prominence: The minimum depth of the parabola over the section, defaults to 30 (optional)
+    :param max_rmse: The largest root mean square residual of the fit, defaults to a limit based on
+    `noise_level` and the depth (optional)
+    :param block_size: See `rolling_quadratic_fits` (optional)
+    :return: a list of `(start, end, rmse)` tuples sorted by start, `end` inclusive.
+    """
+    signal = np.asarray(signal, dtype=np.float64)
+    min_window = max(int(min_window), 3)
+    max_window = min(int(max_window), len(signal))
+    if max_window < min_window:
+        return []
+    noise_limit = NOISE_FACTOR * noise_level(signal)
+    # The prefix sums are computed once, every window length differences them
+    sums = _block_prefix_sums(signal, max_window, block_size)
+    candidates = []
+    for window in range(min_window, max_window + 1):
+        coefficients, residuals = _rolling_fits(sums, len(signal), window, block_size)
+        a, b = coefficients[:, 0], coefficients[:, 1]
+        half = (window - 1) / 2
+        with np.errstate(divide="ignore", invalid="ignore"):
+            vertex = -b / (2 * a)
+            depth = a * np.minimum((half + vertex) ** 2, (half - vertex) ** 2)
+        rmse = np.sqrt(residuals / window)
+        limit = np.maximum(noise_limit, DEPTH_FACTOR * depth) if max_rmse is None else max_rmse
+        good = (a > 0) & (np.abs(vertex) < half) & (depth >= prominence) & (rmse <= limit)
+        for start in np.flatnonzero(good).tolist():
+            candidates.append((-window, rmse[start], start))
+
+    candidates.sort()
+    taken = np.zeros(len(signal), dtype=bool)
+    curves = []
+    for negative_window, rmse, start in candidates:
+        end = start - negative_window
+        if taken[start:end].any():
+            continue
+        taken[start:end] = True
+        curves.append((start, end - 1, float(rmse)))
+    return sorted(curves)
+
+
+def _line_residuals(prefix, start, stop):
+    """
+    Returns the sum of squared residuals of the least squares lines fitted to the samples
+    `start:stop` (arrays of bounds), from the prefix sums of 1, t, t^2, y, t*y and y^2.
+    """
+    n, st, stt, sy, sty, syy = (p[stop] - p[start] for p in prefix)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ctt = stt - st ** 2 / n
+        cty = sty - st * sy / n
+        cyy = syy - sy ** 2 / n
+        residuals = cyy - np.where(ctt > 0, cty ** 2 / ctt, 0.0)
+    return np.maximum(np.nan_to_num(residuals), 0.0)
+
+
+def segment_jump(signal, min_window=3, max_window=None, prominence=30, block_size=BLOCK_SIZE):
+    """
+    The function `segment_jump` splits a signal into a line before the jump, a parabola during the
+    flight and a line after the landing, choosing the launch and landing that minimize the total sum
+    of squared residuals of the three least squares fits.
+
+    Every fit is computed in O(1) from cumulative moment sums: prefix sums of 1, t, t^2, y, t*y and
+    y^2 for the lines, and the block prefix sums of `rolling_quadratic_fits` for the parabola. All
+    (launch, landing) pairs with a flight of `min_window` to `max_window` samples are evaluated, which
+    is exhaustive without `max_window` and O(n) per flight length otherwise. Only flights whose
+    parabola opens upwards, has its vertex inside the flight and is at least `prominence` deep are
+    accepted. Each line holds at least two samples.
+
+    :param signal: A 1-D array, e.g. the y coordinates of the left hip
+    :param min_window: The shortest flight, in samples, defaults to 3 (optional)
+    :param max_window: The longest flight, in samples, defaults to the whole signal (optional)
+    :param prominence: The minimum depth of the flight parabola, defaults to 30 (optional)
+    :param block_size: See `rolling_quadratic_fits` (optional)
+    :return: a tuple `(launch, landing, loss)` with the first and last samples of the flight and the
+    total sum of squared residuals, or None if no flight was accepted.
+    """
+    signal = np.asarray(signal, dtype=np.float64)
+    n_samples = len(signal)
+    min_window = max(int(min_window), 3)
+    max_window = min(int(max_window or n_samples), n_samples - 4)
+    if max_window < min_window:
+        return None
+
+    # Centering t and y keeps the line moments small
+    t = np.arange(n_samples) - (n_samples - 1) / 2
+    y = signal - signal.mean()
+    prefix = [np.concatenate(([0.0], np.cumsum(values)))
+              for values in (np.ones(n_samples), t, t ** 2, y, t * y, y ** 2)]
+    sums = _block_prefix_sums(y, max_window, block_size)
+
+    best = None
+    for window in range(min_window, max_window + 1):
+        # The flight covers starts .. starts + window - 1, with two samples or more on each side
+        starts = np.arange(2, n_samples - window - 1)
+        coefficients, residuals = _rolling_fits(sums, n_samples, window, block_size)
+        a, b = coefficients[starts, 0], coefficients[starts, 1]
+        half = (window - 1) / 2
+        with np.errstate(divide="ignore", invalid="ignore"):
+            vertex = -b / (2 * a)
+            depth = a * np.minimum((half + vertex) ** 2, (half - vertex) ** 2)
+        loss = (_line_residuals(prefix, 0, starts) + residuals[starts]
+                + _line_residuals(prefix, starts + window, n_samples))
+        loss[~((a > 0) & (np.abs(vertex) < half) & (depth >= prominence))] = np.inf
+        i = int(np.argmin(loss))
+        if np.isfinite(loss[i]) and (best is None or loss[i] < best[2]):
+            best = (int(starts[i]), int(starts[i]) + window - 1, float(loss[i]))
+    return best
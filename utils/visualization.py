@@ -1,142 +1,287 @@
 import cv2
 import os
+from bisect import bisect_right
+from functools import lru_cache
+
+import numpy as np
+from keypoints.track import as_tracks
+
+from . import profiling
 
 FONT_SCALE = 0.9
 FONT_THICKNESS = 2
 FONT = cv2.FONT_HERSHEY_SIMPLEX
+LINE_SPACING = 5
+GRAVITY = 9.81
+
+# Define colors for each keypoint
+KEYPOINT_COLORS = [
+    (255, 0, 0),   # Red
+    (0, 255, 0),   # Green
+    (0, 0, 255),   # Blue
+    (255, 255, 0), # Cyan
+    (255, 0, 255), # Magenta
+    (0, 255, 255), # Yellow
+    (128, 128, 128), # Gray
+    (128, 0, 0),   # Maroon
+    (0, 128, 0),   # Dark Green
+    (0, 0, 128),   # Navy
+    (128, 128, 0), # Olive
+    (128, 0, 128), # Purple
+    (0, 128, 128), # Teal
+    (192, 192, 192), # Silver
+    (64, 0, 0),    # Dark Red
+    (0, 64, 0),    # Darker Green
+    (0, 0, 64)     # Dark Blue
+]
+# Define skeleton connections
+SKELETON = [
+    (0, 1), (1, 2), (0, 3), (3, 4),
+    (5, 6), (5, 7), (7, 9), (6, 8),
+    (8, 10), (5, 11), (6, 12), (11, 13),
+    (13, 15), (12, 14), (14, 16), (11, 12)
+]
+
+
+# Skeleton lines are drawn in one colour
+SKELETON_COLOR = KEYPOINT_COLORS[len(SKELETON) % len(KEYPOINT_COLORS)]
+SKELETON_STARTS = np.array([start for start, end in SKELETON])
+SKELETON_ENDS = np.array([end for start, end in SKELETON])
+
+
+@lru_cache(maxsize=4096)
+def text_size(line):
+    """
+    Returns the (width, height) of a line of text. Most lines repeat from frame to frame, so the
+    metrics are cached.
+    """
+    return cv2.getTextSize(line, FONT, FONT_SCALE, FONT_THICKNESS)[0]
+
+
+def layout_text_lines(lines, text_start_x, text_start_y):
+    """
+    Places each line of text below the previous one, starting at (text_start_x, text_start_y), and
+    returns the `(line, origin)` pairs to draw.
+    """
+    placed = []
+    for line in lines:
+        placed.append((line, (text_start_x, text_start_y)))
+        text_start_y += LINE_SPACING + text_size(line)[1]
+    return placed
+
+
+def player_overlay(id, box, keypoints, height, launch_velocity):
+    """
+    The function `player_overlay` lays out the box, the current height and the skeleton of a player
+    that is in the air.
+
+    :param id: The ID of the player
+    :param box: The box of the player in xyxy format
+    :param keypoints: The keypoints of the player in this frame
+    :param height: The current height of the jump in cm
+    :param launch_velocity: The launch velocity of the jump in m/s
+    :return: a tuple `(box, text, points, segments)` to pass to `draw_overlay`.
+    """
+    text = f"ID: {id}\nHeight: {height:.2f} cm\nLaunch speed: {launch_velocity:.2f} m/s"
+    box = tuple(int(b) for b in box)
+    lines = text.split('\n')
+    text_height = sum(text_size(line)[1] + LINE_SPACING for line in lines) - LINE_SPACING
+    box_center_y = (box[1] + box[3]) // 2
+    placed = layout_text_lines(lines, box[2] + 10, box_center_y - text_height // 2)
+
+    points = np.asarray(keypoints)[:, :2].astype(np.int32)
+    segments = []
+    if len(points) > max(SKELETON_STARTS.max(), SKELETON_ENDS.max()):
+        segments = list(np.stack([points[SKELETON_STARTS], points[SKELETON_ENDS]], axis=1))
+    return box, placed, [tuple(point) for point in points.tolist()], segments
+
+
+def result_overlay(id, jump_height, launch_velocity):
+    """
+    Lays out the final result of a jump at the top of the frame, see `draw_overlay`.
+    """
+    text = f"ID: {id}, Max Height: {jump_height:.2f} cm, Launch velocity: {launch_velocity:.2f} m/s \n"
+    # put multi-line text on top of the frame by splitting the text on newline character
+    return None, layout_text_lines(text.split('\n'), 10, 80), (), ()
+
+
+def draw_overlay(frame, overlay):
+    """
+    Draws an overlay laid out by `player_overlay` or `result_overlay`.
+    """
+    box, placed, points, segments = overlay
+    if box is not None:
+        cv2.rectangle(frame, (box[0], box[1]), (box[2], box[3]), (255, 0, 0), 2)
+    for line, origin in placed:
+        cv2.putText(frame, line, origin, FONT, FONT_SCALE, (255, 255, 255), FONT_THICKNESS)
+    # Draw keypoints with different colors
+    for i, point in enumerate(points):
+        cv2.circle(frame, point, 3, KEYPOINT_COLORS[i % len(KEYPOINT_COLORS)], -1)
+    # Draw lines for skeleton
+    if len(segments):
+        cv2.polylines(frame, segments, False, SKELETON_COLOR, 2)
+
 
-def save_and_show_output(video_path, video, jump_data, keypoints_data, show=True, fps=30):
+def jump_height_at(frame_count, launch_frame, launch_velocity, fps=30):
+    """
+    Returns the height in cm reached `frame_count - launch_frame` frames after the launch.
+    """
+    t = (frame_count - launch_frame) / fps
+    return (launch_velocity * t - 0.5 * GRAVITY * t ** 2) * 100
+
+
+def draw_jump_overlays(frame, frame_count, jump_data, detections, fps=30):
+    """
+    The function `draw_jump_overlays` draws all jump overlays of one frame. It is meant for callers
+    that learn about jumps while rendering; with the whole `jump_data` known in advance,
+    `build_overlay_plan` is cheaper.
+
+    :param frame: The frame to draw on
+    :param frame_count: The frame number, starting at 1
+    :param jump_data: The `jump_data` dictionary returned by `analyze_jump`
+    :param detections: A function returning the `(box, keypoints)` pair of an ID in this frame, or
+    None if the ID was not detected
+    :param fps: The frame rate of the video, defaults to 30 (optional)
+    """
+    for id in jump_data:
+        if jump_data[id]["jumping"]:
+            v_0 = jump_data[id]["launch_velocity"]
+
+            if frame_count >= jump_data[id]["launch_frame"] and frame_count <= jump_data[id]["landing_frame"]:
+                h = jump_height_at(frame_count, jump_data[id]["launch_frame"], v_0, fps)
+                detection = detections(id)
+                if detection is not None:
+                    box, keypoints = detection
+                    draw_overlay(frame, player_overlay(id, box, keypoints, h, v_0))
+            if frame_count > jump_data[id]["landing_frame"]:
+                draw_overlay(frame, result_overlay(id, jump_data[id]["jump_height"], v_0))
+
+
+class OverlayPlan:
+    """
+    The overlays of a whole video, laid out before rendering. `players` maps a frame number to the
+    `(order, overlay)` pairs of the players in the air in that frame. The result banners stay on
+    screen after the landing, so they are stored as `(first_frame, order, overlay)` triples sorted
+    by their first frame (the frame after the landing) and found with a binary search.
+    """
+
+    __slots__ = ("players", "results", "_result_frames")
+
+    def __init__(self, players, results):
+        self.players = players
+        self.results = sorted(results, key=lambda result: result[0])
+        self._result_frames = [result[0] for result in self.results]
+
+    def overlays_at(self, frame_count):
+        """
+        Returns the overlays of a frame in drawing order, an empty list if there is nothing to draw.
+        """
+        active = bisect_right(self._result_frames, frame_count)
+        players = self.players.get(frame_count)
+        if not active and not players:
+            return []
+        ordered = list(players or []) + [(order, overlay) for _, order, overlay in self.results[:active]]
+        ordered.sort(key=lambda item: item[0])
+        return [overlay for _, overlay in ordered]
+
+    def draw(self, frame, frame_count):
+        """
+        Draws the overlays of a frame, returns False if there was nothing to draw.
+        """
+        overlays = self.overlays_at(frame_count)
+        for overlay in overlays:
+            draw_overlay(frame, overlay)
+        return bool(overlays)
+
+
+def build_overlay_plan(jump_data, keypoints_data, fps=30, frame_range=None):
+    """
+    The function `build_overlay_plan` lays out every overlay of a video in advance, so that rendering
+    a frame only draws what that frame needs and frames without overlays are left untouched.
+
+    :param jump_data: The `jump_data` dictionary returned by `analyze_jump`
+    :param keypoints_data: A dictionary mapping each ID to its `KeypointTrack`
+    :param fps: The frame rate of the video, defaults to 30 (optional)
+    :param frame_range: Only lay out the players in the air within this `(first, last)` frame range,
+    defaults to the whole video (optional)
+    :return: an `OverlayPlan`.
+    """
+    keypoints_data = as_tracks(keypoints_data)
+    first, last = frame_range or (-np.inf, np.inf)
+    players = {}
+    results = []
+    for order, id in enumerate(jump_data):
+        jump = jump_data[id]
+        if not jump["jumping"]:
+            continue
+        v_0 = jump["launch_velocity"]
+        results.append((jump["landing_frame"] + 1, order, result_overlay(id, jump["jump_height"], v_0)))
+
+        track = keypoints_data.get(int(id))
+        if track is None:
+            continue
+        start = max(jump["launch_frame"], first)
+        stop = min(jump["landing_frame"], last)
+        rows = range(int(np.searchsorted(track.frames, start, side="left")),
+                     int(np.searchsorted(track.frames, stop, side="right")))
+        for row in rows:
+            frame_count = int(track.frames[row])
+            h = jump_height_at(frame_count, jump["launch_frame"], v_0, fps)
+            overlay = player_overlay(id, track.boxes[row], track.keypoints[row], h, v_0)
+            players.setdefault(frame_count, []).append((order, overlay))
+    return OverlayPlan(players, results)
+
+
+def save_and_show_output(video_path, video, jump_data, keypoints_data, show=True, fps=30, output_dir="output_videos"):
     """
     The function `save_and_show_output` saves a video with annotated keypoints and jump data, and
     optionally displays the video while saving.
-    
+
     :param video_path: The path to the input video file
     :param video: The `video` parameter is the input video file that you want to process and save the
     output for. It should be a video file object that you can read frames from
     :param jump_data: The `jump_data` parameter is a dictionary that contains information about the
     jumps. Each key in the dictionary represents a unique identifier for a jump, and the corresponding
     value is another dictionary that contains the following information:
-    :param keypoints_data: The `keypoints_data` parameter is a dictionary that contains the keypoints
-    data for each frame of the video. The dictionary has the following structure:
+    :param keypoints_data: The `keypoints_data` parameter is a dictionary that maps each ID to its
+    `KeypointTrack`, holding the box and keypoints of every frame in which the ID was detected
     :param show: A boolean indicating whether to display the video frames while saving and showing the
     output. If set to True, the frames will be displayed; if set to False, the frames will not be
     displayed, defaults to True (optional)
     :param fps: The `fps` parameter specifies the frames per second of the output video. It determines
     how many frames are displayed per second in the video, defaults to 30 (optional)
+    :param output_dir: The directory in which the annotated video is written, defaults to output_videos
+    (optional)
     """
+    with profiling.stage("render.plan"):
+        plan = build_overlay_plan(jump_data, keypoints_data, fps)
     frame_count = 0
     fourcc = cv2.VideoWriter_fourcc(*'mp4v')
     video_file_name = video_path.split("/")[-1]
-    output_dir = "output_videos"
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
     output_video_path = os.path.join(output_dir, video_file_name)
     out = cv2.VideoWriter(output_video_path, fourcc, fps, (int(video.get(3)), int(video.get(4))))
 
-    # Define colors for each keypoint
-    colors = [
-        (255, 0, 0),   # Red
-        (0, 255, 0),   # Green
-        (0, 0, 255),   # Blue
-        (255, 255, 0), # Cyan
-        (255, 0, 255), # Magenta
-        (0, 255, 255), # Yellow
-        (128, 128, 128), # Gray
-        (128, 0, 0),   # Maroon
-        (0, 128, 0),   # Dark Green
-        (0, 0, 128),   # Navy
-        (128, 128, 0), # Olive
-        (128, 0, 128), # Purple
-        (0, 128, 128), # Teal
-        (192, 192, 192), # Silver
-        (64, 0, 0),    # Dark Red
-        (0, 64, 0),    # Darker Green
-        (0, 0, 64)     # Dark Blue
-    ]
-    # Define skeleton connections
-    skeleton = [
-        (0, 1), (1, 2), (0, 3), (3, 4), 
-        (5, 6), (5, 7), (7, 9), (6, 8), 
-        (8, 10), (5, 11), (6, 12), (11, 13), 
-        (13, 15), (12, 14), (14, 16), (11, 12)
-    ]
-
     while True:
-        ret, frame = video.read()
+        with profiling.stage("render.decode"):
+            ret, frame = video.read()
         if not ret:
             break
         frame_count += 1
-        current_time = frame_count / fps
-
-        for id in jump_data:
-            if jump_data[id]["jumping"]:
-                t_0 = jump_data[id]["launch_frame"] / fps
-                v_0 = jump_data[id]["launch_velocity"]
-                g = 9.81  # Gravity constant
-
-                if frame_count >= jump_data[id]["launch_frame"] and frame_count <= jump_data[id]["landing_frame"]:
-                    h = (v_0 * (current_time - t_0) - 0.5 * g * (current_time - t_0) ** 2)*100     
-                    text = f"ID: {id}\nHeight: {h:.2f} cm\nLaunch speed: {v_0:.2f} m/s"
-                    if str(frame_count) in keypoints_data[str(id)]:
-                        box = keypoints_data[str(id)][str(frame_count)]["box"]
-                        keypoints = keypoints_data[str(id)][str(frame_count)]["keypoints"]
-                        box = [int(b) for b in box]
-                        cv2.rectangle(frame, (box[0], box[1]), (box[2], box[3]), (255, 0, 0), 2)
-
-                        box_center_y = (box[1] + box[3]) // 2
-                        lines = text.split('\n')
-                        line_spacing = 5
-                        text_width, text_height = 0, 0
-
-                        for line in lines:
-                            text_size = cv2.getTextSize(line, FONT, FONT_SCALE, FONT_THICKNESS)[0]
-                            text_width = max(text_width, text_size[0])
-                            text_height += text_size[1] + line_spacing
-                        text_height -= line_spacing
-
-                        text_start_x = box[2] + 10
-                        text_start_y = box_center_y - text_height // 2
-                        for i, line in enumerate(lines):
-                            text_size = cv2.getTextSize(line, FONT, FONT_SCALE, FONT_THICKNESS)[0]
-                            cv2.putText(frame, line, (text_start_x, text_start_y), FONT, FONT_SCALE, (255, 255, 255), FONT_THICKNESS)
-                            text_start_y += line_spacing + text_size[1]
-
-                        # Draw keypoints with different colors
-                        for i, kp in enumerate(keypoints):
-                            color = colors[i % len(colors)]  # Cycle through colors
-                            cv2.circle(frame, (int(kp[0]), int(kp[1])), 3, color, -1)
-
-                        # Draw lines for skeleton
-                        for start, end in skeleton:
-                            if start < len(keypoints) and end < len(keypoints):
-                                start_point = (int(keypoints[start][0]), int(keypoints[start][1]))
-                                end_point = (int(keypoints[end][0]), int(keypoints[end][1]))
-                                cv2.line(frame, start_point, end_point, colors[len(skeleton) % len(colors)], 2)  # Use a different color for skeleton lines
-                if frame_count > jump_data[id]["landing_frame"]:
-                    h = jump_data[id]["jump_height"]
-                    text = f"ID: {id}, Max Height: {h:.2f} cm, Launch velocity: {v_0:.2f} m/s \n"
-                    # put multi-line text on top of the frame by splitting the text on newline character
-                    lines = text.split('\n')
-                    line_spacing = 5
-                    text_width, text_height = 0, 0
-                    for line in lines:
-                        text_size = cv2.getTextSize(line, FONT, FONT_SCALE, FONT_THICKNESS)[0]
-                        text_width = max(text_width, text_size[0])
-                        text_height += text_size[1] + line_spacing
-                    text_height -= line_spacing
-                    text_start_x = 10
-                    text_start_y = 80
-                    for i, line in enumerate(lines):
-                        text_size = cv2.getTextSize(line, FONT, FONT_SCALE, FONT_THICKNESS)[0]
-                        cv2.putText(frame, line, (text_start_x, text_start_y), FONT, FONT_SCALE, (255, 255, 255), FONT_THICKNESS)
-                        text_start_y += line_spacing + text_size[1]
-
-
-        if show:                
-            cv2.imshow("Frame", frame)
-            if cv2.waitKey(1) == ord('q'):
+
+        with profiling.stage("render.draw"):
+            plan.draw(frame, frame_count)
+
+        if show:
+            with profiling.stage("render.show"):
+                cv2.imshow("Frame", frame)
+                key = cv2.waitKey(1)
+            if key == ord('q'):
                 break
-        out.write(frame)
+        with profiling.stage("render.encode"):
+            out.write(frame)
     video.release()
     out.release()
-    cv2.destroyAllWindows()
+    if show:
+        cv2.destroyAllWindows()